@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Throughput of the plain text BLAST parser (parser_to_bio_blast.blast_parse_txt).
+
+Parses the text BLAST outputs from test_func/test_data and synthetic multi-MB outputs made by repeating the hits
+ of a web BLAST export. With --reference, another implementation of the parser (e.g. the previous revision) is
+ timed too and the parsed records are checked to be identical:
+
+    git show HEAD~1:rna_blast_analyze/BR_core/parser_to_bio_blast.py > /tmp/parser_old.py
+    python benchmarks/bench_blast_parse.py --hits 5000 --reference /tmp/parser_old.py
+"""
+import argparse
+import glob
+import os
+import tempfile
+import time
+from importlib.machinery import SourceFileLoader
+
+from rna_blast_analyze.BR_core import parser_to_bio_blast
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'test_func', 'test_data')
+template = os.path.join(data_dir, 'blast_parse_web_multi_hit.txt')
+
+
+def make_synthetic(out_file, hits, queries):
+    """Web BLAST like output with given number of queries each with (at least) given number of hits."""
+    with open(template, 'r') as f:
+        text = f.read()
+    first_query = text.index('Query=')
+    first_hit = text.index('\n>', first_query) + 1
+    tail = text.index('\n  Database:', first_hit) + 1
+    head, query_head, body = text[:first_query], text[first_query:first_hit], text[first_hit:tail]
+
+    blocks = body.split('\n>')
+    n_blocks = len(blocks)
+    with open(out_file, 'w') as f:
+        f.write(head)
+        for q in range(queries):
+            f.write(query_head.replace('Query=', 'Query= synthetic_{}'.format(q), 1))
+            for i in range(hits):
+                block = blocks[i % n_blocks]
+                if not block.startswith('>'):
+                    block = '>' + block
+                f.write(block.rstrip('\n') + '\n\n')
+        f.write(text[tail:])
+
+
+def record_summary(record):
+    """Everything the parser sets on the records, comparable with ==."""
+    out = [vars(record)[k] for k in sorted(vars(record)) if k != 'alignments']
+    for alig in record.alignments:
+        out.append(sorted((k, v) for k, v in vars(alig).items() if k != 'hsps'))
+        for hsp in alig.hsps:
+            out.append(sorted(vars(hsp).items()))
+    return out
+
+
+def parse(parser, blast_file):
+    with open(blast_file, 'r') as f:
+        return list(parser.blast_parse_txt(f))
+
+
+def bench(name, parser, blast_file, repeat):
+    best = float('inf')
+    records = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        records = parse(parser, blast_file)
+        best = min(best, time.perf_counter() - t)
+    n_hits = sum(len(r.alignments) for r in records)
+    print('    {:<10} {:>8.2f} MB/s {:>10.0f} hits/s  ({:.3f} s)'.format(
+        name, os.path.getsize(blast_file) / best / 2**20, n_hits / best, best
+    ))
+    return records
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--hits', type=int, default=5000, help='hits per query of the synthetic output')
+    p.add_argument('--queries', type=int, default=2, help='number of queries of the synthetic output')
+    p.add_argument('--repeat', type=int, default=3)
+    p.add_argument('--reference', help='python file with other implementation of blast_parse_txt')
+    args = p.parse_args()
+
+    parsers = [('current', parser_to_bio_blast)]
+    if args.reference:
+        parsers.append(('reference', SourceFileLoader('parser_reference', args.reference).load_module()))
+
+    fd, synthetic = tempfile.mkstemp(prefix='rba_', suffix='_bench.txt')
+    os.close(fd)
+    try:
+        make_synthetic(synthetic, args.hits, args.queries)
+        files = sorted(glob.glob(os.path.join(data_dir, '*.txt')) + glob.glob(os.path.join(data_dir, '*.blastout')))
+        files = [f for f in files if os.path.basename(f) != 'config_test.txt'] + [synthetic]
+
+        for blast_file in files:
+            print('{} ({:.2f} MB)'.format(os.path.basename(blast_file), os.path.getsize(blast_file) / 2**20))
+            results = [bench(name, parser, blast_file, args.repeat) for name, parser in parsers]
+            if len(results) == 2:
+                if [record_summary(r) for r in results[0]] != [record_summary(r) for r in results[1]]:
+                    print('    parsed records differ from the reference')
+    finally:
+        os.remove(synthetic)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Throughput (pairs/s) of the structure distance backends used for selecting suboptimal structures.
+
+Each "hit" is a group of similar structures compared to one reference, as in predict_structures._helper_subopt.
+
+    python benchmarks/bench_distance.py --length 150 --hits 20 --subopt 20
+"""
+import argparse
+import random
+import shutil
+import time
+
+from rna_blast_analyze.BR_core.config import CONFIG
+from rna_blast_analyze.BR_core import par_distance_no_RNAlib
+from rna_blast_analyze.BR_core.tree_distance import DistanceEngine
+
+
+def random_structure(length, rng):
+    """Random dot-bracket of given length made of helices with hairpin loops of at least 3 nt."""
+    s = ['.'] * length
+    stack = []
+    i = 0
+    while i < length:
+        if stack and i - stack[-1] > 3 and rng.random() < 0.35:
+            s[i] = ')'
+            stack.pop()
+        elif length - i > len(stack) + 4 and rng.random() < 0.3:
+            s[i] = '('
+            stack.append(i)
+        i += 1
+    for j in stack:
+        s[j] = '.'
+    return ''.join(s)
+
+
+def _balanced(window):
+    depth = 0
+    for c in window:
+        depth += {'(': 1, ')': -1}.get(c, 0)
+        if depth < 0:
+            return False
+    return depth == 0
+
+
+def mutate(structure, rng, n=12):
+    """Similar structure with one window re-randomized (suboptimal structures usually differ locally)."""
+    for _ in range(100):
+        start = rng.randrange(max(1, len(structure) - n))
+        window = structure[start:start + n]
+        if _balanced(window):
+            return structure[:start] + random_structure(len(window), rng) + structure[start + len(window):]
+    return structure
+
+
+def make_data(length, hits, subopt, seed=0):
+    rng = random.Random(seed)
+    pairs = []
+    for _ in range(hits):
+        ref = random_structure(length, rng)
+        base = random_structure(length, rng)
+        for _ in range(subopt):
+            base = mutate(base, rng)
+            pairs.append((ref, base))
+    return pairs
+
+
+def bench(name, func, pairs):
+    t = time.perf_counter()
+    res = func(pairs)
+    elapsed = time.perf_counter() - t
+    print('{:<20} {:>10.1f} pairs/s  ({:.2f} s)'.format(name, len(pairs) / elapsed, elapsed))
+    return res
+
+
+def native(pairs):
+    out = []
+    engines = {}
+    for ref, s in pairs:
+        if ref not in engines:
+            engines[ref] = DistanceEngine(ref)
+        out.append(engines[ref].tree_edit_distances([s])[0])
+    return out
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--length', type=int, default=150)
+    p.add_argument('--hits', type=int, default=20)
+    p.add_argument('--subopt', type=int, default=20)
+    args = p.parse_args()
+
+    pairs = make_data(args.length, args.hits, args.subopt)
+    print('{} pairs, structure length {}'.format(len(pairs), args.length))
+
+    results = {}
+    if shutil.which('{}RNAdistance'.format(CONFIG.viennarna_path)):
+        results['subprocess'] = bench(
+            'RNAdistance/pair', lambda x: [par_distance_no_RNAlib.run_RNAdistance(i) for i in x], pairs
+        )
+        results['batch'] = bench('RNAdistance -Xf', par_distance_no_RNAlib.compute_distances, pairs)
+    else:
+        print('RNAdistance not found, skipping subprocess backends')
+
+    try:
+        from rna_blast_analyze.BR_core import par_distance_efective
+        results['rnalib'] = bench('RNAlib', par_distance_efective.compute_distances, pairs)
+    except ImportError:
+        print('RNAlib not found, skipping RNAlib backend')
+
+    results['native'] = bench('native', native, pairs)
+
+    ref = results['native']
+    for name, res in results.items():
+        if res != ref:
+            print('distances of {} differ from native'.format(name))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""Time of building the result table (BlastSearchRecompute.export_pandas_results) and of writing it as csv,
+ pandas pickle and (with pyarrow) Parquet and Arrow IPC, for several queries appended to one file.
+
+    python benchmarks/bench_export.py --hits 20000 --queries 4
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from bench_hit_copy import make_analyzed_hits
+from rna_blast_analyze.BR_core.output import table_output
+
+
+def make_query(iteration, n_hits, rng):
+    bsr = make_analyzed_hits(n_hits, 2, 200, 400, rng)
+    bsr.iteration = iteration
+    bsr.args.prediction_method = ['ss0', 'ss1']
+    for i, hit in enumerate(bsr.hits):
+        hit.source.annotations['extended_start'] = i
+        hit.source.annotations['extended_end'] = i + 200
+        hit.source.annotations['blast'][1].expect = 10 ** rng.uniform(-80, 1)
+        hit.source.annotations['blast'][1].bits = rng.uniform(20, 300)
+        hit.extension.annotations['score'] = None
+        hit.best_start, hit.best_end = 1, 200
+    return bsr
+
+
+def timed(name, func, *args):
+    t = time.perf_counter()
+    func(*args)
+    print('    {:<10} {:>8.3f} s'.format(name, time.perf_counter() - t))
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--hits', type=int, default=20000, help='hits per query')
+    p.add_argument('--queries', type=int, default=4)
+    args = p.parse_args()
+
+    rng = random.Random(0)
+    queries = [make_query(i, args.hits, rng) for i in range(args.queries)]
+    print('{} queries, {} hits each'.format(args.queries, args.hits))
+
+    timed('table', lambda: [q.export_pandas_results() for q in queries])
+
+    out_dir = tempfile.mkdtemp(prefix='rba_')
+    try:
+        timed('csv', lambda: [q.to_csv(os.path.join(out_dir, '{}.csv'.format(q.iteration))) for q in queries])
+        timed('pickle', lambda: [
+            q.to_pandas_dump(os.path.join(out_dir, '{}.pandas_dump'.format(q.iteration))) for q in queries
+        ])
+        if table_output.pyarrow is not None:
+            for ext in ('parquet', 'arrow'):
+                path = os.path.join(out_dir, 'all.' + ext)
+
+                def write():
+                    with table_output.shared_table_writers():
+                        for q in queries:
+                            q.to_table(path)
+                timed(ext, write)
+        for f in sorted(os.listdir(out_dir)):
+            print('    {:<16} {:>8.1f} MB'.format(f, os.path.getsize(os.path.join(out_dir, f)) / 2**20))
+    finally:
+        shutil.rmtree(out_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Time and peak memory of copying the analyzed hits of one query (BlastSearchRecompute) before repredicting
+ the structures with other parameters (deepcopy of the whole object vs. BlastSearchRecompute.snapshot).
+
+    python benchmarks/bench_hit_copy.py --hits 2000 --structures 4
+"""
+import argparse
+import random
+import time
+import tracemalloc
+from argparse import Namespace
+from copy import deepcopy
+
+from Bio.Blast.Record import HSP
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from rna_blast_analyze.BR_core.BA_methods import BlastSearchRecompute
+from rna_blast_analyze.BR_core.BA_support import Subsequences
+
+
+def random_seq(length, rng):
+    return ''.join(rng.choice('ACGU') for _ in range(length))
+
+
+def make_analyzed_hits(n_hits, n_structures, hit_length, source_length, rng):
+    query = SeqRecord(Seq(random_seq(hit_length, rng)), id='query')
+    bsr = BlastSearchRecompute(Namespace(threads=1, prediction_method=['rnafold']), query, 0)
+    for i in range(n_hits):
+        hsp = HSP()
+        hsp.query = random_seq(hit_length, rng)
+        hsp.sbjct = random_seq(hit_length, rng)
+        hsp.match = '|' * hit_length
+        hsp.query_start, hsp.query_end = 1, hit_length
+        hsp.sbjct_start, hsp.sbjct_end = 1, hit_length
+        source = SeqRecord(
+            Seq(random_seq(source_length, rng)),
+            id='uid:{}|hit_{}'.format(i, i),
+            annotations={'blast': ('hit_{}'.format(i), hsp), 'msgs': []},
+        )
+        hit = Subsequences(source)
+        hit.extension = SeqRecord(
+            Seq(random_seq(hit_length, rng)),
+            id=source.id,
+            annotations={'blast': source.annotations['blast'], 'msgs': [], 'sss': [], 'ambiguous': False},
+        )
+        for n in range(n_structures):
+            hit.extension.letter_annotations['ss{}'.format(n)] = '.' * hit_length
+            hit.extension.annotations['sss'].append('ss{}'.format(n))
+        bsr.hits.append(hit)
+    bsr.copy_hits()
+    return bsr
+
+
+def measure(func, obj):
+    tracemalloc.start()
+    t = time.perf_counter()
+    func(obj)
+    elapsed = time.perf_counter() - t
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--hits', type=int, default=2000)
+    p.add_argument('--structures', type=int, default=4, help='structures predicted for each hit')
+    p.add_argument('--length', type=int, default=200, help='length of the extended hits')
+    p.add_argument('--source-length', type=int, default=1000, help='length of the sequence retrieved for each hit')
+    args = p.parse_args()
+
+    bsr = make_analyzed_hits(args.hits, args.structures, args.length, args.source_length, random.Random(0))
+    print('{} hits, {} structures each'.format(args.hits, args.structures))
+    for name, func in (('deepcopy', deepcopy), ('snapshot', BlastSearchRecompute.snapshot)):
+        elapsed, peak = measure(func, bsr)
+        print('    {:<10} {:>8.3f} s {:>10.1f} MB peak'.format(name, elapsed, peak / 2**20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Time of filtering BLAST hits by e-value and bit score (filter_blast) with the per-hit list comprehensions
+ (previous implementation) and with the columns of hit_table.HitTable.
+
+    python benchmarks/bench_hit_filter.py --hits 50000
+"""
+import argparse
+import random
+import time
+
+from Bio.Blast.Record import HSP
+
+from rna_blast_analyze.BR_core.BA_support import blast_hit_getter_from_hits
+from rna_blast_analyze.BR_core.filter_blast import OPERATIONS, filter_by_bits, filter_by_eval
+
+
+def make_hits(n_hits, rng):
+    hits = []
+    for i in range(n_hits):
+        hsp = HSP()
+        hsp.expect = 10 ** rng.uniform(-80, 1)
+        hsp.bits = rng.uniform(20, 300)
+        hits.append(['hit_{}'.format(i), hsp])
+    return hits
+
+
+def filter_per_hit(blast_hitlist, getter, filter_conditions, attr):
+    result = blast_hitlist
+    for relation, condition in filter_conditions:
+        result = [h for h in result if OPERATIONS[relation](getattr(getter(h), attr), condition)]
+    return result
+
+
+def best_of(repeat, func, *args):
+    best = float('inf')
+    out = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        out = func(*args)
+        best = min(best, time.perf_counter() - t)
+    return best, out
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--hits', type=int, default=50000)
+    p.add_argument('--repeat', type=int, default=5)
+    args = p.parse_args()
+
+    hits = make_hits(args.hits, random.Random(0))
+    cases = [
+        ('eval <', 'expect', filter_by_eval, [('<', 1e-10)]),
+        ('eval > <', 'expect', filter_by_eval, [('>', 1e-60), ('<', 1e-5)]),
+        ('bits > <', 'bits', filter_by_bits, [('>', 30), ('<=', 200)]),
+    ]
+    print('{} hits'.format(args.hits))
+    for name, attr, func, conditions in cases:
+        t_old, old = best_of(args.repeat, filter_per_hit, hits, blast_hit_getter_from_hits, conditions, attr)
+        t_new, new = best_of(args.repeat, func, hits, blast_hit_getter_from_hits, conditions)
+        assert old == new
+        print('    {:<10} per hit {:>8.2f} ms   columns {:>8.2f} ms   ({} kept)'.format(
+            name, t_old * 1000, t_new * 1000, len(new)
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -179,6 +179,25 @@ def f_parser():
         type=str,
         help='Output html file with secondary structure pictures and other useful stuff.'
     )
+    output_group.add_argument(
+        '--html_report',
+        default='single',
+        choices=['single', 'paged'],
+        help=(
+            'Layout of the html output. single: one self-contained file,'
+            ' paged: small page with the hits stored in [html]_files directory and loaded when scrolled to'
+            ' (for large searches).'
+        )
+    )
+    output_group.add_argument(
+        '--html_pictures',
+        default='rnaplot',
+        choices=['rnaplot', 'lazy'],
+        help=(
+            'How the structure pictures in html output are made. rnaplot: drawn with RNAplot (cached between runs),'
+            ' lazy: drawn as arc diagrams by the browser when shown (smaller file, faster output).'
+        )
+    )
     misc_group.add_argument(
         '--threads',
         default=None,
@@ -191,6 +210,17 @@ def f_parser():
         default=None,
         help='Output in csv table, infered sequence and structure present.'
     )
+    output_group.add_argument(
+        '--table',
+        type=str,
+        metavar='PATH',
+        default=None,
+        help=(
+            'Output the csv table in columnar format, Parquet (.parquet) or Arrow IPC (.arrow, .feather).'
+            ' Results of all queries are written to one file, each query as a separate row group'
+            ' (in the order of the queries). Requires pyarrow.'
+        )
+    )
     output_group.add_argument(
         '--json',
         type=str,
@@ -230,6 +260,16 @@ def f_parser():
         metavar='PATH',
         help='Provide config file if tools and data are in non-default paths.'
     )
+    parameters_group.add_argument(
+        '--cache_dir',
+        type=str,
+        default=None,
+        metavar='PATH',
+        help=(
+            'Directory for persistent caches of computed results. Overrides "cache_dir" from the config file.'
+            ' Give empty string to disable the caches. (default: $XDG_CACHE_HOME/rboAnalyzer)'
+        )
+    )
     parameters_group.add_argument(
         '-pm',
         '--prediction_method',
@@ -489,6 +529,7 @@ def lunch_with_args(args):
     from rna_blast_analyze.BR_core.luncher import lunch_computation
     from rna_blast_analyze.BR_core.convert_classes import blastsearchrecompute2dict
     from rna_blast_analyze.BR_core.cmalign import RfamInfo
+    from rna_blast_analyze.BR_core.checkpoint import CheckpointStore
 
     logger = logging.getLogger('rboAnalyzer')
 
@@ -519,9 +560,13 @@ def lunch_with_args(args):
     logger.info('BLAST db:   {}'.format(args.blast_db))
     if args.config_file:
         logger.info('configfile: {}'.format(args.config_file))
+    if args.cache_dir is not None:
+        logger.info('cache_dir:  {}'.format(args.cache_dir))
 
     # ========= load optional cfg file =========
     CONFIG.override(tools_paths(config_file=args.config_file))
+    if args.cache_dir is not None:
+        CONFIG.data_paths['cache_dir'] = args.cache_dir
 
     # ========= check rfam =========
     if not args.download_rfam and not cmalign.check_rfam_present():
@@ -551,14 +596,10 @@ def lunch_with_args(args):
     blast_dir = os.path.dirname(args.blast_in)
     if blast_dir == '':
         blast_dir = os.getcwd()
-    potential_matches = [f for f in os.listdir(blast_dir) if f == blast_fn]
-    if len(potential_matches) == 0:
-        with open(args.blast_in + '.r-' + args.sha1[:10], 'w') as f:
-            json.dump(None, f)
+    checkpoint = CheckpointStore(os.path.join(blast_dir, blast_fn), sha1=args.sha1)
 
     _, results = lunch_computation(args)
-    with open(os.path.join(blast_dir, blast_fn), 'w') as f:
-        json.dump([blastsearchrecompute2dict(r) for r in results], f, indent=2)
+    checkpoint.compact([(r.iteration, blastsearchrecompute2dict(r)) for r in results])
 
     return results
 
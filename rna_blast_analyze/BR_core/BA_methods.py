@@ -2,9 +2,10 @@ import copy
 import time
 import pandas as pd
 import logging
-from copy import deepcopy
 
-from rna_blast_analyze.BR_core.BA_support import Subsequences, get_hit_n, annotate_ambiguos_base
+from rna_blast_analyze.BR_core.BA_support import Subsequences, get_hit_n, annotate_ambiguos_base, snapshot_record
+from rna_blast_analyze.BR_core.hit_table import HitTable
+from rna_blast_analyze.BR_core.output.table_output import write_table
 
 ml = logging.getLogger('rboAnalyzer')
 
@@ -31,13 +32,13 @@ class BlastSearchRecompute(object):
         annotate_ambiguos_base(self.query)
 
     def copy_hits(self):
-        hits = deepcopy(self.hits)
+        hits = self.hits.snapshot()
         for hit in hits:
             annotate_ambiguos_base(hit.extension)
         self.__all_hits = hits
 
     def get_all_hits(self):
-        return deepcopy(self.__all_hits)
+        return self.__all_hits.snapshot()
 
     def update_hit_stuctures(self):
         b_dict = {get_hit_n(h): h for h in self.hits}
@@ -68,107 +69,55 @@ class BlastSearchRecompute(object):
             self.export_pandas_results()
         self.pandas.to_csv(output_file)
 
+    def to_table(self, output_file):
+        """write to Parquet or Arrow file, appended to the other queries if within output.table_output context"""
+        if self.pandas is None:
+            self.export_pandas_results()
+        write_table(output_file, self.pandas, self.iteration)
+
     def export_pandas_results(self):
         self.stop_timer()
 
-        export_columns = [
-            'blast_query',
-            'subject',
-            'bstart',
-            'bend',
-            'blast_bits',
-            'best_sequence',
-            'estart',
-            'eend',
-            'blast_eval',
-            'query_start',
-            'query_end',
-            'b_e_start',
-            'b_e_end',
-            'locarna_score',
-        ]
-
         # build export DataFrame
-        # add prediction method names ad columns to final DataFrame (add lists to "data")
-        #  each prediction method has its own columns
+        # add prediction method names ad columns to final DataFrame
+        #  each prediction method has its own column
         #  unused columns are not listed
-        data = dict()
         if isinstance(self.args.prediction_method, str):
             self.args.prediction_method = [self.args.prediction_method,]
 
-        for col in export_columns + self.args.prediction_method:
-            data[col] = []
-
+        hits = []
         for i, hit in enumerate(self.hits):
             if hit.extension is None:
                 ml.warning("Skipping exporting hit {}, which was not extended.".format(i))
                 continue
+            hits.append(hit)
+
+        # the columns are built one by one, BLAST values are read as NumPy columns
+        table = HitTable(hits)
+        data = {
+            'blast_query': [self.query.id] * len(hits),
+            'subject': [hit.source.id for hit in hits],
+            'bstart': table['sbjct_start'],
+            'bend': table['sbjct_end'],
+            'blast_bits': table['bits'],
+            'best_sequence': [str(hit.extension.seq) for hit in hits],
+            'estart': [hit.best_start for hit in hits],
+            'eend': [hit.best_end for hit in hits],
+            'blast_eval': table['expect'],
+            'query_start': table['query_start'],
+            'query_end': table['query_end'],
+            'b_e_start': [hit.source.annotations['extended_start'] for hit in hits],
+            'b_e_end': [hit.source.annotations['extended_end'] for hit in hits],
+            'locarna_score': [hit.extension.annotations['score'] for hit in hits],
+        }
+        for method in self.args.prediction_method:
+            # key (prediction method name) is missing from letter annotations, but it was requested and
+            #  should be predicted. This means that something went wrong with the prediction and it was
+            #  logged with stdout. However, we need to include something to the table output
+            data[method] = [
+                hit.extension.letter_annotations.get(method, 'PREDICTION FAILED') for hit in hits
+            ]
 
-            for k in data.keys():
-                if k == 'blast_query':
-                    # query name
-                    data['blast_query'].append(self.query.id)
-                    continue
-                elif k == 'locarna_score':
-                    data['locarna_score'].append(hit.extension.annotations['score'])
-                    continue
-                elif k == 'b_e_start':
-                    data['b_e_start'].append(hit.source.annotations['extended_start'])
-                    continue
-                elif k == 'b_e_end':
-                    data['b_e_end'].append(hit.source.annotations['extended_end'])
-                    continue
-                elif k == 'query_start':
-                    data['query_start'].append(hit.source.annotations['blast'][1].query_start)
-                    continue
-                elif k == 'query_end':
-                    data['query_end'].append(hit.source.annotations['blast'][1].query_end)
-                    continue
-                elif k == 'blast_eval':
-                    data['blast_eval'].append(hit.source.annotations['blast'][1].expect)
-                    continue
-                elif k == 'blast_bits':
-                    data['blast_bits'].append(hit.source.annotations['blast'][1].bits)
-                    continue
-                elif k == 'subject':
-                    # subject sequence name
-                    data['subject'].append(hit.source.id)
-                    continue
-                elif k == 'bstart':
-                    # blast start
-                    data['bstart'].append(hit.source.annotations['blast'][1].sbjct_start)
-                    continue
-                elif k == 'bend':
-                    # blast end
-                    data['bend'].append(hit.source.annotations['blast'][1].sbjct_end)
-                    continue
-                elif k == 'estart':
-                    # extended start
-                    data['estart'].append(hit.best_start)
-                    continue
-                elif k == 'eend':
-                    # extended end
-                    data['eend'].append(hit.best_end)
-                    continue
-                elif k == 'best_sequence':
-                    # selected sequence
-                    data['best_sequence'].append(str(hit.extension.seq))
-                    continue
-                elif hasattr(hit, k):
-                    data[k].append(getattr(hit, k))
-                    continue
-                elif k in hit.extension.letter_annotations:
-                    # add secondary structure
-                    data[k].append(hit.extension.letter_annotations[k])
-                else:
-                    if k in self.args.prediction_method:
-                        # key (prediction method name) is missing from letter annotations, but it was requested and
-                        #  should be predicted. This means that something went wrong with the prediction and it was
-                        #  logged with stdout. However, we need to include something to the table output
-                        data[k].append('PREDICTION FAILED')
-                    else:
-                        raise Exception('key not found')
-                pass
         self.pandas = pd.DataFrame(data)
         return self.pandas
 
@@ -205,6 +154,23 @@ class BlastSearchRecompute(object):
         new.multi_query = self.multi_query
         return new
 
+    def snapshot(self):
+        """
+        copy in which the args, hits and their structures can be changed independently of this object
+         (e.g. prediction with different parameters), see Subsequences.snapshot
+        """
+        new = copy.copy(self)
+        new.args = copy.copy(self.args)
+        new.query = snapshot_record(self.query)
+        new.hits = self.hits.snapshot()
+        new.hits_failed = self.hits_failed.snapshot()
+        new.__all_hits = self.__all_hits.snapshot()
+        new.msgs = list(self.msgs)
+        new.best_matching_model = copy.copy(self.best_matching_model)
+        if self.pandas is not None:
+            new.pandas = self.pandas.copy()
+        return new
+
 
 class HitList(list):
     """
@@ -222,6 +188,13 @@ class HitList(list):
 
         super(HitList, self).append(p_object)
 
+    def snapshot(self):
+        return HitList(h.snapshot() for h in self)
+
+    def table(self):
+        """columnar (NumPy) view of the BLAST values of the hits, see hit_table.HitTable"""
+        return HitTable(self)
+
 
 def to_tab_delim_line_simple(input_args):
     A = vars(input_args)
@@ -8,7 +8,9 @@ from subprocess import call
 from tempfile import mkstemp, TemporaryFile
 import shlex
 import sys
+from copy import copy
 
+import numpy as np
 from Bio import SeqIO, AlignIO
 from Bio.Alphabet import IUPAC
 from Bio.Blast import NCBIXML
@@ -314,6 +316,31 @@ def blast_in(blast_input_file, b='guess'):
         sys.exit(1)
 
 
+def guess_blast_format(handle, log=True):
+    """
+    guess format of the BLAST output from the first line, the handle is returned to the beginning
+    :returns 'plain', 'xml' or None
+    """
+    l = handle.readline()
+    handle.seek(0, 0)     # seek to begining
+    if isinstance(l, bytes):
+        l = l.decode(errors='replace')
+    if re.search(r'^BLASTN \d+\.\d+\.\d+', l):
+        # blast object prob plaintext
+        if log:
+            ml.info('Inferred BLAST format: txt.')
+        return 'plain'
+    elif re.search(r'<\?xml version', l):
+        # run xml parser
+        if log:
+            ml.info('Inferred BLAST format: xml.')
+        return 'xml'
+    else:
+        if log:
+            ml.error('Could not guess the BLAST format, preferred format is NCBI xml.')
+        return None
+
+
 def blast_in_handle(handle, b='guess', log=True):
     """
     gueses blast format
@@ -323,22 +350,8 @@ def blast_in_handle(handle, b='guess', log=True):
         ml.debug(fname())
     multiq = []
     if b == 'guess':
-        # gues the format
-        l = handle.readline()
-        handle.seek(0, 0)     # seek to begining
-        if re.search(r'^BLASTN \d+\.\d+\.\d+', l):
-            # blast object prob plaintext
-            b_type = 'plain'
-            if log:
-                ml.info('Inferred BLAST format: txt.')
-        elif re.search(r'<\?xml version', l):
-            # run xml parser
-            b_type = 'xml'
-            if log:
-                ml.info('Inferred BLAST format: xml.')
-        else:
-            if log:
-                ml.error('Could not guess the BLAST format, preferred format is NCBI xml.')
+        b_type = guess_blast_format(handle, log=log)
+        if b_type is None:
             return None
     else:
         b_type = b
@@ -379,6 +392,30 @@ class Subsequences(object):
         self.best_end = None
         self.templates = {}
 
+    def snapshot(self):
+        """
+        copy of the hit in which the extension annotations (structures, msgs, ...) can be changed independently
+        the source record (with BLAST HSP) and the sequences are shared, they are not changed after the extension
+        """
+        new = copy(self)
+        new.templates = dict(self.templates)
+        if self.extension is not None:
+            new.extension = snapshot_record(self.extension)
+        return new
+
+
+def snapshot_record(rec):
+    """
+    copy of SeqRecord for changing its annotations and letter annotations (per-method structures)
+    sequence and annotation values are shared, only mutable containers (list, dict, set) in annotations are copied
+    """
+    new = copy(rec)
+    new.annotations = {
+        k: copy(v) if isinstance(v, (list, dict, set)) else v for k, v in rec.annotations.items()
+    }
+    new.letter_annotations = dict(rec.letter_annotations)
+    return new
+
 
 def blasthsp2pre(bhsp):
     """
@@ -499,6 +536,35 @@ def non_redundant_seqs(sequences: list) -> list:
     return out
 
 
+def dedup_seqs(sequences: list) -> tuple:
+    """
+    find distinct sequences so each of them is processed only once
+    :param sequences: list of SeqRecords
+    :return: (unique, positions) where unique is the list of first sequence encountered for each distinct sequence
+     and positions[i] is index to unique for sequences[i]
+    """
+    ml.debug(fname())
+    index = dict()
+    unique = []
+    positions = []
+    for seq in sequences:
+        str_seq = str(seq.seq)
+        if str_seq not in index:
+            index[str_seq] = len(unique)
+            unique.append(seq)
+        positions.append(index[str_seq])
+
+    return unique, positions
+
+
+def dedup_msg(n_unique, n_total):
+    if n_total == 0:
+        return 'No sequences to predict.'
+    return 'Structures predicted for {} unique of {} sequences ({:.1f}% duplicates).'.format(
+        n_unique, n_total, 100 * (n_total - n_unique) / n_total
+    )
+
+
 def parse_one_rec_in_multiline_structure(fh):
     """
     in fasta-like multiple structures file iterates through records one by one
@@ -524,9 +590,9 @@ def filter_ambiguous_seqs_from_list(seqlist):
 
 
 def filter_by_length_diff(sequences, ref_len, len_diff_):
-    return [
-        seq for seq in sequences if ref_len * (1 - len_diff_) < len(seq) < ref_len * (1 + len_diff_)
-    ]
+    lengths = np.fromiter((len(seq) for seq in sequences), dtype=np.int64, count=len(sequences))
+    keep = (ref_len * (1 - len_diff_) < lengths) & (lengths < ref_len * (1 + len_diff_))
+    return [sequences[i] for i in np.flatnonzero(keep)]
 
 
 def sel_seq_simple(all_seqs, query, len_diff):
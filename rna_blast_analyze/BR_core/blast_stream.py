@@ -0,0 +1,173 @@
+"""Lazy reading of the BLAST output paired with the query sequences, one query at a time.
+
+The byte offsets of the query records in the BLAST output are found by a scan of the raw file (without parsing)
+ and stored next to the checkpoint file, so on resume the reading can start at the first unfinished query.
+"""
+import json
+import logging
+import mmap
+import os
+from tempfile import mkstemp
+
+from Bio import SeqIO
+from Bio.Blast import NCBIXML
+
+from rna_blast_analyze.BR_core.BA_support import guess_blast_format
+from rna_blast_analyze.BR_core.parser_to_bio_blast import blast_parse_txt
+from rna_blast_analyze.BR_core import exceptions
+
+ml = logging.getLogger('rboAnalyzer')
+
+INDEX_VERSION = 1
+
+
+def resolve_blast_format(blast_file, b_type='guess'):
+    if b_type != 'guess':
+        return b_type
+    with open(blast_file, 'r') as f:
+        return guess_blast_format(f)
+
+
+def _find_all(mm, pattern):
+    offsets = []
+    pos = mm.find(pattern)
+    while pos != -1:
+        offsets.append(pos)
+        pos = mm.find(pattern, pos + 1)
+    return offsets
+
+
+def build_offset_index(blast_file, b_type):
+    """Find byte offsets of the query records (<Iteration> elements of xml or "Query=" lines of txt)."""
+    st = os.stat(blast_file)
+    index = {
+        'version': INDEX_VERSION,
+        'format': b_type,
+        'size': st.st_size,
+        'mtime': st.st_mtime,
+        'offsets': [],
+        'seekable': True,
+    }
+    if st.st_size == 0:
+        return index
+
+    with open(blast_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if b_type == 'xml':
+            index['offsets'] = _find_all(mm, b'<Iteration>')
+            # output of old BLAST (one xml document per query) can't be continued with the header of the first one
+            index['seekable'] = mm.find(b'<?xml', 1) == -1
+        else:
+            index['offsets'] = [0] if mm[:6] == b'Query=' else []
+            index['offsets'] += [i + 1 for i in _find_all(mm, b'\nQuery=')]
+    return index
+
+
+def load_offset_index(blast_file, b_type, index_file):
+    """Return offset index of the BLAST file, read from the index_file if it is up to date, else build and save it."""
+    st = os.stat(blast_file)
+    try:
+        with open(index_file, 'r') as f:
+            index = json.load(f)
+        if (index.get('version'), index.get('format'), index.get('size'), index.get('mtime')) == \
+                (INDEX_VERSION, b_type, st.st_size, st.st_mtime):
+            return index
+    except (OSError, ValueError):
+        pass
+
+    index = build_offset_index(blast_file, b_type)
+    try:
+        fd, tmp_file = mkstemp(prefix='.rba_', suffix='_idx', dir=os.path.dirname(os.path.abspath(index_file)))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_file, index_file)
+    except OSError as e:
+        ml.debug('Failed to save BLAST offset index: {}'.format(str(e)))
+    return index
+
+
+class _PrefixedReader(object):
+    """Read-only file-like object returning the prefix followed by the rest of the handle."""
+    def __init__(self, prefix, handle):
+        self.prefix = prefix
+        self.handle = handle
+
+    def read(self, size=-1):
+        if not self.prefix:
+            return self.handle.read(size)
+        if size < 0:
+            out, self.prefix = self.prefix + self.handle.read(), b''
+            return out
+        out, self.prefix = self.prefix[:size], self.prefix[size:]
+        if len(out) < size:
+            out += self.handle.read(size - len(out))
+        return out
+
+
+def iter_blast_records(blast_file, b_type, start=0, index=None):
+    """Yield BLAST records one by one, starting with the record number "start".
+    With the offset index, the records before start are not read at all.
+    """
+    if start and index is not None and index['seekable'] and start < len(index['offsets']):
+        offsets = index['offsets']
+        if b_type == 'xml':
+            with open(blast_file, 'rb') as f:
+                header = f.read(offsets[0])
+                f.seek(offsets[start])
+                for record in NCBIXML.parse(_PrefixedReader(header, f)):
+                    yield record
+        else:
+            with open(blast_file, 'r') as f:
+                for record in blast_parse_txt(f, start_offset=offsets[start]):
+                    yield record
+        return
+
+    with open(blast_file, 'r') as f:
+        if b_type == 'xml':
+            records = NCBIXML.parse(f)
+        elif b_type == 'plain':
+            records = blast_parse_txt(f)
+        else:
+            raise exceptions.ParsingError('BLAST type not known: allowed types: plain, xml, guess')
+        for i, record in enumerate(records):
+            if i >= start:
+                yield record
+
+
+def count_fasta_records(fasta_file):
+    n = 0
+    with open(fasta_file, 'r') as f:
+        for line in f:
+            if line.startswith('>'):
+                n += 1
+    return n
+
+
+def _count_mismatch(n_blast, n_query):
+    return exceptions.ParsingError(
+        'Number of query sequences in provided BLAST output file ({}) does not match number of query sequences'
+        ' in query FASTA file ({}).'.format(n_blast, n_query)
+    )
+
+
+def iter_queries(blast_file, query_file, b_type, start=0, index=None):
+    """Yield (iteration, BLAST record, query SeqRecord) pairing BLAST records with query sequences lazily.
+
+    BLAST records of iterations before start are not read, None is yielded instead.
+    The numbers of BLAST records and query sequences are checked as they are read,
+     ParsingError is raised when one of them is exhausted before the other.
+    """
+    records = iter_blast_records(blast_file, b_type, start=start, index=index)
+    n_query = 0
+    for iteration, query in enumerate(SeqIO.parse(query_file, 'fasta')):
+        n_query += 1
+        if iteration < start:
+            yield iteration, None, query
+            continue
+        bhp = next(records, None)
+        if bhp is None:
+            raise _count_mismatch(iteration, '{} or more'.format(n_query))
+        yield iteration, bhp, query
+
+    # when all records were skipped, the count was checked before (with the index or in the previous run)
+    if n_query > start and next(records, None) is not None:
+        raise _count_mismatch('more than {}'.format(n_query), n_query)
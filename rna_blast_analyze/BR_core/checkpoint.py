@@ -0,0 +1,240 @@
+import json
+import logging
+import os
+import re
+import threading
+from tempfile import mkstemp
+
+ml = logging.getLogger('rboAnalyzer')
+
+MAGIC = 'rba-checkpoint'
+VERSION = 1
+
+QUERY = 'Q'
+PREDICTION = 'P'
+ALIGNMENT = 'A'
+CMSCAN = 'C'
+
+
+class CheckpointStore(object):
+    """Append-only store for the [BLAST FILE].r-[HASH] backup data.
+
+    The file starts with a header line followed by records, one record per line:
+        Q<tab>iteration<tab>json  - whole query data (BlastSearchRecompute dict) after the extension
+        P<tab>iteration<tab>json  - structures predicted by one method (delta over the query record)
+        A<tab>iteration<tab>json  - one finished extension (LocARNA alignment) of query which is not completed yet
+        C<tab>iteration<tab>json  - cmscan table rows of query which is not completed yet
+
+    Only the delta is written after each computed step. Records are indexed by byte offset when the file is opened
+    and decoded only when the query data is requested. Line which was not fully written (crash during write)
+    is removed when the file is opened.
+
+    Files in the previous (single json document) format are migrated on open.
+    """
+    def __init__(self, path, sha1=None):
+        self.path = path
+        self.sha1 = sha1
+        self._index = {}
+        self._alignments = {}
+        self._cmscan = {}
+        # queries may be computed concurrently
+        self._lock = threading.Lock()
+
+        if not os.path.isfile(path) or os.path.getsize(path) == 0:
+            self._write_new([])
+        elif not self._is_store():
+            self._migrate()
+
+        self._build_index()
+
+    def _is_store(self):
+        with open(self.path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC.encode()
+
+    @staticmethod
+    def _header(sha1):
+        return '{}\t{}\t{}\n'.format(MAGIC, VERSION, sha1 if sha1 else '')
+
+    @staticmethod
+    def _record(kind, iteration, data):
+        # json.dumps escapes newlines, so one record always occupies exactly one line
+        return '{}\t{}\t{}\n'.format(kind, iteration, json.dumps(data))
+
+    def _write_new(self, records):
+        """Atomically replace the store with records [(iteration, query_data), ...]."""
+        fd, tmp_file = mkstemp(prefix='.rba_', suffix='_ckpt', dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self._header(self.sha1))
+                for iteration, data in records:
+                    f.write(self._record(QUERY, iteration, data))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.path)
+        except BaseException:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+
+    def _migrate(self):
+        with open(self.path, 'r') as f:
+            saved = json.load(f)
+
+        if saved is None:
+            saved = []
+
+        records = [(i, data) for i, data in enumerate(saved) if data is not None]
+        for _, data in records:
+            # the first record decides the hash, mismatch is reported by the caller
+            self.sha1 = data['args']['sha1']
+            break
+
+        msg = 'Migrating backup file {} to the checkpoint format.'.format(self.path)
+        ml.info(msg)
+        self._write_new(records)
+
+    def _build_index(self):
+        self._index = {}
+        self._alignments = {}
+        self._cmscan = {}
+        with open(self.path, 'rb') as f:
+            header = f.readline().decode().rstrip('\n').split('\t')
+            if header[0] != MAGIC or int(header[1]) != VERSION:
+                raise ValueError('Unknown checkpoint file format: {}'.format(self.path))
+            if header[2]:
+                self.sha1 = header[2]
+
+            offset = f.tell()
+            incomplete = False
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # unfinished write
+                    incomplete = True
+                    break
+                kind, iteration, _ = line.split(b'\t', 2)
+                self._add_to_index(kind.decode(), int(iteration), offset)
+                offset += len(line)
+
+        if incomplete:
+            # the next record must not be appended to the unfinished line
+            ml.warning('Removing incomplete record at the end of {}.'.format(self.path))
+            os.truncate(self.path, offset)
+
+    def _add_to_index(self, kind, iteration, offset):
+        if kind == QUERY:
+            # new query record invalidates all previous data of the query
+            self._index[iteration] = [offset]
+            self._alignments.pop(iteration, None)
+        elif kind == PREDICTION and iteration in self._index:
+            self._index[iteration].append(offset)
+        elif kind == ALIGNMENT and iteration not in self._index:
+            self._alignments.setdefault(iteration, []).append(offset)
+        elif kind == CMSCAN:
+            self._cmscan[iteration] = offset
+
+    def _append(self, kind, iteration, data):
+        line = self._record(kind, iteration, data).encode()
+        with self._lock:
+            with open(self.path, 'ab') as f:
+                offset = f.tell()
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._add_to_index(kind, iteration, offset)
+
+    def __contains__(self, iteration):
+        return iteration in self._index
+
+    def iterations(self):
+        return sorted(self._index.keys())
+
+    def _read(self, offsets):
+        records = []
+        with open(self.path, 'rb') as f:
+            for offset in offsets:
+                f.seek(offset)
+                records.append(json.loads(f.readline().split(b'\t', 2)[2].decode()))
+        return records
+
+    def load(self, iteration):
+        """Return query data dict (as saved by save_query) with all prediction deltas applied or None."""
+        if iteration not in self._index:
+            return None
+
+        records = self._read(self._index[iteration])
+        data = records[0]
+        for delta in records[1:]:
+            apply_prediction(data, delta)
+        return data
+
+    def save_query(self, iteration, data):
+        """Save whole query data, overriding anything saved for the query before."""
+        self._append(QUERY, iteration, data)
+
+    def save_prediction(self, iteration, delta):
+        """Save structures predicted by one method, see prediction_delta."""
+        if iteration not in self._index:
+            raise KeyError('No query data saved for iteration {}.'.format(iteration))
+        self._append(PREDICTION, iteration, delta)
+
+    def save_alignment(self, iteration, key, data):
+        """Save one finished extension of the query before the whole query data are saved."""
+        self._append(ALIGNMENT, iteration, {'key': key, 'data': data})
+
+    def load_alignments(self, iteration):
+        """Return {key: data} of extensions saved by save_alignment for query which was not completed."""
+        return {r['key']: r['data'] for r in self._read(self._alignments.get(iteration, []))}
+
+    def save_cmscan(self, iteration, rows):
+        """Save cmscan table rows of the query searched before the computation of the query started."""
+        self._append(CMSCAN, iteration, rows)
+
+    def load_cmscan(self, iteration):
+        """Return cmscan table rows saved by save_cmscan or None."""
+        if iteration not in self._cmscan:
+            return None
+        return self._read([self._cmscan[iteration]])[0]
+
+    def compact(self, records):
+        """Replace the store content with final query data [(iteration, data), ...]."""
+        self._write_new(records)
+        self._build_index()
+
+
+def _hit_key(hit_dict):
+    return int(re.split('[|:]', hit_dict['source']['id'])[1])
+
+
+def prediction_delta(pkey, sha1, hits, msgs):
+    """Build the prediction record from hits (Subsequences) after the pkey prediction was merged.
+
+    Only values changed by prediction are stored: the pkey structure, 'sss', 'msgs' and 'sha1' annotations.
+    """
+    delta_hits = {}
+    for hit in hits:
+        ext = hit.extension
+        delta_hits[str(int(re.split('[|:]', hit.source.id)[1]))] = {
+            'structure': ext.letter_annotations.get(pkey, None),
+            'annotations': {k: ext.annotations[k] for k in ('sss', 'msgs', 'sha1') if k in ext.annotations},
+        }
+    return {
+        'method': pkey,
+        'sha1': sha1,
+        'hits': delta_hits,
+        'msgs': msgs,
+    }
+
+
+def apply_prediction(data, delta):
+    """Apply prediction record to query data dict in place."""
+    pkey = delta['method']
+    for hit_dict in data['hits'] + data.get('__all_hits', []):
+        d = delta['hits'].get(str(_hit_key(hit_dict)), None)
+        if d is None or hit_dict['extension'] is None:
+            continue
+        ext = hit_dict['extension']
+        if d['structure'] is not None:
+            ext['letter_annotations'][pkey] = d['structure']
+        ext['annotations'].update(d['annotations'])
+    data['msgs'] = delta['msgs']
+    return data
@@ -0,0 +1,224 @@
+"""Store of covariance models and of the data derived from them.
+
+Single models extracted from RFAM are kept in the cm_models directory of the cache_dir as [sha1 of content].cm,
+ the "cm_models" cache maps (RFAM release, model name) to the content hash. The reference structure (cmemit -a)
+ and the cmemit samples are cached by the content hash of any CM file (RFAM, user provided or built by RSEARCH).
+
+Files from the store are shared by the queries. They are acquired by fetch_model and given back with release,
+ which removes only files not belonging to the store (temporary files). Acquired file is held open with shared
+ lock (flock), so it is not removed by other runs using the same cache_dir. Files which are not locked are removed
+ from the store when its size exceeds MODEL_STORE_SIZE, the least recently used first.
+When the cache is disabled, the models are extracted to temporary files as before.
+"""
+import os
+import re
+import fcntl
+import logging
+import threading
+from hashlib import sha1
+from tempfile import mkstemp
+
+from rna_blast_analyze.BR_core.BA_support import remove_one_file_with_try
+from rna_blast_analyze.BR_core.cmalign import RfamInfo, run_cmfetch, run_cmfetch_index, check_if_cmfetch_indexed, \
+    run_cmemit, extract_ref_from_cm, cmscan_fingerprint
+from rna_blast_analyze.BR_core.config import CONFIG
+from rna_blast_analyze.BR_core import exceptions
+from rna_blast_analyze.BR_core.result_cache import open_cache, cache_key
+
+ml = logging.getLogger('rboAnalyzer')
+
+# 500 MB, all RFAM models take about 400 MB
+MODEL_STORE_SIZE = 5 * 10**8
+
+_lock = threading.Lock()
+# {path of model in the store: [number of users, locked file object]}
+_refcount = {}
+
+
+def _store_dir():
+    if not CONFIG.cache_dir:
+        return None
+    d = os.path.join(CONFIG.cache_dir, 'cm_models')
+    try:
+        os.makedirs(d, exist_ok=True)
+    except OSError as e:
+        ml.info('Model store is not available: {}'.format(str(e)))
+        return None
+    return d
+
+
+def cm_hash(cm_file):
+    h = sha1()
+    with open(cm_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _acquire(path):
+    """Count the user of the model, raises OSError if the model was removed from the store."""
+    with _lock:
+        if path in _refcount:
+            _refcount[path][0] += 1
+        else:
+            f = open(path, 'rb')
+            try:
+                fcntl.flock(f, fcntl.LOCK_SH)
+                # the file could be removed by other run before it was locked
+                if os.fstat(f.fileno()).st_ino != os.stat(path).st_ino:
+                    raise FileNotFoundError(path)
+            except BaseException:
+                f.close()
+                raise
+            _refcount[path] = [1, f]
+        # the modification time orders the models for pruning
+        os.utime(path)
+    return path
+
+
+def release(cm_file):
+    """Give back model obtained by fetch_model (or any CM file which is not needed anymore).
+    Files outside the store are removed.
+    """
+    if cm_file is None:
+        return
+    with _lock:
+        if cm_file in _refcount:
+            _refcount[cm_file][0] -= 1
+            if _refcount[cm_file][0] <= 0:
+                _refcount.pop(cm_file)[1].close()
+            return
+    remove_one_file_with_try(cm_file)
+
+
+def _store_files(store_dir):
+    """Return [(mtime, size, path)] of the models in the store, temporary files (being written) are skipped."""
+    files = []
+    for name in os.listdir(store_dir):
+        path = os.path.join(store_dir, name)
+        if name.endswith('.cm') and not name.startswith('.') and os.path.isfile(path):
+            st = os.stat(path)
+            files.append((st.st_mtime, st.st_size, path))
+    return files
+
+
+def store_stats(store_dir):
+    """Return number of models and size (in bytes) of the store."""
+    files = _store_files(store_dir)
+    return {'models': len(files), 'size': sum(f[1] for f in files)}
+
+
+def prune(store_dir, max_size=MODEL_STORE_SIZE):
+    """Remove the least recently used models which are not in use (by any process) until the store size
+     is below max_size.
+    """
+    files = _store_files(store_dir)
+    total = sum(f[1] for f in files)
+    removed = 0
+    with _lock:
+        for _, size, path in sorted(files):
+            if total <= max_size:
+                break
+            if path in _refcount:
+                continue
+            try:
+                with open(path, 'rb') as f:
+                    # the model is used by other run
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+    return removed
+
+
+def _ensure_index(rfam):
+    with _lock:
+        if not check_if_cmfetch_indexed(rfam.file_path):
+            try:
+                run_cmfetch_index(rfam.file_path)
+            except (exceptions.CmfetchException, OSError) as e:
+                # cmfetch works without the index, only slower
+                ml.warning('RFAM file is not indexed: {}'.format(str(e)))
+
+
+def fetch_model(model_name, rfam=None, timeout=None):
+    """
+    Return CM file with the RFAM model, the file must be given back with release.
+    :param model_name: name of the model in RFAM
+    :return: path
+    """
+    if rfam is None:
+        rfam = RfamInfo()
+
+    store_dir = _store_dir()
+    cache = open_cache('cm_models')
+    if store_dir is None or cache is None:
+        return run_cmfetch(rfam.file_path, model_name, timeout=timeout)
+
+    key = cache_key('cmfetch', cmscan_fingerprint(rfam), model_name)
+    digest = cache.get(key)
+    if digest is not None:
+        path = os.path.join(store_dir, digest + '.cm')
+        try:
+            return _acquire(path)
+        except OSError:
+            # removed from the store
+            pass
+
+    _ensure_index(rfam)
+    fd, tmp_file = mkstemp(prefix='.rba_', suffix='.cm', dir=store_dir)
+    os.close(fd)
+    try:
+        run_cmfetch(rfam.file_path, model_name, outfile=tmp_file, timeout=timeout)
+        digest = cm_hash(tmp_file)
+        path = os.path.join(store_dir, digest + '.cm')
+        os.replace(tmp_file, path)
+    except BaseException:
+        remove_one_file_with_try(tmp_file)
+        raise
+
+    cache.put(key, digest)
+    _acquire(path)
+    prune(store_dir)
+    return path
+
+
+def ref_structure(cm_file, timeout=None):
+    """Reference structure of the CM in dot bracket notation (see cmalign.extract_ref_from_cm)."""
+    cache = open_cache('cm_models')
+    if cache is None:
+        return extract_ref_from_cm(cm_file, timeout=timeout)
+
+    key = cache_key('ref-structure', cmscan_fingerprint(RfamInfo()), cm_hash(cm_file))
+    structure = cache.get(key)
+    if structure is None:
+        structure = extract_ref_from_cm(cm_file, timeout=timeout)
+        cache.put(key, structure)
+    return structure
+
+
+def emit_samples(cm_file, params='', timeout=None):
+    """
+    Sequences sampled from the CM with cmemit. Only output of cmemit seeded with explicit non-zero --seed
+     is repeatable, so only then it is cached.
+    :return: path to temporary file with cmemit output, the caller removes it
+    """
+    cache = open_cache('cm_models')
+    seed = re.search(r'--seed[\s=]+(\d+)', params)
+    if cache is None or seed is None or int(seed.group(1)) == 0:
+        return run_cmemit(cm_file, params=params, timeout=timeout)
+
+    key = cache_key('cmemit', cmscan_fingerprint(RfamInfo()), cm_hash(cm_file), ' '.join(params.split()))
+    text = cache.get(key)
+    if text is None:
+        out = run_cmemit(cm_file, params=params, timeout=timeout)
+        with open(out, 'r') as f:
+            cache.put(key, f.read())
+        return out
+
+    fd, out = mkstemp(prefix='rba_', suffix='_12', dir=CONFIG.tmpdir)
+    with os.fdopen(fd, 'w') as f:
+        f.write(text)
+    return out
@@ -1,5 +1,7 @@
 import os
 import re
+import json
+from hashlib import sha1
 from io import StringIO
 from subprocess import call
 from tempfile import mkstemp, TemporaryFile
@@ -8,7 +10,7 @@ import gzip
 import shutil
 import sys
 
-from Bio import AlignIO
+from Bio import AlignIO, SeqIO
 import pandas as pd
 
 from rna_blast_analyze.BR_core.BA_support import parse_seq_str, remove_one_file_with_try
@@ -16,10 +18,37 @@ from rna_blast_analyze.BR_core.config import CONFIG
 from rna_blast_analyze.BR_core.stockholm_parser import stockholm_read
 from rna_blast_analyze.BR_core.fname import fname
 from rna_blast_analyze.BR_core import exceptions
+from rna_blast_analyze.BR_core.result_cache import open_cache, cache_key, hit_rate_msg
 
 ml = logging.getLogger('rboAnalyzer')
 # this file holds files needed for running and parsing infernal tools
 
+CMSCAN_COLUMNS = [
+    'target_name',
+    'accession_seq',
+    'query_name',
+    'accession_mdl',
+    'mdl',
+    'mld_from',
+    'mld_to',
+    'seq_from',
+    'seq_to',
+    'strand',
+    'trunc',
+    'pass',
+    'gc',
+    'bias',
+    'score',
+    'E-value',
+    'inc',
+    'description_of_target',
+]
+
+# 100 MB, the tables are small
+CMSCAN_CACHE_SIZE = 10**8
+
+_fingerprint = {}
+
 
 def run_cmscan(fastafile, cmmodels_file=None, params=None, outfile=None, threads=None, rfam=None, timeout=None):
     """
@@ -37,8 +66,11 @@ def run_cmscan(fastafile, cmmodels_file=None, params=None, outfile=None, threads
         fd, out = mkstemp(prefix='rba_', suffix='_10', dir=CONFIG.tmpdir)
         os.close(fd)
 
+    if params is None:
+        params = ''
+
     if threads:
-        params += '--cpu {}'.format(threads)
+        params += ' --cpu {}'.format(threads)
 
     if cmmodels_file:
         cm_file = cmmodels_file
@@ -102,6 +134,36 @@ def run_cmfetch(cmfile, modelid, outfile=None, timeout=None):
         return out
 
 
+def run_cmfetch_index(cmfile):
+    """
+    Build SSI index of the cm file ([cmfile].ssi), cmfetch then reads only the requested model.
+    :param cmfile:
+    :return:
+    """
+    ml.info('Running cmfetch --index.')
+    ml.debug(fname())
+    # cmfetch does not overwrite an existing (outdated) index
+    if os.path.exists(cmfile + '.ssi'):
+        os.remove(cmfile + '.ssi')
+
+    with TemporaryFile(mode='w+', encoding='utf-8') as tmp:
+        cmd = ['{}cmfetch'.format(CONFIG.infernal_path), '--index', cmfile]
+        ml.debug(cmd)
+        r = call(cmd, stdout=tmp, stderr=tmp)
+
+        if r:
+            msgfail = 'Call to cmfetch --index failed.'
+            ml.error(msgfail)
+            tmp.seek(0)
+            raise exceptions.CmfetchException(msgfail, tmp.read())
+
+
+def check_if_cmfetch_indexed(cmfile):
+    """The index is older than the cm file when the file was replaced (new RFAM release)."""
+    ssi = cmfile + '.ssi'
+    return os.path.isfile(ssi) and os.path.getmtime(ssi) >= os.path.getmtime(cmfile)
+
+
 def run_cmemit(model, params='', out_file=None, timeout=None):
     """
 
@@ -232,6 +294,12 @@ def check_rfam_present():
                 ml.error('The Rfam file might be corrupt. Please check following output to get more information.\n')
                 print(e.errors)
                 return False
+        if not check_if_cmfetch_indexed(rfam.file_path):
+            try:
+                run_cmfetch_index(rfam.file_path)
+            except exceptions.CmfetchException as e:
+                # cmfetch works without the index, only slower
+                ml.warning(str(e))
         return True
     else:
         return False
@@ -300,9 +368,11 @@ def download_cmmodels_file(path=None, url=None):
                     shutil.copyfileobj(fin, fout)
 
             # run cmpress to create binary files needed to run cmscan
+            #  and cmfetch --index to extract single models quickly
             try:
                 run_cmpress(os.path.join(path, rfam.rfam_file_name))
-            except exceptions.CmpressException as e:
+                run_cmfetch_index(os.path.join(path, rfam.rfam_file_name))
+            except (exceptions.CmpressException, exceptions.CmfetchException) as e:
                 ml.error(str(e))
                 ml.error('The Rfam file might be corrupt. Please check following output to get more information.\n')
                 print(e.errors)
@@ -470,24 +540,7 @@ def parse_cmalign_infernal_table(tbl):
                       'inc',
                       'description_of_target']
 
-    output_names = ['target_name',
-                    'accession_seq',
-                    'query_name',
-                    'accession_mdl',
-                    'mdl',
-                    'mld_from',
-                    'mld_to',
-                    'seq_from',
-                    'seq_to',
-                    'strand',
-                    'trunc',
-                    'pass',
-                    'gc',
-                    'bias',
-                    'score',
-                    'E-value',
-                    'inc',
-                    'description_of_target']
+    output_names = CMSCAN_COLUMNS
 
     name_line = tbl.readline()
     lc_line = tbl.readline()
@@ -533,22 +586,100 @@ def get_cm_model(query_file, params=None, threads=None):
 
 
 def get_cm_model_table(query_file, params=None, threads=None, rfam=None, timeout=None):
+    ml.debug(fname())
+    records = list(SeqIO.parse(query_file, 'fasta'))
+    tables = cmscan_tables(records, params=params, threads=threads, rfam=rfam, timeout=timeout)
+    if tables is None:
+        return None
+    if not records:
+        return pd.DataFrame(columns=CMSCAN_COLUMNS)
+    return pd.concat([tables[i] for i in range(len(records))], ignore_index=True)
+
+
+def cmscan_fingerprint(rfam):
+    """Identify cmscan executable and the RFAM CM file by path, size and modification time.
+    New infernal or new RFAM release invalidates the cached cmscan tables.
+    """
+    cm_file = os.path.join(rfam.rfam_dir, rfam.rfam_file_name)
+    key = (CONFIG.infernal_path, cm_file)
+    if key not in _fingerprint:
+        h = sha1()
+        for name, path in (('cmscan', shutil.which(CONFIG.infernal_path + 'cmscan')), ('rfam', cm_file)):
+            if path is None or not os.path.isfile(path):
+                h.update('{}:missing;'.format(name).encode())
+            else:
+                st = os.stat(path)
+                h.update('{}:{}:{}:{};'.format(name, os.path.realpath(path), st.st_size, st.st_mtime).encode())
+        _fingerprint[key] = h.hexdigest()
+    return _fingerprint[key]
+
+
+def cmscan_table_from_records(rows, query_name=None):
+    """Rebuild cmscan table of one query from its rows (table.to_dict(orient='records'))."""
+    table = pd.DataFrame.from_records(rows, columns=CMSCAN_COLUMNS)
+    if query_name is not None:
+        table['query_name'] = query_name
+    table['E-value'] = table['E-value'].astype('float')
+    table['score'] = table['score'].astype('float')
+    return table
+
+
+def cmscan_tables(records, params=None, threads=None, rfam=None, timeout=None):
+    """
+    Scan query sequences against RFAM with cmscan, the parsed tables are cached per sequence.
+    Sequences already scanned with the same cmscan parameters, infernal and RFAM release are taken from the cache,
+     the rest is scanned with one cmscan call.
+    :param records: query SeqRecords
+    :return: dict {index of the record: cmscan table of the record} or None if cmscan failed
+    """
     ml.debug(fname())
     if params is None:
         params = dict()
+    if rfam is None:
+        rfam = RfamInfo()
 
     cmscan_params = '-g '
     if params and ('cmscan' in params) and params['cmscan']:
         cmscan_params += params['cmscan']
-    try:
-        out_table = run_cmscan(query_file, params=cmscan_params, threads=threads, rfam=rfam, timeout=timeout)
-        f = open(out_table, 'r')
-        cmscan_data = parse_cmalign_infernal_table(f)
-        f.close()
-        remove_one_file_with_try(out_table)
-        return cmscan_data
-    except exceptions.CmscanException as e:
-        return None
+
+    tables = {}
+    keys = {}
+    cache = open_cache('cmscan', max_size=CMSCAN_CACHE_SIZE)
+    if cache is not None:
+        before = cache.stats()
+        fingerprint = cmscan_fingerprint(rfam)
+        for i, rec in enumerate(records):
+            keys[i] = cache_key('cmscan', fingerprint, cmscan_params, str(rec.seq).upper())
+            text = cache.get(keys[i])
+            if text is not None:
+                tables[i] = cmscan_table_from_records(json.loads(text), rec.id)
+
+    to_scan = [i for i in range(len(records)) if i not in tables]
+    if to_scan:
+        # the queries are renamed, so the ids in the table are unique and don't depend on the fasta header
+        fd, query_file = mkstemp(prefix='rba_', suffix='_10', dir=CONFIG.tmpdir)
+        with os.fdopen(fd, 'w') as f:
+            for i in to_scan:
+                f.write('>q{}\n{}\n'.format(i, str(records[i].seq)))
+        try:
+            out_table = run_cmscan(query_file, params=cmscan_params, threads=threads, rfam=rfam, timeout=timeout)
+            with open(out_table, 'r') as f:
+                cmscan_data = parse_cmalign_infernal_table(f)
+            remove_one_file_with_try(out_table)
+        except exceptions.CmscanException:
+            return None
+        finally:
+            remove_one_file_with_try(query_file)
+
+        for i in to_scan:
+            rows = cmscan_data[cmscan_data['query_name'] == 'q{}'.format(i)]
+            if cache is not None:
+                cache.put(keys[i], rows.to_json(orient='records'))
+            tables[i] = cmscan_table_from_records(rows.to_dict(orient='records'), records[i].id)
+
+    if cache is not None:
+        ml.info(hit_rate_msg('cmscan', before, cache.stats()))
+    return tables
 
 
 def select_best_matching_model_from_cmscan(cmscan_data):
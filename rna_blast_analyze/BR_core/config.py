@@ -39,6 +39,10 @@ class tools_paths(object):
             ),
             'rnastructure_datapath': dp,
             'tmpdir': None,
+            'cache_dir': os.path.join(
+                os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                'rboAnalyzer'
+            ),
         }
 
         if config_file:
@@ -145,6 +149,10 @@ class tools_paths(object):
     def tmpdir(self):
         return self.data_paths['tmpdir']
 
+    @property
+    def cache_dir(self):
+        return self.data_paths['cache_dir']
+
     def __repr__(self):
         return repr(vars(self))
 
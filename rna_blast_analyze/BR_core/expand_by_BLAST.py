@@ -1,5 +1,4 @@
 import sys
-from copy import deepcopy
 import logging
 
 import rna_blast_analyze.BR_core.BA_support as BA_support
@@ -96,7 +95,7 @@ def create_blast_only_report_object(exp_hit, query_len):
     hit = BA_support.Subsequences(exp_hit)
 
     # init new SeqRecord object
-    ns = deepcopy(exp_hit)
+    ns = BA_support.snapshot_record(exp_hit)
     ann = ns.annotations
     tss = ann['trimmed_ss']
     tse = ann['trimmed_se']
@@ -134,7 +133,7 @@ def create_blast_only_report_object(exp_hit, query_len):
     return hit
 
 
-def extend_simple_core(analyzed_hits, query, args_inner, all_short, multi_query, iteration, ih_model):
+def extend_simple_core(analyzed_hits, query, args_inner, all_short, multi_query, iteration, ih_model, region_pool=None, infer=True):
     # the extra here is given "pro forma" the sequence is extended exactly by lenghts of unaligned portions of query
     if args_inner.db_type == "blastdb":
         shorts_expanded, _ = rna_blast_analyze.BR_core.extend_hits.expand_hits(
@@ -145,6 +144,7 @@ def extend_simple_core(analyzed_hits, query, args_inner, all_short, multi_query,
             blast_regexp=args_inner.blast_regexp,
             skip_missing=args_inner.skip_missing,
             msgs=analyzed_hits.msgs,
+            region_pool=region_pool,
         )
     elif args_inner.db_type in ["fasta", "gb", "server", "entrez"]:
         shorts_expanded, _ = rna_blast_analyze.BR_core.extend_hits.expand_hits_from_fasta(
@@ -158,6 +158,7 @@ def extend_simple_core(analyzed_hits, query, args_inner, all_short, multi_query,
             format=args_inner.db_type,
             entrez_email=args_inner.entrez,
             blast_input_file=args_inner.blast_in,
+            region_pool=region_pool,
         )
     else:
         raise exceptions.IncorrectDatabaseChoice()
@@ -198,6 +199,10 @@ def extend_simple_core(analyzed_hits, query, args_inner, all_short, multi_query,
     for hit in analyzed_hits.hits:
         hit.extension.annotations['score'] = None
 
+    if not infer:
+        # homology is inferred by the caller (meta mode)
+        return analyzed_hits, None, None, None
+
     # this part predicts homology - it is not truly part of repredict
     homology_prediction, homol_seqs, cm_file_rfam_user = infer_homology(
         analyzed_hits=analyzed_hits, args=args_inner, cm_model_file=ih_model, multi_query=multi_query,
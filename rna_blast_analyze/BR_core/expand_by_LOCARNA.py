@@ -1,10 +1,11 @@
 import os
 import re
-from multiprocessing import Pool
 import subprocess
 from tempfile import mkstemp, TemporaryFile
 import logging
 import shlex
+from functools import partial
+from io import StringIO
 
 from Bio.SeqRecord import SeqRecord
 
@@ -12,11 +13,14 @@ import rna_blast_analyze.BR_core.BA_support as BA_support
 import rna_blast_analyze.BR_core.extend_hits
 from rna_blast_analyze.BR_core.alifold4all import compute_refold
 from rna_blast_analyze.BR_core.config import CONFIG
+from rna_blast_analyze.BR_core.convert_classes import subsequences2dict, subsequencesfromdict
 from rna_blast_analyze.BR_core.infer_homology import infer_homology
 from rna_blast_analyze.BR_core.locarna_clustal_like_2stockholm import parse_locarna_alignment
 from rna_blast_analyze.BR_core.stockholm_parser import trim_alignment_by_sequence
 from rna_blast_analyze.BR_core.fname import fname
 from rna_blast_analyze.BR_core import exceptions
+from rna_blast_analyze.BR_core.parallel import pool_for
+from rna_blast_analyze.BR_core.result_cache import open_cache, cache_key, hit_rate_msg
 
 ml = logging.getLogger('rboAnalyzer')
 
@@ -28,6 +32,17 @@ def write_clustal_like_file_with_anchors(fid, seq_name, cseq, my_anchors):
         fid.write('{} {}\n'.format(anch[0], anch[1]))
 
 
+def _rename_locarna_seq(loc_text, old_name, new_name):
+    """Rename sequence in the locarna output (clustal like format)."""
+    out = []
+    for line in loc_text.splitlines(keepends=True):
+        spl = line.split()
+        if len(spl) == 2 and spl[0] == old_name:
+            line = '{} {}\n'.format(new_name, spl[1])
+        out.append(line)
+    return ''.join(out)
+
+
 def locarna_worker(pack, timeout=None):
     ml.debug(fname())
     one_expanded_hit, query_seq, locarna_params, anchor_length = pack
@@ -50,40 +65,56 @@ def locarna_worker(pack, timeout=None):
         if anchors.too_many_anchors:
             ml.info('Too many anchors for {}. Can handle up to 520 distinct anchors.'.format(one_expanded_hit.id))
         # extracted temp is my query
-
-        # access the locarna aligner directly
-        fd1, locarna_file1 = mkstemp(prefix='rba_', suffix='_20', dir=CONFIG.tmpdir)
-        with os.fdopen(fd1, 'w') as fp_locarna_file_1:
-            ql1, ql2 = anchors.anchor_whole_seq(str(query_seq), 'query')
-            write_clustal_like_file_with_anchors(fp_locarna_file_1,
-                                                 'query',
-                                                 str(query_seq),
-                                                 (
-                                                     ('#A1', ql1.split()[0]),
-                                                     ('#A2', ql2.split()[0])
-                                                 ))
-
-        fd2, locarna_file2 = mkstemp(prefix='rba_', suffix='_21', dir=CONFIG.tmpdir)
-        with os.fdopen(fd2, 'w') as fp_locarna_file_2:
-            sl1, sl2 = anchors.anchor_whole_seq(str(one_expanded_hit.seq), 'subject')
-            write_clustal_like_file_with_anchors(fp_locarna_file_2,
-                                                 one_expanded_hit.id,
-                                                 str(one_expanded_hit.seq),
-                                                 (
-                                                     ('#A1', sl1.split()[0]),
-                                                     ('#A2', sl2.split()[0])
-                                                 ))
-
-        loc_out_file = run_locarna(
-            locarna_file1,
-            locarna_file2,
-            locarna_params,
-            timeout=timeout
+        ql1, ql2 = anchors.anchor_whole_seq(str(query_seq), 'query')
+        sl1, sl2 = anchors.anchor_whole_seq(str(one_expanded_hit.seq), 'subject')
+
+        # the alignment is fully determined by the sequences, anchors and parameters
+        #  the subject name is stored as 'subject' so the alignment can be reused for other hits
+        cache = open_cache('locarna')
+        key = cache_key(
+            str(query_seq), ql1, ql2, str(one_expanded_hit.seq), sl1, sl2, locarna_params, anchor_length
         )
+        loc_text = cache.get(key) if cache is not None else None
+
+        if loc_text is None:
+            # access the locarna aligner directly
+            fd1, locarna_file1 = mkstemp(prefix='rba_', suffix='_20', dir=CONFIG.tmpdir)
+            with os.fdopen(fd1, 'w') as fp_locarna_file_1:
+                write_clustal_like_file_with_anchors(fp_locarna_file_1,
+                                                     'query',
+                                                     str(query_seq),
+                                                     (
+                                                         ('#A1', ql1.split()[0]),
+                                                         ('#A2', ql2.split()[0])
+                                                     ))
+
+            fd2, locarna_file2 = mkstemp(prefix='rba_', suffix='_21', dir=CONFIG.tmpdir)
+            with os.fdopen(fd2, 'w') as fp_locarna_file_2:
+                write_clustal_like_file_with_anchors(fp_locarna_file_2,
+                                                     one_expanded_hit.id,
+                                                     str(one_expanded_hit.seq),
+                                                     (
+                                                         ('#A1', sl1.split()[0]),
+                                                         ('#A2', sl2.split()[0])
+                                                     ))
+
+            loc_out_file = run_locarna(
+                locarna_file1,
+                locarna_file2,
+                locarna_params,
+                timeout=timeout
+            )
+
+            with open(loc_out_file, 'r') as f:
+                loc_text = f.read()
+
+            if cache is not None:
+                cache.put(key, _rename_locarna_seq(loc_text, one_expanded_hit.id, 'subject'))
+        else:
+            loc_text = _rename_locarna_seq(loc_text, 'subject', one_expanded_hit.id)
 
         # read locarna alignment
-        with open(loc_out_file, 'r') as f:
-            locarna_alig = parse_locarna_alignment(f)
+        locarna_alig = parse_locarna_alignment(StringIO(loc_text))
 
         if len(locarna_alig) != 2:
             raise exceptions.SubseqMatchError('There must be 2 sequences in Locarna alignment.')
@@ -91,6 +122,12 @@ def locarna_worker(pack, timeout=None):
         loc_rep = create_report_object_from_locarna(one_expanded_hit, locarna_alig)
 
         return loc_rep
+    except subprocess.TimeoutExpired:
+        msg = 'LocARNA alignment of {} exceeded the time limit of {} s.'.format(one_expanded_hit.id, timeout)
+        ml.warning(msg)
+        one_expanded_hit.annotations['msgs'] = [msg]
+        empty_hit = BA_support.Subsequences(one_expanded_hit)
+        return empty_hit
     except exceptions.LocarnaException as e:
         one_expanded_hit.annotations['msgs'] = [str(e), e.errors]
         empty_hit = BA_support.Subsequences(one_expanded_hit)
@@ -109,7 +146,7 @@ def locarna_worker(pack, timeout=None):
                 BA_support.remove_one_file_with_try(f)
 
 
-def extend_locarna_core(analyzed_hits, query, args_inner, all_short, multi_query, iteration, ih_model, timeout=None):
+def extend_locarna_core(analyzed_hits, query, args_inner, all_short, multi_query, iteration, ih_model, timeout=None, region_pool=None, checkpoint=None, infer=True):
     # expand hits according to query + 10 nucleotides +-
     if args_inner.db_type == "blastdb":
         shorts_expanded, _ = rna_blast_analyze.BR_core.extend_hits.expand_hits(
@@ -120,6 +157,7 @@ def extend_locarna_core(analyzed_hits, query, args_inner, all_short, multi_query
             blast_regexp=args_inner.blast_regexp,
             skip_missing=args_inner.skip_missing,
             msgs=analyzed_hits.msgs,
+            region_pool=region_pool,
         )
     elif args_inner.db_type in ["fasta", "gb", "server", "entrez"]:
         shorts_expanded, _ = rna_blast_analyze.BR_core.extend_hits.expand_hits_from_fasta(
@@ -133,6 +171,7 @@ def extend_locarna_core(analyzed_hits, query, args_inner, all_short, multi_query
             format=args_inner.db_type,
             entrez_email=args_inner.entrez,
             blast_input_file=args_inner.blast_in,
+            region_pool=region_pool,
         )
     else:
         raise exceptions.IncorrectDatabaseChoice()
@@ -142,35 +181,55 @@ def extend_locarna_core(analyzed_hits, query, args_inner, all_short, multi_query
     query_seq = query.seq.transcribe()
 
     # compute alignment here
-
-    if args_inner.threads == 1:
-        result = []
-        for oeh in shorts_expanded:
-            result.append(
-                locarna_worker(
-                    (
-                        oeh,
-                        query_seq,
-                        args_inner.locarna_params,
-                        args_inner.locarna_anchor_length
-                    ), timeout=timeout
-                )
+    keys = [int(re.split('[|:]', oeh.id)[1]) for oeh in shorts_expanded]
+
+    # alignments finished before the computation was interrupted
+    finished = {}
+    if checkpoint is not None:
+        for key, hit_dict in checkpoint.load_alignments(iteration).items():
+            finished[key] = subsequencesfromdict(hit_dict)
+        if finished:
+            ml.info('Loaded {} LocARNA alignments from backup file.'.format(len(finished)))
+
+    # the most expensive alignments are started first
+    #  so a single long alignment does not keep running when all other jobs are done
+    todo = [i for i, key in enumerate(keys) if key not in finished]
+    todo.sort(key=lambda i: len(query_seq) * len(shorts_expanded[i]), reverse=True)
+
+    pack = []
+    for i in todo:
+        pack.append(
+            (
+                shorts_expanded[i],
+                query_seq,
+                args_inner.locarna_params,
+                args_inner.locarna_anchor_length
             )
-    else:
-        pack = []
-        for oeh in shorts_expanded:
-            pack.append(
-                (
-                    oeh,
-                    query_seq,
-                    args_inner.locarna_params,
-                    args_inner.locarna_anchor_length
-                )
-            )
-        # timeout is not used with multiprocessing
-        pool = Pool(processes=args_inner.threads)
-        result = pool.map(locarna_worker, pack)
-        pool.close()
+        )
+
+    def _save_alignment(j, res):
+        if checkpoint is not None:
+            checkpoint.save_alignment(iteration, keys[todo[j]], subsequences2dict(res))
+
+    cache = open_cache('locarna')
+    if cache is not None:
+        cache_stats = cache.stats()
+
+    with pool_for(args_inner.threads) as pool:
+        computed = pool.map(
+            partial(locarna_worker, timeout=timeout),
+            pack,
+            chunksize=1,
+            desc='LocARNA alignments',
+            callback=_save_alignment,
+        )
+
+    if cache is not None:
+        ml.info(hit_rate_msg('LocARNA', cache_stats, cache.stats()))
+
+    for i, res in zip(todo, computed):
+        finished[keys[i]] = res
+    result = [finished[key] for key in keys]
 
     for res in result:
         if res.extension is None:
@@ -178,6 +237,10 @@ def extend_locarna_core(analyzed_hits, query, args_inner, all_short, multi_query
         else:
             analyzed_hits.hits.append(res)
 
+    if not infer:
+        # homology is inferred by the caller (meta mode)
+        return analyzed_hits, None, None, None
+
     # this part predicts homology - it is not truly part of repredict
     homology_prediction, homol_seqs, cm_file_rfam_user = infer_homology(
         analyzed_hits=analyzed_hits, args=args_inner, cm_model_file=ih_model, multi_query=multi_query,
@@ -1,59 +1,71 @@
-import os
-from copy import deepcopy
-from tempfile import mkstemp
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
 import logging
 
 import rna_blast_analyze.BR_core.BA_support as BA_support
 from rna_blast_analyze.BR_core.config import tools_paths, CONFIG
+from rna_blast_analyze.BR_core import cm_store
 from rna_blast_analyze.BR_core.expand_by_BLAST import extend_simple_core
 from rna_blast_analyze.BR_core.expand_by_LOCARNA import extend_locarna_core
 from rna_blast_analyze.BR_core.fname import fname
+from rna_blast_analyze.BR_core.infer_homology import score_hits, write_repredict_table
 
 ml = logging.getLogger('rboAnalyzer')
 
 
-def extend_meta_core(analyzed_hits, query, args_inner, all_short, multi_query, iteration, ih_model, timeout=None):
+def extend_meta_core(analyzed_hits, query, args_inner, all_short, multi_query, iteration, ih_model, timeout=None, region_pool=None, checkpoint=None):
     ml.debug(fname())
     # update params if different config is requested
     CONFIG.override(tools_paths(args_inner.config_file))
 
-    blast_args = deepcopy(args_inner)
-    locarna_args = deepcopy(args_inner)
-    b_all_short = deepcopy(all_short)
-    l_all_short = deepcopy(all_short)
+    # the BLAST hits are only read by the extension, the args attributes are replaced (not modified)
+    blast_args = copy(args_inner)
+    locarna_args = copy(args_inner)
 
-    if args_inner.repredict_file is None:
-        fd, repred_file = mkstemp(prefix='rba_', suffix='_18', dir=CONFIG.tmpdir)
-        os.close(fd)
-    else:
-        repred_file = args_inner.repredict_file
-
-    for i, args in enumerate([blast_args, locarna_args]):
+    for args in [blast_args, locarna_args]:
         args.prediction_method = []
         args.pred_params = dict()
         args.dump = None
         args.pdf_out = None
         args.pandas_dump = None
-        args.repredict_file = repred_file + str(i)
+        args.table = None
+        args.repredict_file = None
         args.dev_pred = False
         args.logfile = None
         args.json = None
         args.html = None
         args.cm_file = ih_model
 
-    analyzed_hits_simple = deepcopy(analyzed_hits)
-    analyzed_hits_locarna = deepcopy(analyzed_hits)
-
-    analyzed_hits_simple, _, _, _ = extend_simple_core(analyzed_hits_simple, query, blast_args, b_all_short, multi_query, iteration, ih_model)
-    analyzed_hits_locarna, _, _, _ = extend_locarna_core(analyzed_hits_locarna, query, locarna_args, l_all_short, multi_query, iteration, ih_model, timeout=timeout)
-
-    # add cmstat to query
-    analyzed_hits.query = analyzed_hits_simple.query
-
-    order_out = []
+    analyzed_hits_simple = analyzed_hits.snapshot()
+    analyzed_hits_locarna = analyzed_hits.snapshot()
+
+    # both extensions are computed at once (the regions of both are sliced from the same retrieved window),
+    #  the homology of all extended sequences is then inferred by one cmalign
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        f_simple = executor.submit(
+            extend_simple_core, analyzed_hits_simple, query, blast_args, all_short, multi_query, iteration, ih_model,
+            region_pool=region_pool, infer=False
+        )
+        f_locarna = executor.submit(
+            extend_locarna_core, analyzed_hits_locarna, query, locarna_args, all_short, multi_query, iteration,
+            ih_model, timeout=timeout, region_pool=region_pool, checkpoint=checkpoint, infer=False
+        )
+        analyzed_hits_simple = f_simple.result()[0]
+        analyzed_hits_locarna = f_locarna.result()[0]
+
+    candidates = list(analyzed_hits_simple.hits) + list(analyzed_hits_locarna.hits)
+    prediction, cm_msa_conservation = score_hits(
+        analyzed_hits.query, candidates, ih_model, threads=args_inner.threads, timeout=timeout,
+        conservation=bool(args_inner.repredict_file)
+    )
+    for hit, pred in zip(candidates, prediction):
+        hit.hpred = pred
 
     b_dict = {BA_support.get_hit_n(h): h for h in analyzed_hits_simple.hits}
     l_dict = {BA_support.get_hit_n(h): h for h in analyzed_hits_locarna.hits}
+    # position of the candidate in the scored sequences (after the query)
+    position = {id(h): i + 1 for i, h in enumerate(candidates)}
+    selected_conservation = []
     ok_keys = sorted(set(b_dict.keys()) | set(l_dict.keys()))
     for inum in ok_keys:
         bh = b_dict.get(inum, None)
@@ -69,20 +81,21 @@ def extend_meta_core(analyzed_hits, query, args_inner, all_short, multi_query, i
             ml.info(msg)
             if ml.getEffectiveLevel() < 20:
                 print(msg)
-            analyzed_hits.hits.append(filtered_hits[0])
-            continue
+            chosen = filtered_hits[0]
         elif len(filtered_hits) == 0:
             # append empty extension
             analyzed_hits.hits_failed.append(lh)
             continue
+        else:
+            bit_scores = [i.extension.annotations['cmstat']['bit_sc'] for i in hits]
 
-        bit_scores = [i.extension.annotations['cmstat']['bit_sc'] for i in hits]
-
-        mb = max(bit_scores)
-        bit_index = [i for i, j in enumerate(bit_scores) if j == mb][0]
-        order_out.append(bit_index)
+            mb = max(bit_scores)
+            bit_index = [i for i, j in enumerate(bit_scores) if j == mb][0]
+            chosen = hits[bit_index]
 
-        analyzed_hits.hits.append(hits[bit_index])
+        analyzed_hits.hits.append(chosen)
+        if cm_msa_conservation is not None:
+            selected_conservation.append(cm_msa_conservation[position[id(chosen)]])
 
     # build failed hits
     b_dict_failed = {BA_support.get_hit_n(h): h for h in analyzed_hits_simple.hits_failed}
@@ -96,28 +109,14 @@ def extend_meta_core(analyzed_hits, query, args_inner, all_short, multi_query, i
             else:
                 raise KeyError("Failed to find inum key in failed extensions. This should not happen.")
 
-    # build the repredict file here if needed
+    # the table is written for the selected hits, the conservation is from the alignment of all extensions
     if args_inner.repredict_file:
-        b_repredict = BA_support.iter2file_name(blast_args.repredict_file, multi_query, iteration)
-        l_repredict = BA_support.iter2file_name(blast_args.repredict_file, multi_query, iteration)
-        o_repredict = BA_support.iter2file_name(args_inner.repredict_file, multi_query, iteration)
-        with open(b_repredict, 'r') as barf, open(l_repredict, 'r') as larf, open(o_repredict, 'w') as reprf:
-            """
-            please note that order of files to merge must be same as the order of methods in previous for cycle
-            ie same as the one in which order_out var is set
-            """
-            bb = (barf, larf)
-
-            fl = bb[0].readline()
-            reprf.write(fl)
-            fl = bb[0].readline()
-            reprf.write(fl)
-            # dump first line of the other documents
-            [[i.readline() for _ in range(1)] for i in bb[1:]]
-
-            for o in order_out:
-                lll = [i.readline() for i in bb]
-                reprf.write(lll[o])
+        write_repredict_table(
+            BA_support.iter2file_name(args_inner.repredict_file, multi_query, iteration),
+            analyzed_hits.query,
+            analyzed_hits.hits,
+            [cm_msa_conservation[0]] + selected_conservation
+        )
 
     # recreate needed data from selected hits
     homology_prediction = []
@@ -132,7 +131,7 @@ def extend_meta_core(analyzed_hits, query, args_inner, all_short, multi_query, i
         # add default prediction if it is not present
         if 'ss0' not in hit.extension.letter_annotations:
             if 'sss' not in hit.extension.annotations:
-                hit.extension.anotations['sss'] = []
+                hit.extension.annotations['sss'] = []
             hit.extension.annotations['sss'] += ['ss0']
             hit.extension.letter_annotations['ss0'] = '.' * len(hit.extension.seq)
 
@@ -149,7 +148,7 @@ def extend_meta_core(analyzed_hits, query, args_inner, all_short, multi_query, i
         # add default prediction if it is not present
         if 'ss0' not in hit.extension.letter_annotations:
             if 'sss' not in hit.extension.annotations:
-                hit.extension.anotations['sss'] = []
+                hit.extension.annotations['sss'] = []
             hit.extension.annotations['sss'] += ['ss0']
             hit.extension.letter_annotations['ss0'] = '.' * len(hit.extension.seq)
 
@@ -161,5 +160,5 @@ def extend_meta_core(analyzed_hits, query, args_inner, all_short, multi_query, i
         cm_file_rfam_user = ih_model
     else:
         cm_file_rfam_user = None
-        BA_support.remove_one_file_with_try(ih_model)
+        cm_store.release(ih_model)
     return analyzed_hits, homology_prediction, homol_seqs, cm_file_rfam_user
@@ -3,6 +3,10 @@ import logging
 from subprocess import Popen, PIPE
 from tempfile import mkstemp, TemporaryFile, gettempdir
 import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from time import time
 
 from Bio import SeqIO
 
@@ -10,6 +14,7 @@ from rna_blast_analyze.BR_core.config import CONFIG
 from rna_blast_analyze.BR_core.fname import fname
 from rna_blast_analyze.BR_core.BA_support import remove_files_with_try, match_acc, remove_one_file_with_try
 from rna_blast_analyze.BR_core import exceptions
+from rna_blast_analyze.BR_core.fasta_index import IndexedSequenceFile
 from Bio import Entrez
 from http.client import HTTPException
 from math import floor
@@ -25,199 +30,290 @@ def fetch_accession_range(acc: str, start: int, stop: int):
         return SeqIO.read(temp, format='fasta')
 
 
-def expand_hits(hits, blast_db, query_length, extra=0, blast_regexp=None, skip_missing=False, msgs=None):
+def expand_hits(hits, blast_db, query_length, extra=0, blast_regexp=None, skip_missing=False, msgs=None, region_pool=None):
     """takes list of blast.HSP objects as first argument and
     path to local blast database as second argument
     then it uses blastdbcmd from blast+ installation to obtain desired sequence
     Two temporary files are used in this call and are deleted at final stage
+    If region_pool (BlastdbRegionPool) is given, the sequences already retrieved to it are reused
+     and blastdbcmd is called only for the missing regions.
     :return list of SeqRecord objects (parsed fasta file)
     """
     ml.info('Retrieving sequence neighborhoods for blast hits.')
     ml.debug(fname())
 
-    fd, temp_filename = mkstemp(prefix='rba_', suffix='_25', dir=CONFIG.tmpdir)
-    fdb, blast_tempfile = mkstemp(prefix='rba_', suffix='_26', dir=CONFIG.tmpdir)
-    os.close(fdb)
-    exp_hits = []
     strand = []
     loc = []
-    try:
-        with os.fdopen(fd, 'w') as temp_file:
-            for index, hit in enumerate(hits):
-                # +1 here because blastdbcmd counts sequences from 1
-                if hit[1].sbjct_end < hit[1].sbjct_start:
-                    # this is hit to minus strand
-                    start = hit[1].sbjct_end - _positive_index(query_length - hit[1].query_end) - extra
-                    end = hit[1].sbjct_start + hit[1].query_start + extra - 1
-                    strand.append(-1)
-                    d = {'query_start': hit[1].sbjct_end, 'query_end': hit[1].sbjct_start,
-                         'extended_start': hit[1].sbjct_end - _positive_index(query_length - hit[1].query_end),
-                         'extended_end': hit[1].sbjct_start + hit[1].query_start - 1,
-                         'strand': -1}
-                else:
-                    # this is hit to plus strand
-                    start = hit[1].sbjct_start - hit[1].query_start + 1 - extra
-                    end = hit[1].sbjct_end + _positive_index(query_length - hit[1].query_end) + extra
-                    strand.append(1)
-                    d = {'query_start': hit[1].sbjct_start, 'query_end': hit[1].sbjct_end,
-                         'extended_start': hit[1].sbjct_start - hit[1].query_start + 1,
-                         'extended_end': hit[1].sbjct_end + _positive_index(query_length - hit[1].query_end),
-                         'strand': 1}
-
-                # ====== information about possible trim ======
-                # assume ok
-                d['trimmed_ss'] = False
-                d['trimmed_se'] = False
-                d['trimmed_es'] = False
-                d['trimmed_ee'] = False
-
-                d['super_start'] = start
-                d['super_end'] = end
-
-                if start < 1:
-                    start = 1                    # index from which sequence should be retrieved from the db
-                    d['trimmed_ss'] = True
-
-                # repair possible extended start violation
-                if d['extended_start'] < 1:
-                    d['trimmed_es'] = True
-
-                # add blast record
-                d['blast'] = hit
+    regions = []
+    for hit in hits:
+        d, start, end = _hit_region(hit, query_length, extra)
+        strand.append(d['strand'])
 
-                try:
-                    bdb_accession = match_acc(hit[0], blast_regexp)
-                except exceptions.AccessionMatchException as e:
-                    remove_files_with_try([temp_filename, blast_tempfile])
-                    raise e
-
-                d['blast'][0] = bdb_accession
-                loc.append(d)
-
-                temp_file.write(bdb_accession + ' ' + '-region ' + str(start) + '-' + str(end) + '\n')
-    except RuntimeError as e:
-        ml.error(str(e))
-        sys.exit(1)
-
-    cmd = [
-        '{}blastdbcmd'.format(CONFIG.blast_path),
-        '-dbtype',
-        'nucl',
-        '-db',
-        str(blast_db),
-        '-entry_batch',
-        temp_filename,
-        '-out',
-        blast_tempfile
-    ]
-    ml.debug(cmd)
+        bdb_accession = match_acc(hit[0], blast_regexp)
 
-    try:
-        pcall = Popen(
-            cmd,
-            stdout=PIPE,
-            stderr=PIPE,
-            universal_newlines=True
-        )
-        out, errs = pcall.communicate()
-    except FileNotFoundError:
-        msgfail = 'Unable to run blastdbcmd command, please check its availability.'
-        ml.error(msgfail)
-        remove_files_with_try([temp_filename, blast_tempfile])
-        sys.exit(1)
-
-    # inspect the stdout (the blastdbcmd returns exit code 1 even if only one sequence is missing)
-    msgfail = 'Incomplete database. Some sequences not found in database.'
-    msgfail += ' Details: ' + errs
-
-    if errs and not skip_missing:
-        ml.error(msgfail)
-        remove_files_with_try([temp_filename, blast_tempfile])
-        sys.exit(1)
-
-    elif errs and skip_missing:
-        ml.warning(msgfail)
+        d['blast'][0] = bdb_accession
+        loc.append(d)
+        regions.append((bdb_accession, start, end))
 
-    requested_ids = {l['blast'][0] for l in loc}
-    obtained_ids = set()
+    if region_pool is None:
+        region_pool = BlastdbRegionPool(blast_db)
+    # regions already retrieved to the pool (e.g. for all queries) are not requested again
+    for region in regions:
+        region_pool.add(*region)
+    region_pool.fetch_all()
 
-    with open(blast_tempfile, 'r') as bf:
-        index = 0
-        for parsed_record in SeqIO.parse(bf, 'fasta'):
-            record_id = parsed_record.id.split(':')[0]
+    # the blastdbcmd returns exit code 1 even if only one sequence is missing, check the retrieved accessions instead
+    requested_ids = {l['blast'][0] for l in loc}
+    missing_ids = {acc for acc in requested_ids if not region_pool.has_accession(acc)}
+    if missing_ids:
+        msgfail = 'Incomplete database. Some sequences not found in database.'
+        msgfail += ' Details: ' + region_pool.errors()
+        if not skip_missing:
+            ml.error(msgfail)
+            sys.exit(1)
+        ml.warning(msgfail)
 
-            if parsed_record.description.startswith(parsed_record.id):
-                parsed_record.description = parsed_record.description[len(parsed_record.id):].strip()
+    exp_hits = []
+    for index, (d, region) in enumerate(zip(loc, regions)):
+        record_id = d['blast'][0]
+        if record_id in missing_ids:
+            msgwarn = 'Sequence {} not found in provided db. Skipping.'.format(record_id)
+            ml.warning(msgwarn)
+            continue
 
-            obtained_ids.add(record_id)
-            index = _get_correct_blast_hit(record_id, loc, index, skip=skip_missing)
+        parsed_record = region_pool.get(*region)
 
-            parsed_record.annotations = loc[index]
-            parsed_record.annotations['msgs'] = []
-            # add uid to ensure that all hits are unique
-            parsed_record.id = 'uid:' + str(index) + '|' + record_id
+        parsed_record.annotations = d
+        parsed_record.annotations['msgs'] = []
+        # add uid to ensure that all hits are unique
+        parsed_record.id = 'uid:' + str(index) + '|' + record_id
 
-            if loc[index]['trimmed_ss']:
-                if loc[index]['super_start'] + len(parsed_record.seq) < loc[index]['super_end'] + loc[index]['super_start']:
-                    parsed_record.annotations['trimmed_se'] = True
-                    if loc[index]['trimmed_es']:
-                        if len(parsed_record.seq) < loc[index]['extended_end'] + loc[index]['extended_start']:
-                            parsed_record.annotations['trimmed_ee'] = True
-                    else:
-                        if len(parsed_record.seq) < loc[index]['extended_end'] - loc[index]['extended_start']:
-                            parsed_record.annotations['trimmed_ee'] = True
-            else:
-                if loc[index]['super_start'] + len(parsed_record.seq) - 1 < loc[index]['super_end']:
-                    parsed_record.annotations['trimmed_se'] = True
-                    if loc[index]['super_start'] + len(parsed_record.seq) - 1 < loc[index]['extended_end']:
-                        parsed_record.annotations['trimmed_ee'] = True
-
-            msgsub = '{}: Sequence cannot be extended sufficiently'.format(record_id)
-            if parsed_record.annotations['trimmed_ss']:
-                msgwarn = msgsub + '. Missing {} nt upstream in the genome.'.format(parsed_record.annotations['super_start'])
-                parsed_record.annotations['msgs'].append(msgwarn)
-                ml.warning(msgwarn)
-            if parsed_record.annotations['trimmed_se']:
-                msgwarn = msgsub + '. Missing nt downstream in the genome.'.format(record_id)
-                parsed_record.annotations['msgs'].append(msgwarn)
-                ml.warning(msgwarn)
-            if parsed_record.annotations['trimmed_es']:
-                msgwarn = msgsub + ' by unaligned portion of query. THIS IS PROBABLY FRAGMENT!'
-                msgwarn += ' Trimmed upstream.'
-                parsed_record.annotations['msgs'].append(msgwarn)
-                ml.warning(msgwarn)
-            if parsed_record.annotations['trimmed_ee']:
-                msgwarn = msgsub + ' by unalined portion of query. THIS IS PROBABLY FRAGMENT!'
-                msgwarn += ' Trimmed downstream.'
-                parsed_record.annotations['msgs'].append(msgwarn)
-                ml.warning(msgwarn)
-
-            exp_hits.append(parsed_record)
-            index += 1
+        _annotate_trimmed(parsed_record, record_id)
 
-    remove_files_with_try(
-        [temp_filename, blast_tempfile]
-    )
+        exp_hits.append(parsed_record)
 
-    if len(requested_ids - obtained_ids) != 0:
+    if len(missing_ids) != 0:
         msgs.append('Incomplete database. Sequences with following ids were not found:')
-        for m in requested_ids - obtained_ids:
+        for m in missing_ids:
             msgs.append(m)
 
     return exp_hits, strand
 
 
-def expand_hits_from_fasta(hits, database, query_length, extra=0, blast_regexp=None, skip_missing=False, msgs=None, format='fasta', entrez_email=None, blast_input_file=None):
+def add_hits_to_region_pool(region_pool, hits, query_length, extra=0, blast_regexp=None):
+    """Request regions which expand_hits would retrieve for given hits.
+    Hits for which accession can't be matched are skipped (the error is reported by expand_hits).
+    """
+    for hit in hits:
+        _, start, end = _hit_region(hit, query_length, extra)
+        try:
+            region_pool.add(match_acc(hit[0], blast_regexp), start, end)
+        except exceptions.AccessionMatchException:
+            continue
+
+
+class BlastdbRegionPool(object):
+    """Batched retrieval of sequence regions from blast database.
+
+    Regions are collected with add (possibly for all queries), overlapping regions of the same accession are merged
+    and all of them are retrieved by blastdbcmd calls (sharded over "threads" parallel processes) in fetch_all.
+    The requested regions are then sliced from the retrieved sequences with get.
+    The pool may be shared by concurrently computed queries.
+    """
+    def __init__(self, blast_db, threads=1):
+        self.blast_db = blast_db
+        self.threads = max(1, threads)
+        self._lock = threading.RLock()
+        self.pending = {}
+        self.retrieved = {}
+        self.missing = set()
+        self._errs = []
+        self.stats = {'requested': 0, 'retrieved': 0, 'nt': 0, 'time': 0.0}
+
+    def add(self, accession, start, end):
+        """Request region [start, end] (1 based, inclusive). Already retrieved regions are not requested again."""
+        with self._lock:
+            if accession in self.missing or self._is_retrieved(accession, start, end):
+                return
+            self.pending.setdefault(accession, set()).add((start, end))
+            self.stats['requested'] += 1
+
+    def _merged_regions(self):
+        merged = []
+        for acc in sorted(self.pending):
+            regions = sorted(self.pending[acc])
+            cs, ce = regions[0]
+            for s, e in regions[1:]:
+                if s <= ce + 1:
+                    ce = max(ce, e)
+                else:
+                    merged.append((acc, cs, ce))
+                    cs, ce = s, e
+            merged.append((acc, cs, ce))
+        return merged
+
+    def fetch_all(self):
+        """Retrieve all pending regions."""
+        with self._lock:
+            self._fetch_all()
+
+    def _fetch_all(self):
+        merged = self._merged_regions()
+        self.pending = {}
+        if len(merged) == 0:
+            return
+
+        t0 = time()
+        # keep all regions of one accession in one shard so the records can be paired with requests by order
+        shards = [[] for _ in range(min(self.threads, len({r[0] for r in merged})))]
+        acc_shard = {}
+        for region in merged:
+            if region[0] not in acc_shard:
+                acc_shard[region[0]] = len(acc_shard) % len(shards)
+            shards[acc_shard[region[0]]].append(region)
+
+        running = [self._start_blastdbcmd(shard) for shard in shards]
+        for shard, (pcall, entry_file, out_file) in zip(shards, running):
+            try:
+                _, errs = pcall.communicate()
+                if errs:
+                    self._errs.append(errs)
+                with open(out_file, 'r') as bf:
+                    self._read_records(shard, SeqIO.parse(bf, 'fasta'))
+            finally:
+                remove_files_with_try([entry_file, out_file])
+
+        self.missing |= {r[0] for r in merged if r[0] not in self.retrieved}
+
+        self.stats['time'] += time() - t0
+        msg = 'Retrieved {} regions ({} after merging overlaps, {} nt) in {:.2f}s ({:.1f} regions/s).'.format(
+            self.stats['requested'],
+            self.stats['retrieved'],
+            self.stats['nt'],
+            self.stats['time'],
+            self.stats['requested'] / max(self.stats['time'], 1e-6),
+        )
+        ml.info(msg)
+
+    def _start_blastdbcmd(self, shard):
+        fd, entry_file = mkstemp(prefix='rba_', suffix='_25', dir=CONFIG.tmpdir)
+        fdb, out_file = mkstemp(prefix='rba_', suffix='_26', dir=CONFIG.tmpdir)
+        os.close(fdb)
+        with os.fdopen(fd, 'w') as temp_file:
+            for acc, start, end in shard:
+                temp_file.write(acc + ' ' + '-region ' + str(start) + '-' + str(end) + '\n')
+
+        cmd = [
+            '{}blastdbcmd'.format(CONFIG.blast_path),
+            '-dbtype',
+            'nucl',
+            '-db',
+            str(self.blast_db),
+            '-entry_batch',
+            entry_file,
+            '-out',
+            out_file
+        ]
+        ml.debug(cmd)
+
+        try:
+            pcall = Popen(
+                cmd,
+                stdout=PIPE,
+                stderr=PIPE,
+                universal_newlines=True
+            )
+        except FileNotFoundError:
+            msgfail = 'Unable to run blastdbcmd command, please check its availability.'
+            ml.error(msgfail)
+            remove_files_with_try([entry_file, out_file])
+            sys.exit(1)
+        return pcall, entry_file, out_file
+
+    def _read_records(self, shard, records):
+        # missing accessions are not present in the blastdbcmd output, otherwise the order is kept
+        index = 0
+        for parsed_record in records:
+            record_id = parsed_record.id.split(':')[0]
+            while index < len(shard) and shard[index][0] != record_id:
+                index += 1
+            if index == len(shard):
+                raise LookupError('Unexpected sequence {} in blastdbcmd output.'.format(parsed_record.id))
+
+            if parsed_record.description.startswith(parsed_record.id):
+                parsed_record.description = parsed_record.description[len(parsed_record.id):].strip()
+
+            acc, start, end = shard[index]
+            self.retrieved.setdefault(acc, []).append((start, end, parsed_record))
+            self.stats['retrieved'] += 1
+            self.stats['nt'] += len(parsed_record.seq)
+            index += 1
+
+    def _is_retrieved(self, accession, start, end):
+        return any(s <= start and end <= e for s, e, _ in self.retrieved.get(accession, []))
+
+    def has_accession(self, accession):
+        return accession in self.retrieved
+
+    def errors(self):
+        return ''.join(self._errs)
+
+    def get(self, accession, start, end):
+        """Return SeqRecord for region [start, end] (1 based, inclusive) as it would be returned by blastdbcmd."""
+        with self._lock:
+            retrieved = list(self.retrieved.get(accession, []))
+        for s, e, record in retrieved:
+            if s <= start and end <= e:
+                # blastdbcmd returns the region trimmed to the sequence length
+                sub = record[start - s:end - s + 1]
+                sub.id = '{}:{}-{}'.format(accession, start, start + len(sub) - 1)
+                sub.name = sub.id
+                sub.description = record.description
+                return sub
+        raise KeyError('Region {}:{}-{} was not retrieved.'.format(accession, start, end))
+
+
+@contextmanager
+def open_genome_db(args_inner):
+    """Provide GenomeDB shared by all queries of the run for the 'server' database, None for other databases."""
+    if args_inner.db_type != 'server':
+        yield None
+        return
+    # conditional import so we don't need pysam for normal usage
+    from rna_blast_analyze.BR_core.load_from_bgzip import GenomeDB
+    seqdb = GenomeDB(args_inner.blast_db)
+    try:
+        yield seqdb
+    finally:
+        seqdb.close()
+
+
+def expand_hits_from_fasta(hits, database, query_length, extra=0, blast_regexp=None, skip_missing=False, msgs=None, format='fasta', entrez_email=None, blast_input_file=None, region_pool=None):
     """takes list of blast.HSP objects and return extended sequences
+    For 'server' format the region_pool is the GenomeDB opened for the run (see open_genome_db),
+     if not given, the database is opened just for this call.
     :return list of SeqRecord objects (parsed fasta file)
     """
     ml.info('Retrieving sequence neighborhoods for blast hits.')
     ml.debug(fname())
 
     if format == 'server':
-        # conditional import so we don't need pysam for normal usage
-        from rna_blast_analyze.BR_core.load_from_bgzip import GenomeDB
-        seqdb = GenomeDB(database)
+        if region_pool is None:
+            # conditional import so we don't need pysam for normal usage
+            from rna_blast_analyze.BR_core.load_from_bgzip import GenomeDB
+            seqdb = GenomeDB(database)
+        else:
+            seqdb = region_pool
+        # load all regions at once, each genome is read and decompressed only once
+        server_regions = []
+        for hit in hits:
+            _, start, end = _hit_region(hit, query_length, extra)
+            server_regions.append((match_acc(hit[0], blast_regexp), start - 1, end))
+        try:
+            server_records = seqdb.load_regions(server_regions)
+        finally:
+            if region_pool is None:
+                seqdb.close()
 
     if CONFIG.tmpdir is None:
         temp_entrez_file = os.path.join(
@@ -243,54 +339,16 @@ def expand_hits_from_fasta(hits, database, query_length, extra=0, blast_regexp=N
     else:
         known_seq_index = {}
 
+    if format in ['fasta', 'gb']:
+        file_records = _read_file_regions(hits, database, query_length, extra, blast_regexp, format)
+
     exp_hits = []
     strand = []
     for index, hit in enumerate(hits):
-        # +1 here because blastdbcmd counts sequences from 1
-        if hit[1].sbjct_end < hit[1].sbjct_start:
-            # this is hit to minus strand
-            start = hit[1].sbjct_end - _positive_index(query_length - hit[1].query_end) - extra
-            end = hit[1].sbjct_start + hit[1].query_start + extra - 1
-            strand.append(-1)
-            d = {'query_start': hit[1].sbjct_end, 'query_end': hit[1].sbjct_start,
-                 'extended_start': hit[1].sbjct_end - _positive_index(query_length - hit[1].query_end),
-                 'extended_end': hit[1].sbjct_start + hit[1].query_start - 1,
-                 'strand': -1}
-        else:
-            # this is hit to plus strand
-            start = hit[1].sbjct_start - hit[1].query_start + 1 - extra
-            end = hit[1].sbjct_end + _positive_index(query_length - hit[1].query_end) + extra
-            strand.append(1)
-            d = {'query_start': hit[1].sbjct_start, 'query_end': hit[1].sbjct_end,
-                 'extended_start': hit[1].sbjct_start - hit[1].query_start + 1,
-                 'extended_end': hit[1].sbjct_end + _positive_index(query_length - hit[1].query_end),
-                 'strand': 1}
-
-        # ====== information about possible trim ======
-        # assume ok
-        d['trimmed_ss'] = False
-        d['trimmed_se'] = False
-        d['trimmed_es'] = False
-        d['trimmed_ee'] = False
-
-        d['super_start'] = start
-        d['super_end'] = end
-
-        if start < 1:
-            start = 1                    # index from which sequence should be retrieved from the db
-            d['trimmed_ss'] = True
-
-        # repair possible extended start violation
-        if d['extended_start'] < 1:
-            d['trimmed_es'] = True
-
-        # add blast record
-        d['blast'] = hit
+        d, start, end = _hit_region(hit, query_length, extra)
+        strand.append(d['strand'])
 
-        try:
-            bdb_accession = match_acc(hit[0], blast_regexp)
-        except exceptions.AccessionMatchException as e:
-            raise e
+        bdb_accession = match_acc(hit[0], blast_regexp)
 
         d['blast'][0] = bdb_accession
 
@@ -302,6 +360,7 @@ def expand_hits_from_fasta(hits, database, query_length, extra=0, blast_regexp=N
                     msgwarn = 'Sequence {} not found in provided db. Skipping.'.format(bdb_accession)
                     msgs.append(msgwarn)
                     ml.warning(msgwarn)
+                    continue
                 else:
                     msgerror = 'Sequence {} not found in provided db. ' \
                                'Please provide correct database or give "--skip_missing" flag.'.format(
@@ -310,13 +369,11 @@ def expand_hits_from_fasta(hits, database, query_length, extra=0, blast_regexp=N
                     ml.error(msgerror)
                     raise LookupError(msgerror)
 
-            with open(ff, 'r') as handle:
-                ext_seq = next(SeqIO.parse(handle, format=format))
-                parsed_record = ext_seq[start - 1:end]
+            parsed_record = file_records[index]
 
         elif format == 'server':
             # only used when server
-            parsed_record = seqdb.load_genome(bdb_accession, start - 1, end)
+            parsed_record = server_records[index]
 
         elif format == 'entrez':
             prnt_line = '{:3d}% {}'.format(floor(index * 100 / len(hits)), bdb_accession)
@@ -373,40 +430,7 @@ def expand_hits_from_fasta(hits, database, query_length, extra=0, blast_regexp=N
         # add uid to ensure that all hits are unique
         parsed_record.id = 'uid:' + str(index) + '|' + record_id
 
-        if d['trimmed_ss']:
-            if d['super_start'] + len(parsed_record.seq) < d['super_end'] + d['super_start']:
-                parsed_record.annotations['trimmed_se'] = True
-                if d['trimmed_es']:
-                    if len(parsed_record.seq) < d['extended_end'] + d['extended_start']:
-                        parsed_record.annotations['trimmed_ee'] = True
-                else:
-                    if len(parsed_record.seq) < d['extended_end'] - d['extended_start']:
-                        parsed_record.annotations['trimmed_ee'] = True
-        else:
-            if d['super_start'] + len(parsed_record.seq) - 1 < d['super_end']:
-                parsed_record.annotations['trimmed_se'] = True
-                if d['super_start'] + len(parsed_record.seq) - 1 < d['extended_end']:
-                    parsed_record.annotations['trimmed_ee'] = True
-
-        msgsub = '{}: Sequence cannot be extended sufficiently'.format(parsed_record.id)
-        if parsed_record.annotations['trimmed_ss']:
-            msgwarn = msgsub + '. Missing {} nt upstream in the genome.'.format(parsed_record.annotations['super_start'])
-            parsed_record.annotations['msgs'].append(msgwarn)
-            ml.warning(msgwarn)
-        if parsed_record.annotations['trimmed_se']:
-            msgwarn = msgsub + '. Missing nt downstream in the genome.'.format(parsed_record.id)
-            parsed_record.annotations['msgs'].append(msgwarn)
-            ml.warning(msgwarn)
-        if parsed_record.annotations['trimmed_es']:
-            msgwarn = msgsub + ' by unaligned portion of query. THIS IS PROBABLY FRAGMENT!'
-            msgwarn += ' Trimmed upstream.'
-            parsed_record.annotations['msgs'].append(msgwarn)
-            ml.warning(msgwarn)
-        if parsed_record.annotations['trimmed_ee']:
-            msgwarn = msgsub + ' by unalined portion of query. THIS IS PROBABLY FRAGMENT!'
-            msgwarn += ' Trimmed downstream.'
-            parsed_record.annotations['msgs'].append(msgwarn)
-            ml.warning(msgwarn)
+        _annotate_trimmed(parsed_record, parsed_record.id)
 
         exp_hits.append(parsed_record)
 
@@ -417,6 +441,117 @@ def expand_hits_from_fasta(hits, database, query_length, extra=0, blast_regexp=N
     return exp_hits, strand
 
 
+def _read_file_regions(hits, database, query_length, extra, blast_regexp, format):
+    """Read regions of the hits from the "--db_type fasta|gb" database.
+    Each file is opened (and parsed or indexed) only once for all hits to it and closed when its regions are read.
+    :return: {index of hit: SeqRecord}, hits to missing files are left out
+    """
+    by_file = OrderedDict()
+    for index, hit in enumerate(hits):
+        _, start, end = _hit_region(hit, query_length, extra)
+        ff = os.path.join(database, match_acc(hit[0], blast_regexp))
+        if os.path.isfile(ff):
+            by_file.setdefault(ff, []).append((index, start, end))
+
+    records = {}
+    for ff, regions in by_file.items():
+        seq_file = IndexedSequenceFile(ff, format=format)
+        try:
+            for index, start, end in regions:
+                records[index] = seq_file.fetch(start - 1, end)
+        finally:
+            seq_file.close()
+    return records
+
+
+def _hit_region(hit, query_length, extra):
+    """Compute region of the subject sequence needed for extension of the blast hit.
+
+    :param hit: [hit_id, Bio.Blast.Record.HSP]
+    :param query_length: length of the query sequence
+    :param extra: number of nucleotides to add on each side
+    :return: (annotations dict, start, end) where start, end are 1 based indexes to the subject sequence
+    """
+    # +1 here because blastdbcmd counts sequences from 1
+    if hit[1].sbjct_end < hit[1].sbjct_start:
+        # this is hit to minus strand
+        start = hit[1].sbjct_end - _positive_index(query_length - hit[1].query_end) - extra
+        end = hit[1].sbjct_start + hit[1].query_start + extra - 1
+        d = {'query_start': hit[1].sbjct_end, 'query_end': hit[1].sbjct_start,
+             'extended_start': hit[1].sbjct_end - _positive_index(query_length - hit[1].query_end),
+             'extended_end': hit[1].sbjct_start + hit[1].query_start - 1,
+             'strand': -1}
+    else:
+        # this is hit to plus strand
+        start = hit[1].sbjct_start - hit[1].query_start + 1 - extra
+        end = hit[1].sbjct_end + _positive_index(query_length - hit[1].query_end) + extra
+        d = {'query_start': hit[1].sbjct_start, 'query_end': hit[1].sbjct_end,
+             'extended_start': hit[1].sbjct_start - hit[1].query_start + 1,
+             'extended_end': hit[1].sbjct_end + _positive_index(query_length - hit[1].query_end),
+             'strand': 1}
+
+    # ====== information about possible trim ======
+    # assume ok
+    d['trimmed_ss'] = False
+    d['trimmed_se'] = False
+    d['trimmed_es'] = False
+    d['trimmed_ee'] = False
+
+    d['super_start'] = start
+    d['super_end'] = end
+
+    if start < 1:
+        start = 1                    # index from which sequence should be retrieved from the db
+        d['trimmed_ss'] = True
+
+    # repair possible extended start violation
+    if d['extended_start'] < 1:
+        d['trimmed_es'] = True
+
+    # add blast record
+    d['blast'] = hit
+    return d, start, end
+
+
+def _annotate_trimmed(parsed_record, record_name):
+    """Set trimmed_se and trimmed_ee flags by length of retrieved sequence and add warnings."""
+    d = parsed_record.annotations
+    if d['trimmed_ss']:
+        if d['super_start'] + len(parsed_record.seq) < d['super_end'] + d['super_start']:
+            d['trimmed_se'] = True
+            if d['trimmed_es']:
+                if len(parsed_record.seq) < d['extended_end'] + d['extended_start']:
+                    d['trimmed_ee'] = True
+            else:
+                if len(parsed_record.seq) < d['extended_end'] - d['extended_start']:
+                    d['trimmed_ee'] = True
+    else:
+        if d['super_start'] + len(parsed_record.seq) - 1 < d['super_end']:
+            d['trimmed_se'] = True
+            if d['super_start'] + len(parsed_record.seq) - 1 < d['extended_end']:
+                d['trimmed_ee'] = True
+
+    msgsub = '{}: Sequence cannot be extended sufficiently'.format(record_name)
+    if d['trimmed_ss']:
+        msgwarn = msgsub + '. Missing {} nt upstream in the genome.'.format(d['super_start'])
+        d['msgs'].append(msgwarn)
+        ml.warning(msgwarn)
+    if d['trimmed_se']:
+        msgwarn = msgsub + '. Missing nt downstream in the genome.'
+        d['msgs'].append(msgwarn)
+        ml.warning(msgwarn)
+    if d['trimmed_es']:
+        msgwarn = msgsub + ' by unaligned portion of query. THIS IS PROBABLY FRAGMENT!'
+        msgwarn += ' Trimmed upstream.'
+        d['msgs'].append(msgwarn)
+        ml.warning(msgwarn)
+    if d['trimmed_ee']:
+        msgwarn = msgsub + ' by unalined portion of query. THIS IS PROBABLY FRAGMENT!'
+        msgwarn += ' Trimmed downstream.'
+        d['msgs'].append(msgwarn)
+        ml.warning(msgwarn)
+
+
 def _positive_index(o):
     """
     this ensures that indexes stay positive and would not colapse extended sequence
@@ -426,19 +561,3 @@ def _positive_index(o):
     if o < 0:
         o = 0
     return o
-
-
-def _get_correct_blast_hit(id, loc, index, skip):
-    if loc[index]['blast'][0] == id:
-        return index
-    elif loc[index]['blast'][0] != id and skip:
-        msgwarn = 'Sequence {} not found in provided db. Skipping.'.format(loc[index]['blast'][0])
-        ml.warning(msgwarn)
-        return _get_correct_blast_hit(id, loc, index + 1, skip)
-    else:
-        msgerror = 'Sequence {} not found in provided db. ' \
-                   'Please provide correct database or give "--skip_missing" flag.'.format(
-            loc[index]['blast'][0]
-        )
-        ml.error(msgerror)
-        raise LookupError(msgerror)
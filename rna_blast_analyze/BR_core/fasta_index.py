@@ -0,0 +1,169 @@
+import os
+import logging
+from hashlib import sha1
+
+from Bio import SeqIO
+from Bio.Alphabet import single_letter_alphabet
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from rna_blast_analyze.BR_core.config import CONFIG
+
+ml = logging.getLogger('rboAnalyzer')
+
+
+class IrregularFastaException(Exception):
+    pass
+
+
+def build_fai(fasta_file):
+    """Compute samtools faidx compatible index for fasta file.
+
+    :param fasta_file: path to fasta file
+    :return: list of (name, length, offset, linebases, linewidth)
+    :raises IrregularFastaException: when sequence lines of a record are not of equal length
+    """
+    index = []
+    with open(fasta_file, 'rb') as f:
+        name = None
+        pos = 0
+        for line in f:
+            if line.startswith(b'>'):
+                if name is not None:
+                    index.append(_fai_record(name, record_lines, offset))
+                name = line[1:].split()[0].decode()
+                offset = pos + len(line)
+                record_lines = []
+            elif name is not None:
+                record_lines.append(line)
+            pos += len(line)
+        if name is not None:
+            index.append(_fai_record(name, record_lines, offset))
+    return index
+
+
+def _fai_record(name, lines, offset):
+    # trailing empty lines are allowed
+    while lines and len(lines[-1].strip()) == 0:
+        lines.pop()
+    if not lines:
+        return name, 0, offset, 0, 0
+
+    linebases = len(lines[0].rstrip(b'\r\n'))
+    linewidth = len(lines[0])
+    for line in lines[:-1]:
+        if len(line) != linewidth or len(line.rstrip(b'\r\n')) != linebases:
+            raise IrregularFastaException('Different line lengths in record {}.'.format(name))
+    if len(lines[-1].rstrip(b'\r\n')) > linebases:
+        raise IrregularFastaException('Different line lengths in record {}.'.format(name))
+
+    length = linebases * (len(lines) - 1) + len(lines[-1].rstrip(b'\r\n'))
+    return name, length, offset, linebases, linewidth
+
+
+def read_fai(fai_file):
+    with open(fai_file, 'r') as f:
+        return [
+            (l[0], int(l[1]), int(l[2]), int(l[3]), int(l[4])) for l in (line.split('\t') for line in f)
+        ]
+
+
+def write_fai(fai_file, index):
+    tmp_file = fai_file + '.tmp{}'.format(os.getpid())
+    with open(tmp_file, 'w') as f:
+        for rec in index:
+            f.write('\t'.join(str(i) for i in rec) + '\n')
+    os.replace(tmp_file, fai_file)
+
+
+def _cached_fai_file(fasta_file):
+    """Path of the index of fasta_file in the cache_dir or None if the cache is disabled."""
+    if not CONFIG.cache_dir:
+        return None
+    name = sha1(os.path.abspath(fasta_file).encode()).hexdigest() + '.fai'
+    return os.path.join(CONFIG.cache_dir, 'fasta_index', name)
+
+
+def load_or_build_fai(fasta_file):
+    """Return fai index for fasta file.
+    Up to date index [fasta_file].fai (e.g. from samtools faidx) is used if present. Otherwise the index is built
+     and stored in the fasta_index directory of the cache_dir (the database directory is not written to),
+     it is kept in memory only if the cache is disabled or not writable.
+    """
+    cached_fai = _cached_fai_file(fasta_file)
+    for fai_file in (fasta_file + '.fai', cached_fai):
+        if fai_file is None or not os.path.isfile(fai_file):
+            continue
+        if os.path.getmtime(fai_file) >= os.path.getmtime(fasta_file):
+            try:
+                return read_fai(fai_file)
+            except (ValueError, IndexError):
+                ml.debug('Ignoring malformed index {}.'.format(fai_file))
+
+    index = build_fai(fasta_file)
+    if cached_fai is not None:
+        try:
+            os.makedirs(os.path.dirname(cached_fai), exist_ok=True)
+            write_fai(cached_fai, index)
+        except OSError:
+            ml.debug('Could not write index {}, keeping it in memory only.'.format(cached_fai))
+    return index
+
+
+class IndexedSequenceFile(object):
+    """Random access to the first record of a genome file in the "--db_type fasta|gb" database.
+
+    For fasta files only the requested region is read using the fai index.
+    Genbank files (and fasta files which can't be indexed) are parsed once and kept in memory.
+    """
+    def __init__(self, seq_file, format='fasta'):
+        self.seq_file = seq_file
+        self.format = format
+        self._handle = None
+        self._record = None
+        self._fai = None
+
+        if format == 'fasta':
+            try:
+                index = load_or_build_fai(seq_file)
+                if index:
+                    self._fai = index[0]
+                    self._handle = open(seq_file, 'rb')
+                    self.description = self._handle.readline()[1:].decode().rstrip()
+            except IrregularFastaException as e:
+                ml.debug('Could not index {}: {}'.format(seq_file, str(e)))
+
+        if self._fai is None:
+            with open(seq_file, 'r') as handle:
+                self._record = next(SeqIO.parse(handle, format=format))
+
+    def fetch(self, start, end):
+        """Return SeqRecord for the region with python slicing semantics (0 based, end exclusive).
+        The result is same as slicing the SeqRecord parsed with SeqIO.
+        """
+        if self._record is not None:
+            return self._record[start:end]
+
+        name, length, offset, linebases, linewidth = self._fai
+        start = max(0, min(start, length))
+        end = max(start, min(end, length))
+
+        seq = b''
+        if end > start:
+            begin = offset + (start // linebases) * linewidth + start % linebases
+            stop = offset + ((end - 1) // linebases) * linewidth + (end - 1) % linebases + 1
+            self._handle.seek(begin)
+            seq = self._handle.read(stop - begin).replace(b'\n', b'').replace(b'\r', b'')
+
+        return SeqRecord(
+            Seq(seq.decode(), single_letter_alphabet),
+            id=name,
+            name=name,
+            description=self.description,
+        )
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+        self._record = None
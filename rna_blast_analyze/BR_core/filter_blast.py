@@ -1,6 +1,7 @@
 import operator
 import logging
 from rna_blast_analyze.BR_core.fname import fname
+from rna_blast_analyze.BR_core.hit_table import HitTable
 
 ml = logging.getLogger('rboAnalyzer')
 
@@ -15,19 +16,14 @@ OPERATIONS = {
 
 def filter_by_eval(blast_hitlist, getter, filter_conditions):
     ml.debug(fname())
-
-    result = blast_hitlist
-    for relation, condition in filter_conditions:
-        result = [h for h in result if OPERATIONS[relation](getter(h).expect, condition)]
-    return result
+    return _filter_by_column(blast_hitlist, getter, 'expect', filter_conditions)
 
 
 def filter_by_bits(blast_hitlist, getter, filter_conditions):
     ml.debug(fname())
-
-    result = blast_hitlist
-    for relation, condition in filter_conditions:
-        result = [h for h in result if OPERATIONS[relation](getter(h).bits, condition)]
-    return result
+    return _filter_by_column(blast_hitlist, getter, 'bits', filter_conditions)
 
 
+def _filter_by_column(blast_hitlist, getter, column, filter_conditions):
+    table = HitTable(blast_hitlist, getter)
+    return table.select(table.mask(column, filter_conditions, OPERATIONS))
@@ -0,0 +1,181 @@
+"""MFE folding with RNAfold parameters.
+
+Sequences are folded in-process with RNAlib (ViennaRNA python bindings) when it is available and all given RNAfold
+ parameters are supported, otherwise the RNAfold executable is used.
+"""
+import argparse
+import logging
+import os
+import shlex
+from functools import partial
+from tempfile import mkstemp
+
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from rna_blast_analyze.BR_core.BA_support import read_seq_str, parse_seq_str, remove_one_file_with_try
+from rna_blast_analyze.BR_core.config import CONFIG
+from rna_blast_analyze.BR_core.parallel import pool_for
+from rna_blast_analyze.BR_core.viennaRNA import rnafold_fasta
+
+try:
+    import RNA
+except ImportError:
+    RNA = None
+
+ml = logging.getLogger('rboAnalyzer')
+
+
+def _rnafold_option_parser():
+    p = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
+    p.add_argument('-C', '--constraint', action='store_true')
+    p.add_argument('--enforceConstraint', action='store_true')
+    p.add_argument('--noLP', action='store_true')
+    p.add_argument('--noGU', action='store_true')
+    p.add_argument('--noClosingGU', action='store_true')
+    p.add_argument('--noconv', action='store_true')
+    p.add_argument('--noPS', action='store_true')
+    p.add_argument('-T', '--temp', type=float)
+    p.add_argument('-d', '--dangles', type=int, choices=[0, 1, 2, 3])
+    p.add_argument('-P', '--paramFile', type=str)
+    p.add_argument('--maxBPspan', type=int)
+    p.add_argument('-j', '--jobs', type=str, nargs='?')
+    return p
+
+
+def rnalib_options(params):
+    """Convert RNAfold commandline parameters to options for in-process folding.
+    Return None if RNAlib is not available or some parameter is not supported.
+    """
+    if RNA is None:
+        return None
+    try:
+        args, unknown = _rnafold_option_parser().parse_known_args(shlex.split(params))
+    except SystemExit:
+        return None
+    if unknown:
+        ml.debug('RNAfold parameters {} not supported by RNAlib backend.'.format(unknown))
+        return None
+    return vars(args)
+
+
+def backend_version():
+    """Identify RNAlib used for folding (the RNAfold executable is identified by the caller)."""
+    return 'RNAlib {}'.format(RNA.__version__) if RNA is not None else 'RNAfold'
+
+
+def _model_details(options):
+    md = RNA.md()
+    if options['temp'] is not None:
+        md.temperature = options['temp']
+    if options['dangles'] is not None:
+        md.dangles = options['dangles']
+    if options['maxBPspan'] is not None:
+        md.max_bp_span = options['maxBPspan']
+    md.noLP = int(options['noLP'])
+    md.noGU = int(options['noGU'])
+    md.noGUclosure = int(options['noClosingGU'])
+    return md
+
+
+def _fold_one(pack, options=None):
+    """Fold one (sequence, constraint) pair, return mfe structure."""
+    seq, constraint = pack
+    param_file = options['paramFile'] or None
+    if _fold_one.params_loaded != param_file:
+        # energy parameters are global in RNAlib, they are loaded when they differ from the last fold in the process
+        #  and the default ones are restored for folds without -P
+        if param_file is None:
+            RNA.params_load_RNA_Turner2004()
+        else:
+            RNA.params_load(param_file)
+        _fold_one.params_loaded = param_file
+    fc = RNA.fold_compound(seq, _model_details(options))
+    if options['constraint'] and constraint:
+        flags = RNA.CONSTRAINT_DB_DEFAULT
+        if options['enforceConstraint']:
+            flags |= RNA.CONSTRAINT_DB_ENFORCE_BP
+        fc.hc_add_from_db(constraint, flags)
+    structure, _ = fc.mfe()
+    return structure
+
+
+_fold_one.params_loaded = None
+
+
+def _read_fasta(fastafile):
+    """Records of (multiline) fasta file with id and description as given by parse_seq_str."""
+    records = []
+    with open(fastafile, 'r') as f:
+        header = None
+        lines = []
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('>'):
+                if header is not None:
+                    records.append((header, ''.join(lines)))
+                header = line[1:]
+                lines = []
+            else:
+                lines.append(line)
+        if header is not None:
+            records.append((header, ''.join(lines)))
+
+    out = []
+    for header, seq in records:
+        name = header.strip().split(' ')
+        rec = SeqRecord(Seq(seq), id=name[0], description=' '.join(name[1:]))
+        rec.annotations['sss'] = ['ss0']
+        out.append(rec)
+    return out
+
+
+def fold_fasta(fastafile, params='', threads=1, timeout=None):
+    """Predict mfe structure for each sequence in fastafile.
+
+    With -C in params, the file is expected in "sequence, constraint" format (as for RNAfold -C).
+    The timeout applies only to the RNAfold executable.
+    :return: list of SeqRecords with the structure in 'ss0' letter annotation (as read_seq_str)
+    """
+    options = rnalib_options(params)
+    if options is None:
+        fd, structure_output_file = mkstemp(prefix='rba_', suffix='_54', dir=CONFIG.tmpdir)
+        os.close(fd)
+
+        structure_output_file = rnafold_fasta(fastafile, structure_output_file, params, timeout=timeout)
+
+        structures = read_seq_str(structure_output_file)
+        remove_one_file_with_try(structure_output_file)
+        return structures
+
+    if options['constraint']:
+        with open(fastafile, 'r') as f:
+            records = list(parse_seq_str(f))
+        constraints = [rec.letter_annotations['ss0'] for rec in records]
+    else:
+        records = _read_fasta(fastafile)
+        constraints = [None] * len(records)
+
+    sequences = []
+    for rec in records:
+        s = str(rec.seq).upper()
+        if not options['noconv']:
+            s = s.replace('T', 'U')
+        sequences.append(s)
+
+    with pool_for(threads) as pool:
+        structures = pool.map(
+            partial(_fold_one, options=options),
+            list(zip(sequences, constraints)),
+            desc='RNAfold (RNAlib)'
+        )
+
+    out = []
+    for rec, s, structure in zip(records, sequences, structures):
+        nrec = SeqRecord(Seq(s), id=rec.id, description=rec.description)
+        nrec.annotations['sss'] = ['ss0']
+        nrec.letter_annotations['ss0'] = structure
+        out.append(nrec)
+    return out
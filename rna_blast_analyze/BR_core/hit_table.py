@@ -0,0 +1,62 @@
+"""Columnar view of BLAST hits.
+
+The numeric values of the BLAST HSPs (e-value, bit score, coordinates) are read into NumPy arrays, one row per hit,
+ so the hits can be filtered (or exported) by whole column operations instead of attribute lookups per hit and
+ per condition. The table keeps reference to the hits it was built from, selection returns the hit objects.
+"""
+from itertools import compress
+from operator import attrgetter
+
+import numpy as np
+
+from rna_blast_analyze.BR_core.BA_support import blast_hit_getter_from_subseq
+
+HSP_COLUMNS = {
+    'expect': np.float64,
+    'bits': np.float64,
+    'score': np.float64,
+    'query_start': np.int64,
+    'query_end': np.int64,
+    'sbjct_start': np.int64,
+    'sbjct_end': np.int64,
+    'align_length': np.int64,
+}
+
+
+class HitTable(object):
+    """
+    NumPy columns of BLAST HSP values of the hits
+    hits = list of hits in any format, getter = function returning the Bio.Blast.Record.HSP of one hit
+    the columns are read from the HSPs on first access
+    """
+    def __init__(self, hits, getter=blast_hit_getter_from_subseq):
+        self.hits = hits
+        self._hsps = list(map(getter, hits))
+        self._columns = {}
+
+    def __len__(self):
+        return len(self._hsps)
+
+    def __getitem__(self, name):
+        if name not in self._columns:
+            if name not in HSP_COLUMNS:
+                raise KeyError('Unknown hit table column: {}'.format(name))
+            self._columns[name] = np.fromiter(
+                map(attrgetter(name), self._hsps), dtype=HSP_COLUMNS[name], count=len(self._hsps)
+            )
+        return self._columns[name]
+
+    def mask(self, name, conditions, operations):
+        """
+        boolean mask of hits satisfying all the conditions on the column
+        conditions = [(relation, value), ...], operations = dict relation: function (e.g. filter_blast.OPERATIONS)
+        """
+        column = self[name]
+        selected = np.ones(len(column), dtype=bool)
+        for relation, value in conditions:
+            selected &= operations[relation](column, value)
+        return selected
+
+    def select(self, mask):
+        """list of the hits where mask is True, in original order"""
+        return list(compress(self.hits, mask.tolist()))
@@ -1,6 +1,6 @@
 import os
 import logging
-import multiprocessing
+from functools import partial
 from subprocess import call
 from tempfile import mkstemp, TemporaryFile
 
@@ -9,17 +9,18 @@ from Bio import SeqIO
 from rna_blast_analyze.BR_core.BA_support import rebuild_structures_output_from_pred, ct2db, remove_one_file_with_try, remove_files_with_try
 from rna_blast_analyze.BR_core import exceptions
 from rna_blast_analyze.BR_core.config import CONFIG
+from rna_blast_analyze.BR_core.parallel import pool_for
 
 ml = logging.getLogger('rboAnalyzer')
 
 
-def _run_hybrid_ss_min_wrapper(seq, P, W, M):
+def _run_hybrid_ss_min_wrapper(seq, P, W, M, timeout=None):
     fd, tmp_fasta = mkstemp(prefix='rba_', suffix='_06', dir=CONFIG.tmpdir)
     try:
         with os.fdopen(fd, 'w') as fid:
             fid.write('>{}\n{}\n'.format(seq.id, str(seq.seq)))
 
-        predicted_ss = _run_hybrid_ss_min_single(tmp_fasta, P, W, M)
+        predicted_ss = _run_hybrid_ss_min_single(tmp_fasta, P, W, M, timeout=timeout)
         return predicted_ss[0]
 
     except exceptions.HybridssminException as e:
@@ -98,14 +99,13 @@ def run_hybrid_ss_min(in_path, mfold=(10, 2, 20), threads=1, timeout=None):
             suboptimals = []
             for seq in SeqIO.parse(in_path, format='fasta'):
                 suboptimals.append(
-                    _run_hybrid_ss_min_wrapper(seq, P, W, M)
+                    _run_hybrid_ss_min_wrapper(seq, P, W, M, timeout=timeout)
                 )
     else:
 
         tuples = [(seq, P, W, M) for seq in SeqIO.parse(in_path, format='fasta')]
-        # timeout not used with multiprocessing
-        with multiprocessing.Pool(processes=threads) as pool:
-            suboptimals = pool.starmap(_run_hybrid_ss_min_wrapper, tuples)
+        with pool_for(threads) as pool:
+            suboptimals = pool.starmap(partial(_run_hybrid_ss_min_wrapper, timeout=timeout), tuples, desc='hybrid-ss-min')
 
     with open(in_path, 'r') as fin:
         inseqs = [s for s in SeqIO.parse(fin, format='fasta')]
@@ -1,13 +1,19 @@
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from tempfile import mkstemp
 from copy import deepcopy
 import logging
 
+import pandas as pd
+from Bio import SeqIO
+from Bio.SeqRecord import SeqRecord
+
 import rna_blast_analyze.BR_core.BA_support as BA_support
 import rna_blast_analyze.BR_core.viennaRNA
-from rna_blast_analyze.BR_core.cmalign import run_cmalign_on_fasta, read_cmalign_sfile, run_cmbuild, run_cmfetch, \
-    RfamInfo, get_cm_model_table, select_best_matching_model_from_cmscan
+from rna_blast_analyze.BR_core import cm_store
+from rna_blast_analyze.BR_core.cmalign import run_cmalign_on_fasta, read_cmalign_sfile, run_cmbuild, \
+    RfamInfo, cmscan_tables, select_best_matching_model_from_cmscan
 from rna_blast_analyze.BR_core.stockholm_alig import StockholmAlig
 from rna_blast_analyze.BR_core.stockholm_parser import read_st
 from rna_blast_analyze.BR_core.config import CONFIG
@@ -17,13 +23,40 @@ from rna_blast_analyze.BR_core import exceptions
 
 ml = logging.getLogger('rboAnalyzer')
 
+# number of hits aligned by one cmalign call in the sharded mode (see run_cmalign_scores_sharded)
+CMALIGN_MIN_SHARD = 100
+CMALIGN_MAX_SHARD = 2000
+
+
+def scan_queries(query_file, iterations, threads=None, rfam=None, timeout=None):
+    """
+    Search RFAM for models matching the queries with one cmscan call (the CM database is loaded once).
+    :param query_file: query fasta
+    :param iterations: indexes of the queries (order in the query_file) to search
+    :return: dict {iteration: cmscan table of the query} or None if cmscan failed
+    """
+    ml.info('Infer homology - searching RFAM for best matching models of {} queries.'.format(len(iterations)))
+    wanted = set(iterations)
+    selected = [(i, rec) for i, rec in enumerate(SeqIO.parse(query_file, 'fasta')) if i in wanted]
+    tables = cmscan_tables([rec for _, rec in selected], threads=threads, rfam=rfam, timeout=timeout)
+    if tables is None:
+        return None
+    return {iteration: tables[n] for n, (iteration, _) in enumerate(selected)}
+
 
-def find_and_extract_cm_model(args, analyzed_hits, rfam=None, timeout=None):
+def find_and_extract_cm_model(args, analyzed_hits, rfam=None, timeout=None, cmscan_results=None):
+    """
+    :param cmscan_results: cmscan table of the query if it was searched already (see scan_queries),
+        when None the query is searched now
+    """
     if rfam is None:
         rfam = RfamInfo()
 
-    ml.info('Infer homology - searching RFAM for best matching model.')
-    cmscan_results = get_cm_model_table(args.blast_query, threads=args.threads, rfam=rfam, timeout=timeout)
+    if cmscan_results is None:
+        ml.info('Infer homology - searching RFAM for best matching model.')
+        tables = cmscan_tables([analyzed_hits.query], threads=args.threads, rfam=rfam, timeout=timeout)
+        if tables is not None:
+            cmscan_results = tables[0]
     best_matching_cm_model = select_best_matching_model_from_cmscan(cmscan_results)
     analyzed_hits.best_matching_model = best_matching_cm_model
 
@@ -45,7 +78,9 @@ def find_and_extract_cm_model(args, analyzed_hits, rfam=None, timeout=None):
                 ml.error('No RFAM model was matched with score > 0. Nothing to build homology to.')
                 raise exceptions.MissingCMexception
 
-            cm_model_file = run_cmfetch(rfam.file_path, analyzed_hits.best_matching_model['target_name'], timeout=timeout)
+            cm_model_file = cm_store.fetch_model(
+                analyzed_hits.best_matching_model['target_name'], rfam=rfam, timeout=timeout
+            )
         else:
             ml.info('Infer homology - using RSEARCH to build model')
             # default to using RSEARCH
@@ -65,7 +100,6 @@ def infer_homology(analyzed_hits, args, cm_model_file, multi_query=False, iterat
     """
     ml.info('Infering homology...')
     ml.debug(fname())
-    bits, eval, loc_score, alig_length = hit_cons_characteristic(analyzed_hits.hits)
 
     # always run cmscan on rfam for informative reasons
     #  but use inferred CM only if --use_rfam was given
@@ -76,43 +110,15 @@ def infer_homology(analyzed_hits, args, cm_model_file, multi_query=False, iterat
     # This code is moved to each extension method to allow fail-fast if model is found in RFAM
     # cm_model_file, analyzed_hits = find_and_extract_cm_model(args, analyzed_hits)
 
-    # include query seq in fasta file to get relevant bit score
-    fd_f, fd_fasta = mkstemp(prefix='rba_', suffix='_28', dir=CONFIG.tmpdir)
-    with os.fdopen(fd_f, 'w') as f:
-        for seq in [analyzed_hits.query] + analyzed_hits.res_2_record_list():
-            f.write('>{}\n{}\n'.format(
-                seq.id,
-                str(seq.seq))
-            )
-
-    cm_msa, cm_align_scores = run_cmalign_with_scores(fd_fasta, cm_model_file, threads=args.threads, timeout=timeout)
-
-    _add_rsearch_align_scores2anal_hits(analyzed_hits, cm_align_scores)
-
-    # remove first 1 (query) from the prediction scores
-    prediction = infer_hits_cm(cm_align_scores[1:].bit_sc)
+    prediction, cm_msa_conservation = score_hits(
+        analyzed_hits.query, analyzed_hits.hits, cm_model_file, threads=args.threads, timeout=timeout,
+        conservation=bool(args.repredict_file)
+    )
 
     # write scores to a table, compute it for all data and run some correlation statistics
     if args.repredict_file:
-        # note that the first score is for the query and act as a benchmark here
-        cm_msa_conservation = alignment_sequence_conservation(cm_msa, gap_chars='-.')
-
         repredict_file = BA_support.iter2file_name(args.repredict_file, multi_query, iteration)
-        with open(repredict_file, 'w') as f:
-            _print_table_for_corelation(
-                f,
-                cm_align_scores.seq_name[1:],
-                bits,
-                eval,
-                loc_score,
-                alig_length,
-                cm_msa_conservation[1:],
-                cm_align_scores.bit_sc[1:],
-                cm_msa_conservation[0],
-                cm_align_scores.bit_sc[0]
-            )
-
-    BA_support.remove_one_file_with_try(fd_fasta)
+        write_repredict_table(repredict_file, analyzed_hits.query, analyzed_hits.hits, cm_msa_conservation)
 
     selected_hits = [hit.extension for b, hit in zip(prediction, analyzed_hits.hits) if b]
 
@@ -120,11 +126,71 @@ def infer_homology(analyzed_hits, args, cm_model_file, multi_query=False, iterat
         r_cm_file = cm_model_file
     else:
         r_cm_file = None
-        BA_support.remove_one_file_with_try(cm_model_file)
+        cm_store.release(cm_model_file)
 
     return prediction, selected_hits, r_cm_file
 
 
+def score_hits(query, hits, cm_model_file, threads=None, timeout=None, conservation=False):
+    """
+    Align the query and the hit extensions to the CM, add the cmalign scores ('cmstat') and the homology estimate
+     to the query and the extensions.
+    :param hits: Subsequences, the extensions are scored
+    :param conservation: compute conservation of the sequences in the alignment of all of them,
+        otherwise the sequences are only scored (in shards, without building the alignment)
+    :return: (homology prediction of the hits, conservation of [query] + hits or None)
+    """
+    # include query seq to get relevant bit score
+    records = [query] + [hit.extension for hit in hits]
+    # the sequences are renamed, the extensions of one hit by different methods have the same id
+    renamed = [SeqRecord(rec.seq, id='s{}'.format(i), description='') for i, rec in enumerate(records)]
+
+    if conservation:
+        fd_f, fd_fasta = mkstemp(prefix='rba_', suffix='_28', dir=CONFIG.tmpdir)
+        with os.fdopen(fd_f, 'w') as f:
+            for seq in renamed:
+                f.write('>{}\n{}\n'.format(
+                    seq.id,
+                    str(seq.seq))
+                )
+
+        cm_msa, cm_align_scores = run_cmalign_with_scores(fd_fasta, cm_model_file, threads=threads, timeout=timeout)
+        BA_support.remove_one_file_with_try(fd_fasta)
+        # note that the first score is for the query and act as a benchmark here
+        cm_msa_conservation = alignment_sequence_conservation(cm_msa, gap_chars='-.')
+    else:
+        cm_align_scores = run_cmalign_scores_sharded(renamed, cm_model_file, threads=threads, timeout=timeout)
+        cm_msa_conservation = None
+
+    if list(cm_align_scores.seq_name) != [rec.id for rec in renamed]:
+        raise AssertionError('cmalign scores do not match the aligned sequences.')
+    cm_align_scores['seq_name'] = [rec.id for rec in records]
+
+    _add_rsearch_align_scores2anal_hits(query, hits, cm_align_scores)
+
+    # remove first 1 (query) from the prediction scores
+    prediction = infer_hits_cm(cm_align_scores[1:].bit_sc)
+    return prediction, cm_msa_conservation
+
+
+def write_repredict_table(repredict_file, query, hits, cm_msa_conservation):
+    """Write the table for correlation analysis of hits scored by score_hits with conservation of [query] + hits."""
+    bits, eval, loc_score, alig_length = hit_cons_characteristic(hits)
+    with open(repredict_file, 'w') as f:
+        _print_table_for_corelation(
+            f,
+            [hit.extension.id for hit in hits],
+            bits,
+            eval,
+            loc_score,
+            alig_length,
+            cm_msa_conservation[1:],
+            [hit.extension.annotations['cmstat']['bit_sc'] for hit in hits],
+            cm_msa_conservation[0],
+            query.annotations['cmstat']['bit_sc']
+        )
+
+
 def run_cmalign_with_scores(fasta_file, cm_file, threads=None, timeout=None):
     fd_sfile, cm_sfile_path = mkstemp(prefix='rba_', suffix='_29', dir=CONFIG.tmpdir)
     os.close(fd_sfile)
@@ -151,6 +217,64 @@ def run_cmalign_with_scores(fasta_file, cm_file, threads=None, timeout=None):
     return cm_msa, cm_align_scores
 
 
+def _cmalign_shard_scores(records, cm_file, threads=None, timeout=None):
+    fd_f, fasta_file = mkstemp(prefix='rba_', suffix='_28', dir=CONFIG.tmpdir)
+    with os.fdopen(fd_f, 'w') as f:
+        for seq in records:
+            f.write('>{}\n{}\n'.format(seq.id, str(seq.seq)))
+    fd_sfile, cm_sfile_path = mkstemp(prefix='rba_', suffix='_29', dir=CONFIG.tmpdir)
+    os.close(fd_sfile)
+
+    cm_params = '--notrunc --sfile {}'.format(cm_sfile_path)
+    if threads:
+        cm_params += ' --cpu {}'.format(threads)
+    try:
+        cm_msa_file = run_cmalign_on_fasta(fasta_file, cm_file, cmalign_params=cm_params, timeout=timeout)
+        # only the scores are needed, the alignment is not read
+        BA_support.remove_one_file_with_try(cm_msa_file)
+        return read_cmalign_sfile(cm_sfile_path)
+    finally:
+        BA_support.remove_files_with_try([fasta_file, cm_sfile_path])
+
+
+def run_cmalign_scores_sharded(records, cm_file, threads=None, timeout=None, shard_size=None):
+    """
+    Score the records with cmalign in shards aligned concurrently.
+    Each shard starts with the first record (the query) as an anchor, so the scores of the shards come from
+     the same model and the query score is checked in all of them.
+    Only the score tables are read, the alignment is not built.
+    :param records: query followed by the hits
+    :param shard_size: number of hits in one shard, by default the hits are divided between the threads
+        (at least CMALIGN_MIN_SHARD, at most CMALIGN_MAX_SHARD hits in a shard)
+    :return: score table as from read_cmalign_sfile, one row for each record in the order of records
+    """
+    ml.debug(fname())
+    threads = threads if threads else os.cpu_count()
+    anchor, hits = records[0], records[1:]
+    if shard_size is None:
+        shard_size = min(CMALIGN_MAX_SHARD, max(CMALIGN_MIN_SHARD, -(-len(hits) // threads)))
+    shards = [hits[i:i + shard_size] for i in range(0, len(hits), shard_size)] or [[]]
+
+    if len(shards) == 1:
+        return _cmalign_shard_scores(records, cm_file, threads=threads, timeout=timeout)
+
+    ml.info('Running cmalign in {} shards.'.format(len(shards)))
+    workers = min(threads, len(shards))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        tables = list(executor.map(
+            lambda shard: _cmalign_shard_scores(
+                [anchor] + shard, cm_file, threads=max(1, threads // workers), timeout=timeout
+            ),
+            shards
+        ))
+
+    # the anchor row is kept only from the first shard
+    scores = pd.concat([tables[0]] + [t.iloc[1:] for t in tables[1:]], ignore_index=True)
+    if len({t.bit_sc.iloc[0] for t in tables}) != 1:
+        ml.warning('Query scores differ between cmalign shards.')
+    return scores
+
+
 def build_cm_model_rsearch(query_seq, path2selected_sim_array, timeout=None):
     ml.debug(fname())
     query_structure = rna_blast_analyze.BR_core.viennaRNA.RNAfold(str(query_seq.seq), timeout=None)[0]
@@ -178,19 +302,20 @@ def build_cm_model_rsearch(query_seq, path2selected_sim_array, timeout=None):
     return cm_model_file
 
 
-def _add_rsearch_align_scores2anal_hits(ahits, s_table):
+def _add_rsearch_align_scores2anal_hits(query, hits, s_table):
     """
     Adds scores from homology inference to analyzed hits
-    :param ahits:
+    :param query:
+    :param hits:
     :param s_table:
     :return:
     """
     ml.debug(fname())
     # add result for query to the query
-    ahits.query.annotations['cmstat'] = s_table.iloc[0]
-    query_len = len(ahits.query)
+    query.annotations['cmstat'] = s_table.iloc[0]
+    query_len = len(query)
 
-    for hit, (i, row) in zip(ahits.hits, s_table[1:].iterrows()):
+    for hit, (i, row) in zip(hits, s_table[1:].iterrows()):
         assert hit.extension.id == row.seq_name
         hit.extension.annotations['cmstat'] = row
         hit.extension.annotations['homology_estimate'] = compute_homology(query_len, row.bit_sc)
@@ -2,22 +2,37 @@ import os
 import pysam
 import gzip
 import sqlite3
+import logging
+import threading
+from collections import OrderedDict
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
 
+from rna_blast_analyze.BR_core.result_cache import open_cache, cache_key
 
-def load_genome(root_dir, accession, start, end):
+ml = logging.getLogger('rboAnalyzer')
+
+
+def load_genome(root_dir, accession, start, end, description=None):
     ff = resolver(root_dir, accession) + '.fasta.gz'
 
     g = pysam.FastaFile(ff)
     extracted = g.fetch(reference=accession, start=start, end=end)
     g.close()
 
+    if description is not None:
+        return SeqRecord(Seq(extracted), id=accession, description=description)
+
+    return SeqRecord(Seq(extracted), id=accession, description=load_description(ff, accession))
+
+
+def load_description(ff, accession):
+    """Find description line of accession in the bgzipped fasta file (requires decompression of the file)."""
     ace = accession.encode()
     with gzip.open(ff) as gz:
         for line in gz:
             if line[1:].startswith(ace):
-                return SeqRecord(Seq(extracted), id=accession, description=line[1:].decode().strip())
+                return line[1:].decode().strip()
 
     raise RuntimeError("Failed to find accession {} in {}".format(accession, ff))
 
@@ -40,8 +55,18 @@ def resolver(root, accession):
 
 
 class GenomeDB(object):
-    def __init__(self, dbfile, dbroot=None):
-        self.con = sqlite3.connect(dbfile, timeout=300)
+    """
+    Genome database - sqlite file with compressed genomes (or pointers to bgzipped fasta files in dbroot).
+
+    One database is opened for the whole run and shared by the queries (load_regions may be called from
+     multiple threads). Decompressed sequences are kept in LRU cache of at most cache_size characters,
+     so the genomes hit by multiple queries are decompressed only once.
+    Descriptions of genomes stored in bgzipped files are remembered in the "genome_descriptions" cache
+     (in the cache_dir) so the files are not decompressed just to find the description line.
+    The database itself is only read.
+    """
+    def __init__(self, dbfile, dbroot=None, cache_size=2 * 10**9):
+        self.con = sqlite3.connect(dbfile, timeout=300, check_same_thread=False)
         self.con.row_factory = sqlite3.Row
 
         if dbroot:
@@ -49,8 +74,12 @@ class GenomeDB(object):
         else:
             self.dbroot = os.path.dirname(dbfile)
 
-        self.tmpdir = os.path.join(self.dbroot, '__tmpdir')
-        os.makedirs(self.tmpdir, exist_ok=True)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_used = 0
+        self._descriptions = {}
+        self._lock = threading.RLock()
+        self.stats = {'hits': 0, 'misses': 0, 'bytes_decompressed': 0}
 
     def _read_db(self, accession):
         with self.con:
@@ -74,16 +103,96 @@ class GenomeDB(object):
                 dbdescription=row["description"]
             )
 
-    @staticmethod
-    def _decompress_or_none(data):
+    def _decompress_or_none(self, data):
         if data is None:
             return None
         else:
+            self.stats['bytes_decompressed'] += len(data)
             return gzip.decompress(data).decode()
 
+    def _cached_sequence(self, accession):
+        """Return (description, sequence) where sequence is None if it is stored in bgzipped file."""
+        if accession in self._cache:
+            self.stats['hits'] += 1
+            self._cache.move_to_end(accession)
+            return self._cache[accession]
+
+        self.stats['misses'] += 1
+        with self.con:
+            row = self.con.execute("SELECT description, seq FROM genomes WHERE acc = ?;", (accession,)).fetchone()
+        if row is None:
+            raise KeyError("Accession {} is not avalible in the database.".format(accession))
+
+        item = (row["description"], self._decompress_or_none(row["seq"]))
+        size = len(item[1]) if item[1] is not None else 0
+        if size <= self.cache_size:
+            self._cache[accession] = item
+            self._cache_used += size
+            while self._cache_used > self.cache_size:
+                _, (_, old) = self._cache.popitem(last=False)
+                self._cache_used -= len(old) if old is not None else 0
+        return item
+
+    def _file_description(self, accession):
+        if accession in self._descriptions:
+            return self._descriptions[accession]
+
+        ff = resolver(self.dbroot, accession) + '.fasta.gz'
+        cache = open_cache('genome_descriptions')
+        if cache is None:
+            description = load_description(ff, accession)
+        else:
+            st = os.stat(ff)
+            key = cache_key(os.path.abspath(ff), st.st_size, st.st_mtime, accession)
+            description = cache.get(key)
+            if description is None:
+                description = load_description(ff, accession)
+                cache.put(key, description)
+
+        self._descriptions[accession] = description
+        return description
+
+    def load_regions(self, regions):
+        """Load multiple regions at once.
+
+        Each accession is read from the database (and decompressed) at most once.
+
+        :param regions: iterable of (accession, start, end) with python slicing semantics
+        :return: list of SeqRecord objects in the order of regions
+        """
+        with self._lock:
+            return self._load_regions(regions)
+
+    def _load_regions(self, regions):
+        by_acc = OrderedDict()
+        for i, (acc, start, end) in enumerate(regions):
+            by_acc.setdefault(acc, []).append((i, start, end))
+
+        out = [None] * sum(len(i) for i in by_acc.values())
+        for acc, acc_regions in by_acc.items():
+            description, seq = self._cached_sequence(acc)
+            if seq is None:
+                # genome stored in bgzipped fasta file
+                description = self._file_description(acc)
+                g = pysam.FastaFile(resolver(self.dbroot, acc) + '.fasta.gz')
+                try:
+                    for i, start, end in acc_regions:
+                        out[i] = SeqRecord(
+                            Seq(g.fetch(reference=acc, start=start, end=end)), id=acc, description=description
+                        )
+                finally:
+                    g.close()
+            else:
+                for i, start, end in acc_regions:
+                    out[i] = SeqRecord(Seq(seq[start:end]), id=acc, description=description)
+
+        ml.debug('GenomeDB cache: {hits} hits, {misses} misses, {bytes_decompressed} bytes decompressed.'.format(
+            **self.stats
+        ))
+        return out
+
     def load_genome(self, accession, start, end):
-        data = self.load(accession, start, end)
-        return data.load_seq()
+        return self.load_regions([(accession, start, end)])[0]
 
     def load_gff(self, accession):
         data = self.load(accession)
@@ -142,6 +251,9 @@ class GenomeDB(object):
                 self.con.execute("DROP TABLE temp;")
 
     def close(self):
+        ml.info('Genome database: {hits} cache hits, {misses} misses, {bytes_decompressed} bytes decompressed.'.format(
+            **self.stats
+        ))
         self.con.close()
 
 
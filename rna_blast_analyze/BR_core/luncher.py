@@ -2,26 +2,32 @@ import os
 import sys
 import pickle
 import re
-from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from copy import copy
+from itertools import islice
 from random import shuffle
 from tempfile import mkstemp
 import logging
-import json
-from Bio import SeqIO
 
 import rna_blast_analyze.BR_core.BA_support as BA_support
 from rna_blast_analyze.BR_core import validate_args
 from rna_blast_analyze.BR_core.BA_methods import BlastSearchRecompute, to_tab_delim_line_simple
 from rna_blast_analyze.BR_core.config import tools_paths, CONFIG
-from rna_blast_analyze.BR_core.infer_homology import find_and_extract_cm_model
+from rna_blast_analyze.BR_core.infer_homology import find_and_extract_cm_model, scan_queries
 from rna_blast_analyze.BR_core.repredict_structures import wrapped_ending_with_prediction
 from rna_blast_analyze.BR_core.filter_blast import filter_by_eval, filter_by_bits
 from rna_blast_analyze.BR_core.fname import fname
-from rna_blast_analyze.BR_core.cmalign import run_cmfetch, get_cm_model, RfamInfo
+from rna_blast_analyze.BR_core.cmalign import RfamInfo, cmscan_table_from_records
+from rna_blast_analyze.BR_core import cm_store
 from rna_blast_analyze.BR_core.expand_by_BLAST import extend_simple_core
 from rna_blast_analyze.BR_core.expand_by_LOCARNA import extend_locarna_core
 from rna_blast_analyze.BR_core.expand_by_joined_pred_with_rsearch import extend_meta_core
 from rna_blast_analyze.BR_core.convert_classes import blastsearchrecompute2dict, blastsearchrecomputefromdict
+from rna_blast_analyze.BR_core.checkpoint import CheckpointStore
+from rna_blast_analyze.BR_core.blast_stream import resolve_blast_format, load_offset_index, count_fasta_records, iter_queries
+from rna_blast_analyze.BR_core.extend_hits import BlastdbRegionPool, add_hits_to_region_pool, open_genome_db
+from rna_blast_analyze.BR_core.parallel import shared_pool
+from rna_blast_analyze.BR_core.output.table_output import shared_table_writers, query_finished
 from rna_blast_analyze.BR_core import exceptions
 
 ml = logging.getLogger('rboAnalyzer')
@@ -35,220 +41,389 @@ def lunch_computation(args_inner, shared_list=None):
     # update params if different config is requested
     CONFIG.override(tools_paths(args_inner.config_file))
 
-    p_blast = BA_support.blast_in(args_inner.blast_in, b=args_inner.b_type)
-    query_seqs = [i for i in SeqIO.parse(args_inner.blast_query, 'fasta')]
+    # one process pool for all stages
+    # it is started here, so the workers are forked before the BLAST output and sequences are loaded
+    # the table output of all queries is written to one file
+    with shared_pool(args_inner.threads), shared_table_writers():
+        return _lunch_computation(args_inner, shared_list)
 
-    if len(p_blast) != len(query_seqs):
-        ml.error('Number of query sequences in provided BLAST output file ({}) does not match number of query sequences'
-                 ' in query FASTA file ({}).'.format(len(p_blast), len(query_seqs)))
+
+def _lunch_computation(args_inner, shared_list):
+    saved_file = '{}.r-{}'.format(args_inner.blast_in, args_inner.sha1[:10])
+    checkpoint = CheckpointStore(saved_file, sha1=args_inner.sha1)
+    if checkpoint.iterations():
+        msg = "Loading backup data."
+        print('STATUS: ' + msg)
+        ml.info(msg + ' file: ' + saved_file)
+
+        if checkpoint.sha1 != args_inner.sha1:
+            msg = "Input argument hash does not match the saved argument hash. "
+            if checkpoint.sha1[:10] == args_inner.sha1[:10]:
+                msg += "This is because of truncating hashes to first 10 characters. "
+                msg += "Please remove the '{}' file.".format(saved_file)
+                ml.error(msg)
+                sys.exit(1)
+            else:
+                msg += "Please remove the '{}' file.".format(saved_file)
+                sys.exit(1)
+
+    b_type = resolve_blast_format(args_inner.blast_in, args_inner.b_type)
+    if b_type is None:
+        ml.error('Failed to parse provided file {}'.format(args_inner.blast_in))
         sys.exit(1)
 
-    # check if BLAST does not contain unexpected sequence characters
-    validate_args.check_blast(p_blast)
+    # the BLAST records are read lazily, the offsets allow to skip the queries loaded from the checkpoint
+    blast_index = load_offset_index(args_inner.blast_in, b_type, saved_file + '.idx')
+    n_queries = count_fasta_records(args_inner.blast_query)
 
-    # create list of correct length if needed
-    all_saved_data = [None] * len(query_seqs)
-    saved_file = '{}.r-{}'.format(args_inner.blast_in, args_inner.sha1[:10])
-    with open(saved_file, 'r+') as f:
-        _saved = json.load(f)
-        if _saved is None:
-            f.seek(0)
-            f.truncate()
-            json.dump(all_saved_data, f)
-        else:
-            msg = "Loading backup data."
-            print('STATUS: ' + msg)
-            ml.info(msg + ' file: ' + saved_file)
-            all_saved_data = _saved
-
-            for saved_data in all_saved_data:
-                # we can have partially computed data
-                if saved_data is None:
-                    continue
-                if saved_data['args']['sha1'] != args_inner.sha1:
-                    msg = "Input argument hash does not match the saved argument hash. "
-                    if saved_data['args']['sha1'][:10] == args_inner.sha1[:10]:
-                        msg += "This is because of truncating hashes to first 10 characters. "
-                        msg += "Please remove the '{}' file.".format(saved_file)
-                        ml.error(msg)
-                        sys.exit(1)
-                    else:
-                        msg += "Please remove the '{}' file.".format(saved_file)
-                        sys.exit(1)
-
-    if len(p_blast) > 1:
+    if b_type == 'xml' and len(blast_index['offsets']) != n_queries:
+        ml.error('Number of query sequences in provided BLAST output file ({}) does not match number of query sequences'
+                 ' in query FASTA file ({}).'.format(len(blast_index['offsets']), n_queries))
+        sys.exit(1)
+
+    if n_queries > 1:
         multi_query = True
     else:
         multi_query = False
 
-    # this is done for each query
-    ml_out_line = []
-    all_analyzed = []
-    for iteration, (bhp, query, saved_data) in enumerate(zip(p_blast, query_seqs, all_saved_data)):
-        if saved_data is None:
-            print('STATUS: processing query: {}'.format(query.id))
-            validate_args.verify_query_blast(blast=bhp, query=query)
-
-            analyzed_hits = BlastSearchRecompute(args_inner, query, iteration)
-            analyzed_hits.multi_query = multi_query
-
-            # run cm model build
-            # allows to fail fast if rfam was selected and we dont find the model
-            try:
-                ih_model, analyzed_hits = find_and_extract_cm_model(args_inner, analyzed_hits)
-            except (exceptions.MissingCMexception, exceptions.SubprocessException):
-                sys.exit(1)
+    start = 0
+    while start in checkpoint:
+        query_finished(start)
+        start += 1
+
+    # RFAM is searched for all queries at once, before the queries are computed
+    cmscan_results = _scan_queries(args_inner, checkpoint, n_queries)
+
+    # queries are computed concurrently, the threads are divided between them
+    #  work done in the shared process pool is limited by its size
+    threads = args_inner.threads if args_inner.threads else os.cpu_count()
+    n_concurrent = max(1, min(n_queries, threads))
+    query_args = copy(args_inner)
+    query_args.threads = max(1, threads // n_concurrent)
+    if n_concurrent > 1:
+        ml.info('Computing {} queries concurrently, {} threads each.'.format(n_concurrent, query_args.threads))
+
+    results = {}
+    failed = []
+    queries = iter_queries(args_inner.blast_in, args_inner.blast_query, b_type, start=start, index=blast_index)
+    # the genome database (--db_type server) is opened once, so its cache of genomes is shared by the queries
+    # sequence regions of the next queries are retrieved (one batch per n_concurrent queries)
+    #  while the previous queries are computed
+    with open_genome_db(args_inner) as genome_db, \
+            ThreadPoolExecutor(max_workers=1) as fetcher, \
+            ThreadPoolExecutor(max_workers=n_concurrent) as executor:
+        running = {}
+        queries = _prefetched(
+            _exit_on_parsing_error(queries, args_inner.blast_in), args_inner, checkpoint, n_concurrent, fetcher,
+            genome_db,
+        )
+        for iteration, bhp, query, region_pool in queries:
+            future = executor.submit(
+                _compute_query, query_args, shared_list, iteration, bhp, query, multi_query, checkpoint,
+                cmscan_results.get(iteration), region_pool,
+            )
+            running[future] = (iteration, query.id)
+            # only a few queries are read ahead of the computation
+            if len(running) >= n_concurrent:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                _collect(done, running, results, failed, multi_query)
+        _collect(list(running), running, results, failed, multi_query)
+
+    if failed:
+        ml.error('Computation failed for queries: {}'.format(', '.join(failed)))
+        if not results:
+            sys.exit(1)
+
+    # outputs are in the order of the queries
+    ml_out_line = [results[i][1] for i in sorted(results) if results[i] is not None]
+    all_analyzed = [results[i][0] for i in sorted(results) if results[i] is not None]
+    return '\n'.join(ml_out_line), all_analyzed
+
+
+def _collect(done, running, results, failed, multi_query):
+    """Move results of the finished queries from running, failure of one query does not stop the others."""
+    for future in done:
+        iteration, query_id = running.pop(future)
+        try:
+            results[iteration] = future.result()
+        except (SystemExit, Exception) as e:
+            if not multi_query:
+                raise
+            if not isinstance(e, SystemExit):
+                ml.exception('Query {} failed: {}'.format(query_id, str(e)))
+            failed.append(query_id)
+        finally:
+            # table outputs of the following queries may be written now
+            query_finished(iteration)
+
+
+def _scan_queries(args_inner, checkpoint, n_queries):
+    """Return {iteration: cmscan table} for the queries not completed in the checkpoint.
+    Tables saved in the checkpoint are reused, the other queries are searched with one cmscan call.
+    Queries missing in the output (cmscan failed) are searched again when they are computed.
+    """
+    results = {}
+    to_scan = []
+    for iteration in range(n_queries):
+        if iteration in checkpoint:
+            continue
+        rows = checkpoint.load_cmscan(iteration)
+        if rows is None:
+            to_scan.append(iteration)
+        else:
+            results[iteration] = cmscan_table_from_records(rows)
+
+    if to_scan:
+        scanned = scan_queries(args_inner.blast_query, to_scan, threads=args_inner.threads)
+        if scanned is not None:
+            for iteration, table in scanned.items():
+                checkpoint.save_cmscan(iteration, table.to_dict(orient='records'))
+            results.update(scanned)
+    return results
+
+
+def _compute_query(args_inner, shared_list, iteration, bhp, query, multi_query, checkpoint, cmscan_result=None,
+                   region_pool=None):
+    """Compute one query (or load it from the checkpoint) and write its outputs.
+    region_pool is the future of prefetch_regions result for the batch containing this query.
+    Return (analyzed_hits, output line) or None when there is nothing to do for the query.
+    """
+    if iteration not in checkpoint:
+        print('STATUS: processing query: {}'.format(query.id))
+        # check if BLAST does not contain unexpected sequence characters
+        validate_args.check_blast([bhp])
+        validate_args.verify_query_blast(blast=bhp, query=query)
+
+        # the sequence neighborhoods of all hits of this query (and of the other queries of the batch)
+        #  are retrieved at once
+        if region_pool is not None:
+            region_pool = region_pool.result()
+
+        analyzed_hits = BlastSearchRecompute(args_inner, query, iteration)
+        analyzed_hits.multi_query = multi_query
+
+        # run cm model build
+        # allows to fail fast if rfam was selected and we dont find the model
+        try:
+            ih_model, analyzed_hits = find_and_extract_cm_model(
+                args_inner, analyzed_hits, cmscan_results=cmscan_result
+            )
+        except (exceptions.MissingCMexception, exceptions.SubprocessException):
+            sys.exit(1)
+
+        # select all
+        all_blast_hits = BA_support.blast_hsps2list(bhp)
+
+        if len(all_blast_hits) == 0:
+            ml.error('No hits found in {} - {}. Nothing to do.'.format(args_inner.blast_in, bhp.query))
+            return None
+
+        # filter if needed
+        if args_inner.filter_by_eval is not None:
+            tmp = filter_by_eval(all_blast_hits, BA_support.blast_hit_getter_from_hits, args_inner.filter_by_eval)
+            if len(tmp) == 0 and len(all_blast_hits) != 0:
+                ml.error('The requested filter removed all BLAST hits {} - {}. Nothing to do.'.format(args_inner.blast_in,
+                                                                                                      bhp.query))
+                return None
+        elif args_inner.filter_by_bitscore is not None:
+            tmp = filter_by_bits(all_blast_hits, BA_support.blast_hit_getter_from_hits, args_inner.filter_by_bitscore)
+            if len(tmp) == 0 and len(all_blast_hits) != 0:
+                ml.error('The requested filter removed all BLAST hits {} - {}. Nothing to do.'.format(args_inner.blast_in,
+                                                                                                      bhp.query))
+                return None
+
+        all_short = all_blast_hits
+
+        # now this is different for each mode
+        if args_inner.mode == 'simple':
+            analyzed_hits, homology_prediction, homol_seqs, cm_file_rfam_user = extend_simple_core(analyzed_hits, query, args_inner, all_short, multi_query, iteration, ih_model, region_pool=region_pool)
+        elif args_inner.mode == 'locarna':
+            analyzed_hits, homology_prediction, homol_seqs, cm_file_rfam_user = extend_locarna_core(analyzed_hits, query, args_inner, all_short, multi_query, iteration, ih_model, region_pool=region_pool, checkpoint=checkpoint)
+        elif args_inner.mode == 'meta':
+            analyzed_hits, homology_prediction, homol_seqs, cm_file_rfam_user = extend_meta_core(analyzed_hits, query, args_inner, all_short, multi_query, iteration, ih_model, region_pool=region_pool, checkpoint=checkpoint)
+        else:
+            raise ValueError('Unknown option - should be cached by argparse.')
 
-            # select all
-            all_blast_hits = BA_support.blast_hsps2list(bhp)
-
-            if len(all_blast_hits) == 0:
-                ml.error('No hits found in {} - {}. Nothing to do.'.format(args_inner.blast_in, bhp.query))
-                continue
-
-            # filter if needed
-            if args_inner.filter_by_eval is not None:
-                tmp = filter_by_eval(all_blast_hits, BA_support.blast_hit_getter_from_hits, args_inner.filter_by_eval)
-                if len(tmp) == 0 and len(all_blast_hits) != 0:
-                    ml.error('The requested filter removed all BLAST hits {} - {}. Nothing to do.'.format(args_inner.blast_in,
-                                                                                                          bhp.query))
-                    continue
-            elif args_inner.filter_by_bitscore is not None:
-                tmp = filter_by_bits(all_blast_hits, BA_support.blast_hit_getter_from_hits, args_inner.filter_by_bitscore)
-                if len(tmp) == 0 and len(all_blast_hits) != 0:
-                    ml.error('The requested filter removed all BLAST hits {} - {}. Nothing to do.'.format(args_inner.blast_in,
-                                                                                                          bhp.query))
-                    continue
-
-            all_short = all_blast_hits
-
-            # now this is different for each mode
-            if args_inner.mode == 'simple':
-                analyzed_hits, homology_prediction, homol_seqs, cm_file_rfam_user = extend_simple_core(analyzed_hits, query, args_inner, all_short, multi_query, iteration, ih_model)
-            elif args_inner.mode == 'locarna':
-                analyzed_hits, homology_prediction, homol_seqs, cm_file_rfam_user = extend_locarna_core(analyzed_hits, query, args_inner, all_short, multi_query, iteration, ih_model)
-            elif args_inner.mode == 'meta':
-                analyzed_hits, homology_prediction, homol_seqs, cm_file_rfam_user = extend_meta_core(analyzed_hits, query, args_inner, all_short, multi_query, iteration, ih_model)
-            else:
-                raise ValueError('Unknown option - should be cached by argparse.')
+        if len(analyzed_hits.hits) == 0:
+            ml.error(
+                "Extension failed for all sequences. Please see the error message. You can also try '--mode simple'."
+            )
+            sys.exit(1)
 
-            if len(analyzed_hits.hits) == 0:
-                ml.error(
-                    "Extension failed for all sequences. Please see the error message. You can also try '--mode simple'."
-                )
-                sys.exit(1)
+        analyzed_hits.copy_hits()
+
+        checkpoint.save_query(iteration, blastsearchrecompute2dict(analyzed_hits))
 
-            analyzed_hits.copy_hits()
+    else:
+        print('STATUS: extended sequences loaded from backup file for query {}'.format(query.id))
+        analyzed_hits = blastsearchrecomputefromdict(checkpoint.load(iteration))
 
-            with open(args_inner.blast_in + '.r-' + args_inner.sha1[:10], 'r+') as f:
-                all_saved_data = json.load(f)
-                all_saved_data[iteration] = blastsearchrecompute2dict(analyzed_hits)
-                f.seek(0)
-                f.truncate()
-                json.dump(all_saved_data, f, indent=2)
+        # overwrite the saved args with current
+        # this will update used prediction methods and other non essential stuff
+        analyzed_hits.args = args_inner
 
+        if analyzed_hits.args.cm_file:
+            cm_file_rfam_user = analyzed_hits.args.cm_file
         else:
-            print('STATUS: extended sequences loaded from backup file for query {}'.format(query.id))
-            analyzed_hits = blastsearchrecomputefromdict(saved_data)
+            cm_file_rfam_user = None
+
+    # write all hits to fasta
+    fda, all_hits_fasta = mkstemp(prefix='rba_', suffix='_22', dir=CONFIG.tmpdir)
+    os.close(fda)
+    analyzed_hits.write_results_fasta(all_hits_fasta)
+
+    out_line = []
+    # multiple prediction params
+    if args_inner.dev_pred:
+        dp_list = []
+        # acomodate more dev pred outputs
+        dpfile = None
+        if getattr(args_inner, 'dump', False):
+            dpfile = args_inner.dump.strip('dump')
+        if getattr(args_inner, 'pandas_dump', False):
+            dpfile = args_inner.pandas_dump.strip('pandas_dump')
+        if getattr(args_inner, 'json', False):
+            dpfile = args_inner.json.strip('json')
+
+        # optimization so the rfam cm file is used only once
+        if cm_file_rfam_user is None and 'rfam' in ''.join(args_inner.prediction_method) \
+                and analyzed_hits.best_matching_model is not None:
+            rfam = RfamInfo()
+            cm_file_rfam_user = cm_store.fetch_model(analyzed_hits.best_matching_model['target_name'], rfam=rfam)
+
+        for method in args_inner.prediction_method:
+            # cycle the prediction method settings
+            # get set of params for each preditcion
+            selected_pred_params = [kk for kk in args_inner.pred_params if method in kk]
+            shuffle(selected_pred_params)
+            # for method_params in args_inner.pred_params:
+            for i, method_params in enumerate(selected_pred_params):
+                ah = analyzed_hits.snapshot()
+
+                random_flag = BA_support.generate_random_name(8, shared_list)
+                shared_list.append(random_flag)
+
+                pname = re.sub(' ', '', str(method))
+                flag = '|pred_params|' + random_flag
+
+                # rebuild the args only with actualy used prediction settings
+                ah.args.prediction_method = method
+                ah.args.pred_params = method_params
+
+                if getattr(args_inner, 'dump', False):
+                    spa = args_inner.dump.split('.')
+                    ah.args.dump = '.'.join(spa[:-1]) + flag + '.' + spa[-1]
+                if getattr(args_inner, 'pandas_dump', False):
+                    spa = args_inner.pandas_dump.split('.')
+                    ah.args.pandas_dump = '.'.join(spa[:-1]) + flag + '.' + spa[-1]
+                if getattr(args_inner, 'table', False):
+                    spa = args_inner.table.split('.')
+                    ah.args.table = '.'.join(spa[:-1]) + flag + '.' + spa[-1]
+                if getattr(args_inner, 'pdf_out', False):
+                    spa = args_inner.pdf_out.split('.')
+                    ah.args.pdf_out = '.'.join(spa[:-1]) + flag + '.' + spa[-1]
+                if getattr(args_inner, 'json', False):
+                    spa = args_inner.json.split('.')
+                    ah.args.json = '.'.join(spa[:-1]) + flag + '.' + spa[-1]
+
+                wrapped_ending_with_prediction(
+                    args_inner=ah.args,
+                    analyzed_hits=ah,
+                    pred_method=method,
+                    method_params=method_params,
+                    used_cm_file=cm_file_rfam_user,
+                    multi_query=multi_query,
+                    iteration=iteration,
+                    checkpoint=checkpoint,
+                )
+                success = True
+                out_line.append(to_tab_delim_line_simple(ah.args))
 
-            # overwrite the saved args with current
-            # this will update used prediction methods and other non essential stuff
-            analyzed_hits.args = args_inner
+                dp_list.append((i, method_params, success, flag, pname, random_flag, args_inner.pred_params))
 
-            if analyzed_hits.args.cm_file:
-                cm_file_rfam_user = analyzed_hits.args.cm_file
-            else:
-                cm_file_rfam_user = None
-
-        all_analyzed.append(analyzed_hits)
-
-        # write all hits to fasta
-        fda, all_hits_fasta = mkstemp(prefix='rba_', suffix='_22', dir=CONFIG.tmpdir)
-        os.close(fda)
-        analyzed_hits.write_results_fasta(all_hits_fasta)
-
-        out_line = []
-        # multiple prediction params
-        if args_inner.dev_pred:
-            dp_list = []
-            # acomodate more dev pred outputs
-            dpfile = None
-            if getattr(args_inner, 'dump', False):
-                dpfile = args_inner.dump.strip('dump')
-            if getattr(args_inner, 'pandas_dump', False):
-                dpfile = args_inner.pandas_dump.strip('pandas_dump')
-            if getattr(args_inner, 'json', False):
-                dpfile = args_inner.json.strip('json')
-
-            # optimization so the rfam cm file is used only once
-            if cm_file_rfam_user is None and 'rfam' in ''.join(args_inner.prediction_method):
-                best_model = get_cm_model(args_inner.blast_query, threads=args_inner.threads)
-                rfam = RfamInfo()
-                cm_file_rfam_user = run_cmfetch(rfam.file_path, best_model)
-
-            for method in args_inner.prediction_method:
-                # cycle the prediction method settings
-                # get set of params for each preditcion
-                selected_pred_params = [kk for kk in args_inner.pred_params if method in kk]
-                shuffle(selected_pred_params)
-                # for method_params in args_inner.pred_params:
-                for i, method_params in enumerate(selected_pred_params):
-                    ah = deepcopy(analyzed_hits)
-
-                    random_flag = BA_support.generate_random_name(8, shared_list)
-                    shared_list.append(random_flag)
-
-                    pname = re.sub(' ', '', str(method))
-                    flag = '|pred_params|' + random_flag
-
-                    # rebuild the args only with actualy used prediction settings
-                    ah.args.prediction_method = method
-                    ah.args.pred_params = method_params
-
-                    if getattr(args_inner, 'dump', False):
-                        spa = args_inner.dump.split('.')
-                        ah.args.dump = '.'.join(spa[:-1]) + flag + '.' + spa[-1]
-                    if getattr(args_inner, 'pandas_dump', False):
-                        spa = args_inner.pandas_dump.split('.')
-                        ah.args.pandas_dump = '.'.join(spa[:-1]) + flag + '.' + spa[-1]
-                    if getattr(args_inner, 'pdf_out', False):
-                        spa = args_inner.pdf_out.split('.')
-                        ah.args.pdf_out = '.'.join(spa[:-1]) + flag + '.' + spa[-1]
-                    if getattr(args_inner, 'json', False):
-                        spa = args_inner.json.split('.')
-                        ah.args.json = '.'.join(spa[:-1]) + flag + '.' + spa[-1]
-
-                    wrapped_ending_with_prediction(
-                        args_inner=ah.args,
-                        analyzed_hits=ah,
-                        pred_method=method,
-                        method_params=method_params,
-                        used_cm_file=cm_file_rfam_user,
-                        multi_query=multi_query,
-                        iteration=iteration,
-                    )
-                    success = True
-                    out_line.append(to_tab_delim_line_simple(ah.args))
-
-                    dp_list.append((i, method_params, success, flag, pname, random_flag, args_inner.pred_params))
-
-            if dpfile is not None:
-                with open(dpfile + 'devPredRep', 'wb') as devf:
-                    pickle.dump(dp_list, devf)
-        else:
-            wrapped_ending_with_prediction(
-                args_inner=args_inner,
-                analyzed_hits=analyzed_hits,
-                used_cm_file=cm_file_rfam_user,
-                multi_query=multi_query,
-                iteration=iteration,
-            )
-            out_line.append(to_tab_delim_line_simple(args_inner))
+        if dpfile is not None:
+            with open(dpfile + 'devPredRep', 'wb') as devf:
+                pickle.dump(dp_list, devf)
+    else:
+        wrapped_ending_with_prediction(
+            args_inner=args_inner,
+            analyzed_hits=analyzed_hits,
+            used_cm_file=cm_file_rfam_user,
+            multi_query=multi_query,
+            iteration=iteration,
+            checkpoint=checkpoint,
+        )
+        out_line.append(to_tab_delim_line_simple(args_inner))
+
+    # the user provided file is used directly only when the query was loaded from the checkpoint
+    if cm_file_rfam_user is not None and cm_file_rfam_user != args_inner.cm_file:
+        cm_store.release(cm_file_rfam_user)
+
+    BA_support.remove_one_file_with_try(all_hits_fasta)
+    return analyzed_hits, '\n'.join(out_line)
+
+
+def _exit_on_parsing_error(queries, blast_file):
+    """Pass the queries through, exit when the BLAST output can't be read or doesn't match the queries."""
+    try:
+        for item in queries:
+            yield item
+    except exceptions.ParsingError as e:
+        ml.error(str(e))
+        sys.exit(1)
+    except Exception as e:
+        ml.error('Failed to parse provided file {}'.format(blast_file))
+        ml.error(str(e))
+        sys.exit(1)
 
-        ml_out_line.append('\n'.join(out_line))
 
-        if cm_file_rfam_user is not None and os.path.exists(cm_file_rfam_user):
-            BA_support.remove_one_file_with_try(cm_file_rfam_user)
+def _prefetched(queries, args_inner, checkpoint, batch_size, fetcher, genome_db=None):
+    """Add the future of the regions needed by each query to the (iteration, bhp, query) items.
+    The regions of batch_size queries are retrieved together by prefetch_regions submitted to the fetcher.
+    The items of a batch are given only after the retrieval for the next batch was started,
+     so at most two batches of BLAST records are held in memory.
+    """
+    def submit(batch):
+        to_fetch = [(bhp, query) for iteration, bhp, query in batch if iteration not in checkpoint]
+        region_pool = fetcher.submit(prefetch_regions, args_inner, to_fetch, genome_db)
+        return [item + (region_pool,) for item in batch]
+
+    queries = iter(queries)
+    previous = []
+    while True:
+        batch = list(islice(queries, batch_size))
+        if not batch:
+            break
+        current = submit(batch)
+        yield from previous
+        previous = current
+    yield from previous
+
+
+def prefetch_regions(args_inner, queries, genome_db=None):
+    """Retrieve sequence regions needed for extension of the hits of queries [(bhp, query), ...]
+     with batched blastdbcmd calls.
+    Only used with blastdb database. For server database the genome_db shared by the queries is returned,
+     None otherwise.
+    """
+    if args_inner.db_type == 'server':
+        return genome_db
+    if args_inner.db_type != 'blastdb':
+        return None
+
+    if args_inner.mode == 'simple':
+        extras = [0]
+    elif args_inner.mode == 'locarna':
+        extras = [args_inner.subseq_window_locarna]
+    else:
+        # regions of the simple extension are inside the wider locarna regions, only the widest is retrieved
+        extras = [max(0, args_inner.subseq_window_locarna)]
+
+    region_pool = BlastdbRegionPool(args_inner.blast_db, threads=args_inner.threads)
+    for bhp, query in queries:
+        hits = BA_support.blast_hsps2list(bhp)
+        for extra in extras:
+            add_hits_to_region_pool(region_pool, hits, len(query), extra=extra, blast_regexp=args_inner.blast_regexp)
 
-        BA_support.remove_one_file_with_try(all_hits_fasta)
-    return '\n'.join(ml_out_line), all_analyzed
\ No newline at end of file
+    region_pool.fetch_all()
+    return region_pool
@@ -1,15 +1,16 @@
 import os
 import json
+import gzip
+import base64
 import logging
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 from jinja2.exceptions import TemplateError
 from time import strftime
 import re
 
-from rna_blast_analyze.BR_core.BA_support import blasthsp2pre, remove_one_file_with_try
-from rna_blast_analyze.BR_core.viennaRNA import run_rnaplot
+from rna_blast_analyze.BR_core.BA_support import blasthsp2pre, dedup_msg
 from rna_blast_analyze.BR_core.config import CONFIG
-from rna_blast_analyze.BR_core.exceptions import RNAplotException
+from rna_blast_analyze.BR_core.output.structure_pictures import render_pictures
 
 from matplotlib import colors, cm
 
@@ -33,19 +34,22 @@ reference_colors = {
 
 def write_html_output(datain, template_path=''):
     ml.info("Writing HTML output.")
+    # draw all structures at once, in lazy mode they are drawn by the browser
+    if getattr(datain.args, 'html_pictures', 'rnaplot') == 'lazy':
+        pictures = None
+    else:
+        pictures = render_pictures(
+            [h.extension for h in datain.hits + datain.hits_failed if h.extension is not None],
+            threads=getattr(datain.args, 'threads', None),
+        )
+
     # prepare data
-    toprint = _prepare_body(datain)
+    toprint = _prepare_body(datain, pictures)
     myfooter = _prepare_footer(datain)
     my_header = _prepare_header(datain)
 
-    # init jinja2 rendering environment
-    env = Environment(
-        loader=FileSystemLoader(template_path),
-        autoescape=select_autoescape(['html', 'xml'])
-    )
-    cwd = os.getcwd()
+    env = _environment(template_path)
     try:
-        os.chdir(CONFIG.html_template_dir)
         template = env.get_template('onehit.html')
         html_str = template.render(
             input_list=toprint,
@@ -62,8 +66,76 @@ def write_html_output(datain, template_path=''):
     except Exception:
         ml.error("Failed to render html.")
         raise
-    finally:
-        os.chdir(cwd)
+
+
+def write_html_paged(datain, html_file, chunk_size=100, template_path=''):
+    """
+    Write the report as small index page (html_file) and the hits in chunk files ([html_file]_files directory),
+     which are loaded by the browser when scrolled to.
+    The hits are prepared, drawn and written chunk by chunk, so the report is never held in memory whole.
+    Chunk file is a script calling hitChunk(n, payload), payload is gzip compressed json list of hit html in base64
+     (scripts can be loaded also from local file, which is not allowed for json or other data).
+    """
+    ml.info("Writing paged HTML output.")
+    lazy = getattr(datain.args, 'html_pictures', 'rnaplot') == 'lazy'
+    threads = getattr(datain.args, 'threads', None)
+    data_dir = os.path.splitext(html_file)[0] + '_files'
+    os.makedirs(data_dir, exist_ok=True)
+
+    env = _environment(template_path)
+    try:
+        create_onehit = env.get_template('hit.html').make_module(
+            {'show_gene_browser': datain.args.show_gene_browser, 'len': len}
+        ).create_onehit
+
+        mm = _homology_colormap(datain)
+        records = _records2draw(datain)
+        chunks = []
+        for n, start in enumerate(range(0, len(records), chunk_size)):
+            part = records[start:start + chunk_size]
+            if lazy:
+                pictures = None
+            else:
+                pictures = render_pictures([h.extension for h in part if h.extension is not None], threads=threads)
+            hits_html = [
+                str(create_onehit(_prepare_hit(datain, start + i, onehit, mm, pictures)))
+                for i, onehit in enumerate(part)
+            ]
+            chunk_file = 'chunk_{:05d}.js'.format(n)
+            with open(os.path.join(data_dir, chunk_file), 'w') as f:
+                payload = base64.b64encode(gzip.compress(json.dumps(hits_html).encode())).decode()
+                f.write('hitChunk({}, "{}");\n'.format(n, payload))
+            chunks.append({'n': n, 'src': os.path.basename(data_dir) + '/' + chunk_file, 'n_hits': len(part)})
+
+        html_str = env.get_template('paged.html').render(
+            chunks=chunks,
+            n_hits=len(records),
+            data_dir=os.path.basename(data_dir),
+            foo=_prepare_footer(datain),
+            strftime=strftime,
+            hea=_prepare_header(datain),
+            show_gene_browser=datain.args.show_gene_browser,
+            len=len,
+        )
+    except TemplateError:
+        ml.error("Jinja rendering error. Please check if the template is available and correct.")
+        raise
+    except Exception:
+        ml.error("Failed to render html.")
+        raise
+
+    with open(html_file, 'wb') as h:
+        h.write(html_str.encode('utf8'))
+
+
+def _environment(template_path):
+    # init jinja2 rendering environment
+    # template path is relative to the template directory, working directory is not changed (queries may be
+    #  rendered concurrently)
+    return Environment(
+        loader=FileSystemLoader(os.path.join(CONFIG.html_template_dir, template_path)),
+        autoescape=select_autoescape(['html', 'xml'])
+    )
 
 
 def _prepare_header(data):
@@ -81,11 +153,13 @@ def _prep_hit_name(id, desc):
         return id + " " + desc
 
 
-def _prepare_body(data):
+def _homology_colormap(data):
     rog = rog_cmap(['#9E9414', reference_colors['Homologous']])
     norm = colors.Normalize(vmin=0, vmax=len(data.query.seq)*0.7, clip=True)
-    mm = cm.ScalarMappable(norm=norm, cmap=rog)
+    return cm.ScalarMappable(norm=norm, cmap=rog)
 
+
+def _records2draw(data):
     # rebuild original order of hits in case there was missing one:
     d = dict()
     for h in data.hits + data.hits_failed:
@@ -95,129 +169,125 @@ def _prepare_body(data):
     records2draw = []
     for key in sorted(d.keys()):
         records2draw.append(d[key])
+    return records2draw
+
+
+def _prepare_body(data, pictures=None):
+    mm = _homology_colormap(data)
+    return [_prepare_hit(data, i, onehit, mm, pictures) for i, onehit in enumerate(_records2draw(data))]
+
+
+def _prepare_hit(data, i, onehit, mm, pictures):
+    rr = dict()
+    rr['source_seq_name'] = onehit.source.annotations['blast'][0]
+    rr['blast_hit_name'] = _prep_hit_name(onehit.source.annotations['blast'][0], onehit.source.description)
+    rr['blast_text'] = blasthsp2pre(onehit.source.annotations['blast'][1])
+    rr['eval'] = onehit.source.annotations['blast'][1].expect
+    rr['intid'] = str(i)
+    rr['msgs'] = set(onehit.source.annotations['msgs'])
+    if onehit.extension is not None:
+        rr['msgs'] |= set(onehit.extension.annotations['msgs'])
+
+    lx = len(data.query.seq)
+
+    seqview = [
+        'embedded=true',
+        '&noviewheader=true',
+        '&id={}'.format(onehit.source.annotations['blast'][0]),
+        '&appname=rboAnalyzer',
+        '&multipanel=false',
+        '&slim=true'
+    ]
+    sviewlink = [
+        'https://www.ncbi.nlm.nih.gov/nuccore/',
+        '{}'.format(onehit.source.annotations['blast'][0]),
+        '?report=graph',
+    ]
+
+    if onehit.extension is not None:
+        ext = onehit.extension
+        h_bit_sc = ext.annotations['cmstat']['bit_sc']
+
+        rr['seqname'] = ext.id
+        rr['sequence'] = str(ext.seq)
+        rr['formated_seq'] = ext.format('fasta')
+        rr['rsearchbitscore'] = h_bit_sc
+        rr['ext_start'] = onehit.best_start
+        rr['ext_end'] = onehit.best_end
+        rr['pictures'] = _prepare_pictures(ext, pictures)
+        rr['h_estimate'] = ext.annotations['homology_estimate']
+
+        if ext.annotations['homology_estimate'] == 'Uncertain':
+            rr['h_color'] = colors.rgb2hex(mm.to_rgba(h_bit_sc))
+            rr['estimate_pointer'] = u' ↴'
+        else:
+            rr['h_color'] = reference_colors[ext.annotations['homology_estimate']]
 
-    jj = []
-    for i, onehit in enumerate(records2draw):
-        rr = dict()
-        rr['source_seq_name'] = onehit.source.annotations['blast'][0]
-        rr['blast_hit_name'] = _prep_hit_name(onehit.source.annotations['blast'][0], onehit.source.description)
-        rr['blast_text'] = blasthsp2pre(onehit.source.annotations['blast'][1])
-        rr['eval'] = onehit.source.annotations['blast'][1].expect
-        rr['intid'] = str(i)
-        rr['msgs'] = set(onehit.source.annotations['msgs'])
-        if onehit.extension is not None:
-            rr['msgs'] |= set(onehit.extension.annotations['msgs'])
-
-        lx = len(data.query.seq)
-
-        seqview = [
-            'embedded=true',
-            '&noviewheader=true',
-            '&id={}'.format(onehit.source.annotations['blast'][0]),
-            '&appname=rboAnalyzer',
-            '&multipanel=false',
-            '&slim=true'
-        ]
-        sviewlink = [
-            'https://www.ncbi.nlm.nih.gov/nuccore/',
-            '{}'.format(onehit.source.annotations['blast'][0]),
-            '?report=graph',
-        ]
-
-        if onehit.extension is not None:
-            ext = onehit.extension
-            h_bit_sc = ext.annotations['cmstat']['bit_sc']
-
-            rr['seqname'] = ext.id
-            rr['sequence'] = str(ext.seq)
-            rr['formated_seq'] = ext.format('fasta')
-            rr['rsearchbitscore'] = h_bit_sc
-            rr['ext_start'] = onehit.best_start
-            rr['ext_end'] = onehit.best_end
-            rr['pictures'] = _prepare_pictures(ext)
-            rr['h_estimate'] = ext.annotations['homology_estimate']
-
-            if ext.annotations['homology_estimate'] == 'Uncertain':
-                rr['h_color'] = colors.rgb2hex(mm.to_rgba(h_bit_sc))
-                rr['estimate_pointer'] = u' ↴'
-            else:
-                rr['h_color'] = reference_colors[ext.annotations['homology_estimate']]
-
-            # ==== markers ====
-            extended_marker = ['&mk={}:{}|BestMatch!'.format(onehit.best_start, onehit.best_end)]
-
-            seqview += extended_marker
-            sviewlink += extended_marker
+        # ==== markers ====
+        extended_marker = ['&mk={}:{}|BestMatch!'.format(onehit.best_start, onehit.best_end)]
 
-            if data.args.show_HSP:
-                br = onehit.source.annotations['blast'][1]
-                if br.sbjct_start < br.sbjct_end:
-                    bs = br.sbjct_start
-                    be = br.sbjct_end
-                else:
-                    bs = br.sbjct_end
-                    be = br.sbjct_start
-                hsp_marker = ['&mk={}:{}|HSP!'.format(bs, be)]
+        seqview += extended_marker
+        sviewlink += extended_marker
 
-                seqview += hsp_marker
-                sviewlink += hsp_marker
+        if data.args.show_HSP:
+            br = onehit.source.annotations['blast'][1]
+            if br.sbjct_start < br.sbjct_end:
+                bs = br.sbjct_start
+                be = br.sbjct_end
+            else:
+                bs = br.sbjct_end
+                be = br.sbjct_start
+            hsp_marker = ['&mk={}:{}|HSP!'.format(bs, be)]
 
-        else:
-            rr['h_color'] = reference_colors['Not homologous']
+            seqview += hsp_marker
+            sviewlink += hsp_marker
 
-        # create seqviewurl here
-        es = onehit.source.annotations['extended_start']
-        ee = onehit.source.annotations['extended_end']
-        if es > ee:
-            es, ee = [ee, es]
+    else:
+        rr['h_color'] = reference_colors['Not homologous']
 
-        diff = 1000 + 2*lx
-        es -= diff
-        ee += diff
+    # create seqviewurl here
+    es = onehit.source.annotations['extended_start']
+    ee = onehit.source.annotations['extended_end']
+    if es > ee:
+        es, ee = [ee, es]
 
-        if es < 0:
-            es = 1
+    diff = 1000 + 2*lx
+    es -= diff
+    ee += diff
 
-        position = ['&v={}:{}'.format(es, ee)]
-        seqview += position
-        sviewlink += position
+    if es < 0:
+        es = 1
 
-        rr['seqviewurl'] = ''.join(seqview)
-        rr['seqvid'] = 'seqv_{}'.format(i)
-        rr['seqviewlink'] = ''.join(sviewlink)
+    position = ['&v={}:{}'.format(es, ee)]
+    seqview += position
+    sviewlink += position
 
-        jj.append(rr)
-    return jj
+    rr['seqviewurl'] = ''.join(seqview)
+    rr['seqvid'] = 'seqv_{}'.format(i)
+    rr['seqviewlink'] = ''.join(sviewlink)
+    return rr
 
 
-def _prepare_pictures(sub):
+def _prepare_pictures(sub, pictures):
+    """
+    pictures of the structures of sub, pictures = {(sequence, structure): svg} from render_pictures
+     or None, then the structures are drawn in the browser
+    """
     pictureslist = []
-    picfile = None
     for key in sub.letter_annotations.keys():
         np = dict()
         np['picname'] = key
         np['secondary_structure'] = sub.letter_annotations[key]
+        np['pic'] = None
 
-        try:
-            picfile = run_rnaplot(
-                seq=str(sub.seq),
-                structure=sub.letter_annotations[key],
-                format='svg'
-            )
-            with open(picfile) as f:
-                np['pic'] = "data:image/svg+xml;utf8," + f.read()
-
-            pictureslist.append(np)
+        if pictures is not None:
+            svg = pictures.get((str(sub.seq), sub.letter_annotations[key]))
+            if svg is None:
+                print("can't draw structure with RNAfold for {}.".format(sub.id))
+                continue
+            np['pic'] = "data:image/svg+xml;utf8," + svg
 
-            remove_one_file_with_try(picfile)
-        except RNAplotException:
-            print("can't draw structure with RNAfold for {}.".format(sub.id))
-        except FileNotFoundError:
-            if picfile is not None:
-                print('cannot remove file: {}, file not found'.format(picfile))
-        except OSError:
-            if picfile is not None:
-                print('cannot remove file: {}, file is directory'.format(picfile))
+        pictureslist.append(np)
 
     return pictureslist
 
@@ -247,10 +317,14 @@ def _prepare_footer(data):
     if not hasattr(data, 'date_of_run'):
         data.date_of_run = None
 
+    # structures are predicted once for each distinct sequence
+    n_unique = len({str(h.extension.seq) for h in data.hits})
+
     prepared_footer_data = {
         'command': command,
         'parameters': p_text,
         'exec_date': data.date_of_run,
-        'logdup': data.msgs
+        'logdup': data.msgs,
+        'dedup': dedup_msg(n_unique, len(data.hits)),
     }
     return prepared_footer_data
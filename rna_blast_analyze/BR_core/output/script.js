@@ -10,22 +10,42 @@ var BtnSortEvalDescTxt = "Sort Eval desc.";
 function exportSelected(classname) {
   console.log("export selection");
   /*
-        Find all checkboxes
-        return data to fasta
+        Find all checked checkboxes
+        in the paged report also in the hits which were removed from the page
         */
-      var checkboxes;
-      var checked = new Array(0);
-      var i;
-
-      checkboxes = document.getElementsByClassName(classname);
+  var roots = [document];
+  var chunks = document.getElementsByClassName("hitchunk");
+  var checked = new Array(0);
+  var i;
+  var j;
+
+  if (chunks.length !== 0) {
+    roots = [];
+    for (i = 0; i < chunks.length; i++) {
+      var n = chunks[i].id.substring(8);
+      if (chunks[i].dataset.loaded === "true") {
+        roots.push(chunks[i]);
+      } else if (n in hitChunks) {
+        roots.push(detachedChunk(n));
+      }
+    }
+  }
 
-      for (i = 0; i < checkboxes.length; i++) {
-        if (checkboxes[i].checked) {
-          checked.push(checkboxes[i]);
-        }
+  for (i = 0; i < roots.length; i++) {
+    var checkboxes = roots[i].querySelectorAll("." + classname);
+    for (j = 0; j < checkboxes.length; j++) {
+      if (checkboxes[j].checked) {
+        checked.push(checkboxes[j]);
       }
-      return checked;
     }
+  }
+  return checked;
+}
+
+function hitElement(box, id) {
+  // element of the same hit as the checkbox (the hit may not be on the page)
+  return box.getRootNode().getElementById(id);
+}
 
 function buildFastaStructure(seqname, sequence, structure) {
   return ">" + seqname + "\n" + sequence + "\n" + structure + "\n";
@@ -56,9 +76,9 @@ function writeSelectionStructures() {
 
   for (i = 0; i < sel.length; i++) {
     var intid = parseInt(sel[i].id)
-    var oh = document.getElementById(intid + "onehit");
-    var seqname = oh.dataset.brna_seqname + "-" + sel[i].dataset.method + " " + document.getElementById(intid + "SeqStart").textContent + "-" + document.getElementById(intid + "SeqEnd").textContent
-    exportdata += buildFastaStructure(seqname, oh.dataset.brna_sequence, document.getElementById(intid + sel[i].dataset.method).dataset.brna_secondary_structure);
+    var oh = hitElement(sel[i], intid + "onehit");
+    var seqname = oh.dataset.brna_seqname + "-" + sel[i].dataset.method + " " + hitElement(sel[i], intid + "SeqStart").textContent + "-" + hitElement(sel[i], intid + "SeqEnd").textContent
+    exportdata += buildFastaStructure(seqname, oh.dataset.brna_sequence, hitElement(sel[i], intid + sel[i].dataset.method).dataset.brna_secondary_structure);
   }
   mySaveFile("data:application/txt," + encodeURIComponent(exportdata), "structures.txt");
 }
@@ -66,6 +86,7 @@ function writeSelectionStructures() {
 function placeSelection(boxlist, val2place) {
   for (i = 0; i < boxlist.length; i++) {
     boxlist[i].checked = val2place;
+    rememberBox(boxlist[i]);
   }
 }
 
@@ -104,7 +125,7 @@ function writeSelectionFasta() {
 
   for (i = 0; i < sel.length; i++) {
     var intid = parseInt(sel[i].id)
-    var pnodedata = document.getElementById(intid + "FormSeq");
+    var pnodedata = hitElement(sel[i], intid + "FormSeq");
 
     exportdata += pnodedata.textContent;
   }
@@ -210,4 +231,171 @@ function viewAllRegions() {
     viewRegionCallback(rem_sv_btns[i]);
   }
 }
+
+function drawArcs(pic) {
+  // Draw the structure (dot-bracket with pseudoknot brackets) as an arc diagram.
+  // Used for pictures which were not rendered by RNAplot (lazy picture mode).
+  var structure = pic.dataset.brna_secondary_structure;
+  var closing = {")": "(", "]": "[", "}": "{", ">": "<"};
+  var stacks = {"(": [], "[": [], "{": [], "<": []};
+  var svgns = "http://www.w3.org/2000/svg";
+  var height = 1;
+  var i;
+
+  for (i = 0; i < structure.length; i++) {
+    var c = structure.charAt(i);
+    if (c in stacks) {
+      stacks[c].push(i);
+    } else if (c in closing && stacks[closing[c]].length) {
+      var j = stacks[closing[c]].pop();
+      var r = (i - j) / 2;
+      var arc = document.createElementNS(svgns, "path");
+      arc.setAttribute("d", "M " + (j + 0.5) + " 0 A " + r + " " + r + " 0 0 1 " + (i + 0.5) + " 0");
+      arc.setAttribute("class", c === ")" ? "arc" : "arc pk");
+      pic.appendChild(arc);
+      height = Math.max(height, r);
+    }
+  }
+  var line = document.createElementNS(svgns, "line");
+  line.setAttribute("x1", 0);
+  line.setAttribute("x2", structure.length);
+  line.setAttribute("class", "backbone");
+  pic.appendChild(line);
+  pic.setAttribute("viewBox", "0 " + (-height - 1) + " " + structure.length + " " + (height + 2));
+}
+
+function drawVisibleArcs(root) {
+  // Draw the lazy pictures (in root element or whole document) when they are scrolled into view
+  var pics = (root || document).getElementsByClassName("rnaarc");
+  var i;
+  if (!("IntersectionObserver" in window)) {
+    for (i = 0; i < pics.length; i++) {
+      drawArcs(pics[i]);
+    }
+    return;
+  }
+  var observer = new IntersectionObserver(function(entries, obs) {
+    entries.forEach(function(entry) {
+      if (entry.isIntersecting) {
+        drawArcs(entry.target);
+        obs.unobserve(entry.target);
+      }
+    });
+  });
+  for (i = 0; i < pics.length; i++) {
+    observer.observe(pics[i]);
+  }
+}
+
+// Paged report: hits are stored in chunk files (gzip compressed json in base64 wrapped in a script),
+//  chunks are loaded when they get near the viewport and removed from the page when they are far away.
+var hitChunks = {};
+// checked checkboxes {class:intid:method: true}, the state is restored when the chunk is shown again
+var checkedBoxes = {};
+
+function boxKey(box) {
+  return box.className + ":" + parseInt(box.id) + ":" + (box.dataset.method || "");
+}
+
+function rememberBox(box) {
+  if (box.checked) {
+    checkedBoxes[boxKey(box)] = true;
+  } else {
+    delete checkedBoxes[boxKey(box)];
+  }
+}
+
+function restoreBoxes(root) {
+  var boxes = root.querySelectorAll("input[type=checkbox]");
+  var i;
+  for (i = 0; i < boxes.length; i++) {
+    boxes[i].checked = boxKey(boxes[i]) in checkedBoxes;
+  }
+}
+
+function detachedChunk(n) {
+  // hits of the chunk which is not on the page, with the checkbox state
+  var template = document.createElement("template");
+  template.innerHTML = hitChunks[n].join("");
+  restoreBoxes(template.content);
+  return template.content;
+}
+
+function hitChunk(n, payload) {
+  // called by the loaded chunk script
+  var bytes = Uint8Array.from(atob(payload), function(c) { return c.charCodeAt(0); });
+  var stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream("gzip"));
+  new Response(stream).text().then(function(text) {
+    hitChunks[n] = JSON.parse(text);
+    showChunk(document.getElementById("hitchunk" + n));
+  });
+}
+
+function showChunk(chunk) {
+  var n = chunk.id.substring(8);
+  if (!(n in hitChunks)) {
+    if (chunk.dataset.loaded === "loading") {
+      return;
+    }
+    chunk.dataset.loaded = "loading";
+    var script = document.createElement("script");
+    script.src = chunk.dataset.src;
+    script.onload = function() { document.head.removeChild(script); };
+    document.head.appendChild(script);
+    return;
+  }
+  if (chunk.dataset.loaded !== "true") {
+    chunk.innerHTML = hitChunks[n].join("");
+    restoreBoxes(chunk);
+    chunk.style.height = "auto";
+    chunk.dataset.loaded = "true";
+    drawVisibleArcs(chunk);
+  }
+}
+
+function hideChunk(chunk) {
+  // keep the height, so the scroll position does not change
+  if (chunk.dataset.loaded === "true") {
+    chunk.style.height = chunk.offsetHeight + "px";
+    chunk.innerHTML = "";
+    chunk.dataset.loaded = "false";
+  }
+}
+
+function watchChunks() {
+  var chunks = document.getElementsByClassName("hitchunk");
+  var i;
+  if (chunks.length === 0) {
+    return;
+  }
+  var near = new IntersectionObserver(function(entries) {
+    entries.forEach(function(entry) {
+      if (entry.isIntersecting) {
+        showChunk(entry.target);
+      }
+    });
+  }, {rootMargin: "1000px 0px"});
+  var far = new IntersectionObserver(function(entries) {
+    entries.forEach(function(entry) {
+      if (!entry.isIntersecting) {
+        hideChunk(entry.target);
+      }
+    });
+  }, {rootMargin: "5000px 0px"});
+  for (i = 0; i < chunks.length; i++) {
+    near.observe(chunks[i]);
+    far.observe(chunks[i]);
+  }
+}
+
+document.addEventListener("change", function(event) {
+  if (event.target.type === "checkbox") {
+    rememberBox(event.target);
+  }
+});
+
+document.addEventListener("DOMContentLoaded", function() {
+  drawVisibleArcs();
+  watchChunks();
+});
 </script>
@@ -0,0 +1,89 @@
+"""Secondary structure pictures for the html output.
+
+Each distinct (sequence, structure) pair is drawn once, the pictures are rendered with RNAplot in parallel threads
+ (each call runs in its own process and does not change the working directory) and stored in the "rnaplot" cache,
+ so the same structures are not drawn again in the next runs.
+In the lazy mode nothing is rendered, the structures are drawn by the browser (script.js) when they are shown.
+"""
+import os
+import shutil
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha1
+
+from rna_blast_analyze.BR_core.config import CONFIG
+from rna_blast_analyze.BR_core.exceptions import RNAplotException
+from rna_blast_analyze.BR_core.result_cache import open_cache, cache_key, hit_rate_msg
+from rna_blast_analyze.BR_core.viennaRNA import rnaplot_svg
+
+ml = logging.getLogger('rboAnalyzer')
+
+PICTURE_MODES = ('rnaplot', 'lazy')
+
+_fingerprint = {}
+
+
+def rnaplot_fingerprint():
+    """Identify RNAplot executable by path, size and modification time, upgrade invalidates cached pictures."""
+    key = CONFIG.viennarna_path
+    if key not in _fingerprint:
+        h = sha1()
+        path = shutil.which(CONFIG.viennarna_path + 'RNAplot')
+        if path is None:
+            h.update(b'RNAplot:missing')
+        else:
+            st = os.stat(path)
+            h.update('RNAplot:{}:{}:{}'.format(os.path.realpath(path), st.st_size, st.st_mtime).encode())
+        _fingerprint[key] = h.hexdigest()
+    return _fingerprint[key]
+
+
+def _render(pair):
+    seq, structure = pair
+    try:
+        return rnaplot_svg(seq, structure)
+    except (RNAplotException, OSError, subprocess.SubprocessError) as e:
+        # missing or hanging RNAplot must not stop writing the html output, the picture is left out
+        ml.debug('RNAplot failed for {}: {}'.format(structure, str(e)))
+        return None
+
+
+def render_pictures(records, threads=None):
+    """
+    Draw structures of all records (all letter annotations) with RNAplot
+    :param records: SeqRecords with structures in letter_annotations
+    :param threads: number of RNAplot processes run at once
+    :return: dict {(sequence, structure): svg text or None if it can't be drawn}
+    """
+    pairs = {
+        (str(rec.seq), structure) for rec in records for structure in rec.letter_annotations.values()
+    }
+    pictures = {}
+    if not pairs:
+        return pictures
+
+    cache = open_cache('rnaplot')
+    keys = {}
+    if cache is not None:
+        before = cache.stats()
+        fingerprint = rnaplot_fingerprint()
+        for pair in pairs:
+            keys[pair] = cache_key('rnaplot-svg', fingerprint, *pair)
+            svg = cache.get(keys[pair])
+            if svg is not None:
+                pictures[pair] = svg
+
+    to_render = sorted(pairs - set(pictures))
+    if to_render:
+        ml.info('Drawing {} structures with RNAplot ({} cached).'.format(len(to_render), len(pictures)))
+        workers = max(1, min(threads or os.cpu_count(), len(to_render)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for pair, svg in zip(to_render, executor.map(_render, to_render)):
+                pictures[pair] = svg
+                if svg is not None and cache is not None:
+                    cache.put(keys[pair], svg)
+
+    if cache is not None:
+        ml.info(hit_rate_msg('RNAplot', before, cache.stats()))
+    return pictures
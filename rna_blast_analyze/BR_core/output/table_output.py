@@ -0,0 +1,186 @@
+"""Columnar output of the result table (same data as the csv output) in Parquet or Arrow IPC format.
+
+The tables of all queries are appended to one file, each query as one row group (Parquet) or record batch (Arrow),
+ with the query number in the "iteration" column. The queries are computed concurrently, table of a query is
+ written as soon as all queries with lower iteration are finished (reported by query_finished), only tables of
+ queries which finished out of order are kept in memory. So the output is in the order of the queries.
+The format is selected by the file extension. Requires pyarrow.
+"""
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+ml = logging.getLogger('rboAnalyzer')
+
+TABLE_FORMATS = {
+    '.parquet': 'parquet',
+    '.arrow': 'arrow',
+    '.feather': 'arrow',
+}
+
+# columns not listed are stored as strings
+_COLUMN_TYPES = {
+    'iteration': 'int64',
+    'bstart': 'int64',
+    'bend': 'int64',
+    'estart': 'int64',
+    'eend': 'int64',
+    'query_start': 'int64',
+    'query_end': 'int64',
+    'b_e_start': 'int64',
+    'b_e_end': 'int64',
+    'blast_bits': 'float64',
+    'blast_eval': 'float64',
+    'locarna_score': 'float64',
+}
+
+class _SharedWriters(object):
+    def __init__(self):
+        self.writers = {}
+        self.finished = set()
+        # lowest iteration which is not finished
+        self.next = 0
+
+
+_SHARED = None
+_SHARED_LOCK = threading.Lock()
+
+
+def table_format(path):
+    """Return the format ('parquet' or 'arrow') of the table file or None if the extension is not known."""
+    return TABLE_FORMATS.get(os.path.splitext(path)[1].lower())
+
+
+def _schema(columns):
+    return pyarrow.schema(
+        [(c, pyarrow.type_for_alias(_COLUMN_TYPES.get(c, 'string'))) for c in columns]
+    )
+
+
+class TableWriter(object):
+    """Append tables of the queries to one file in the order of iterations, the file is complete after close.
+
+    next_iteration returns the lowest iteration which is not finished. Table is written when its iteration
+     is not greater, the others wait in memory for flush. Without next_iteration the tables are written immediately.
+    """
+    def __init__(self, path, next_iteration=None):
+        if pyarrow is None:
+            raise ImportError('Writing the table output requires pyarrow.')
+        self.path = path
+        self.format = table_format(path)
+        if self.format is None:
+            raise ValueError(
+                'Unknown table format of {}, use one of: {}'.format(path, ', '.join(sorted(TABLE_FORMATS)))
+            )
+        self.next_iteration = next_iteration
+        self._writer = None
+        self._sink = None
+        self._schema = None
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def write(self, df, iteration):
+        data = df.copy()
+        data.insert(0, 'iteration', iteration)
+        with self._lock:
+            if self._schema is None:
+                self._schema = _schema(data.columns)
+            table = pyarrow.Table.from_pandas(data, schema=self._schema, preserve_index=False)
+            # tables of one iteration stay in the order they were written
+            self._pending.append((iteration, len(self._pending), table))
+            self._write_pending(self.next_iteration() if self.next_iteration else None)
+
+    def flush(self):
+        """Write the tables which are not waiting for lower iterations."""
+        with self._lock:
+            self._write_pending(self.next_iteration() if self.next_iteration else None)
+
+    def _write_pending(self, upto):
+        ready = sorted(t for t in self._pending if upto is None or t[0] <= upto)
+        if not ready:
+            return
+        self._pending = [t for t in self._pending if upto is not None and t[0] > upto]
+        if self._writer is None:
+            self._open(self._schema)
+        for _, _, table in ready:
+            self._writer.write_table(table)
+
+    def _open(self, schema):
+        if self.format == 'parquet':
+            self._writer = pyarrow.parquet.ParquetWriter(self.path, schema)
+        else:
+            self._sink = pyarrow.OSFile(self.path, 'wb')
+            self._writer = pyarrow.ipc.new_file(self._sink, schema)
+
+    def close(self):
+        with self._lock:
+            # tables of queries following a query which did not finish
+            self._write_pending(None)
+            if self._writer is not None:
+                self._writer.close()
+            if self._sink is not None:
+                self._sink.close()
+            self._writer = self._sink = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+@contextmanager
+def shared_table_writers():
+    """Tables written within the context to the same path are appended to one file, closed when leaving."""
+    global _SHARED
+    previous = _SHARED
+    _SHARED = _SharedWriters()
+    try:
+        yield
+    finally:
+        shared, _SHARED = _SHARED, previous
+        for writer in shared.writers.values():
+            writer.close()
+
+
+def _next_iteration():
+    return _SHARED.next
+
+
+def query_finished(iteration):
+    """Report that the query is finished (computed, failed or skipped), its tables were written if any.
+    The tables of the following queries which wait for it are written.
+    """
+    with _SHARED_LOCK:
+        if _SHARED is None:
+            return
+        _SHARED.finished.add(iteration)
+        while _SHARED.next in _SHARED.finished:
+            _SHARED.finished.remove(_SHARED.next)
+            _SHARED.next += 1
+        writers = list(_SHARED.writers.values())
+    # writers take their own lock, which is held while asking for the next iteration
+    for writer in writers:
+        writer.flush()
+
+
+def write_table(path, df, iteration):
+    """Write the table of one query. Outside of shared_table_writers context, the file contains only this query."""
+    ml.info('Writing table to {}.'.format(path))
+    if _SHARED is not None:
+        with _SHARED_LOCK:
+            writer = _SHARED.writers.get(path)
+            if writer is None:
+                writer = _SHARED.writers[path] = TableWriter(path, next_iteration=_next_iteration)
+        writer.write(df, iteration)
+    else:
+        with TableWriter(path) as writer:
+            writer.write(df, iteration)
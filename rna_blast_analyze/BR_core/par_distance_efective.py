@@ -1,6 +1,9 @@
 import RNA
 import argparse
+from functools import partial
 from multiprocessing import Pool
+from rna_blast_analyze.BR_core.parallel import pool_for
+from rna_blast_analyze.BR_core.tree_distance import group_by_reference
 
 
 def f_parser():
@@ -48,15 +51,45 @@ def the_main(fp):
         return distances
 
 
+def run_RNAdistance_batch(reference, structures, timeout=None):
+    """
+    tree edit distance of each structure to the reference, the reference tree is build only once
+     and identical structures are compared only once
+    """
+    c_tree = RNA.make_tree(RNA.expand_Full(reference))
+    done = dict()
+    try:
+        for s in structures:
+            if s not in done:
+                s_tree = RNA.make_tree(RNA.expand_Full(s))
+                done[s] = int(RNA.tree_edit_distance(c_tree, s_tree))
+                RNA.free_tree(s_tree)
+    finally:
+        RNA.free_tree(c_tree)
+    return [done[s] for s in structures]
+
+
+def _run_group(group, timeout=None):
+    return run_RNAdistance_batch(group[0], group[1], timeout=timeout)
+
+
 def compute_distances(fp, threads=1, timeout=None):
+    """
+    fp: list of (reference, structure) pairs
+    pairs with the same reference are computed together
+    """
+    groups = group_by_reference(fp)
     if threads == 1:
-        dist = []
-        for pair in fp:
-            dist.append(run_RNAdistance(pair))
-        return dist
+        group_dist = [_run_group(g, timeout=timeout) for g in groups]
     else:
-        with Pool(processes=threads) as pool:
-            return pool.map(run_RNAdistance, fp)
+        with pool_for(threads) as pool:
+            group_dist = pool.map(partial(_run_group, timeout=timeout), groups)
+
+    dist = [None] * len(fp)
+    for (_, _, idx), d in zip(groups, group_dist):
+        for i, v in zip(idx, d):
+            dist[i] = v
+    return dist
 
 
 def two_files_input(fasta_structures, fasta_reference):
@@ -105,7 +138,7 @@ def compute_RNAfold(sequences, threads=1):
     if threads == 1:
         return [RNAfold(seq) for seq in sequences]
     else:
-        with Pool(processes=threads) as pool:
+        with pool_for(threads) as pool:
             return pool.map(RNAfold, sequences)
 
 
@@ -1,9 +1,13 @@
 import argparse
+import shutil
+from functools import partial
 from multiprocessing import Pool
-from subprocess import check_output
+from subprocess import check_output, CalledProcessError
 
 from rna_blast_analyze.BR_core.config import CONFIG
 from rna_blast_analyze.BR_core import exceptions
+from rna_blast_analyze.BR_core.parallel import pool_for
+from rna_blast_analyze.BR_core.tree_distance import DistanceEngine, group_by_reference
 
 
 def f_parser():
@@ -53,15 +57,57 @@ def the_main(fp):
         return distances
 
 
+def run_RNAdistance_batch(reference, structures, timeout=None):
+    """
+    compares all structures to the reference in single RNAdistance call (-Xf)
+    the distances are computed in-process if RNAdistance is not available
+    """
+    if shutil.which('{}RNAdistance'.format(CONFIG.viennarna_path)) is None:
+        return DistanceEngine(reference).tree_edit_distances(structures)
+
+    try:
+        ret = check_output(
+            [
+                '{}RNAdistance'.format(CONFIG.viennarna_path),
+                '-Xf'
+            ],
+            input='\n'.join([reference] + list(structures)).encode() + b'\n',
+            timeout=timeout
+        )
+    except (ChildProcessError, CalledProcessError):
+        raise exceptions.RNAdistanceException('RNAdistance failed.', 'RNAdistance failed.')
+
+    # one line "f: distance" for each structure compared to the first one
+    dist = [int(float(line.split(':')[1])) for line in ret.decode().splitlines() if ':' in line]
+    if len(dist) != len(structures):
+        raise exceptions.RNAdistanceException(
+            'RNAdistance failed.',
+            'RNAdistance returned {} distances for {} structures.'.format(len(dist), len(structures))
+        )
+    return dist
+
+
+def _run_group(group, timeout=None):
+    return run_RNAdistance_batch(group[0], group[1], timeout=timeout)
+
+
 def compute_distances(fp, threads=1, timeout=None):
+    """
+    fp: list of (reference, structure) pairs
+    pairs with the same reference are computed in one RNAdistance call
+    """
+    groups = group_by_reference(fp)
     if threads == 1:
-        dist = []
-        for pair in fp:
-            dist.append(run_RNAdistance(pair, timeout=timeout))
-        return dist
+        group_dist = [_run_group(g, timeout=timeout) for g in groups]
     else:
-        with Pool(processes=threads) as pool:
-            return pool.map(run_RNAdistance, fp)
+        with pool_for(threads) as pool:
+            group_dist = pool.map(partial(_run_group, timeout=timeout), groups)
+
+    dist = [None] * len(fp)
+    for (_, _, idx), d in zip(groups, group_dist):
+        for i, v in zip(idx, d):
+            dist[i] = v
+    return dist
 
 
 def two_files_input(fasta_structures, fasta_reference):
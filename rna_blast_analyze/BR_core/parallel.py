@@ -0,0 +1,117 @@
+import os
+import logging
+import multiprocessing
+from contextlib import contextmanager
+
+ml = logging.getLogger('rboAnalyzer')
+
+# process pool shared by all pipeline stages, owned by lunch_computation
+_SHARED = None
+
+
+def _indexed_call(pack):
+    func, i, args, star = pack
+    if star:
+        return i, func(*args)
+    else:
+        return i, func(args)
+
+
+class WorkerPool(object):
+    """Process pool executing jobs with imap_unordered in chunks.
+
+    Results are returned in the order of the input. When desc is given, the progress is logged
+     approximately every 10% of completed jobs. The callback(index, result) is called in the parent process
+     as soon as each job is finished.
+    The pool is usable only in the process which created it, in worker processes (and with threads == 1)
+     the jobs are executed serially.
+    """
+    def __init__(self, threads):
+        # same as multiprocessing.Pool - None means all cores
+        self.threads = max(1, threads or os.cpu_count() or 1)
+        self._owner = os.getpid()
+        self._pool = None
+        # daemonic worker processes are not allowed to have children
+        if self.threads > 1 and not multiprocessing.current_process().daemon:
+            self._pool = multiprocessing.Pool(processes=self.threads)
+
+    @property
+    def active(self):
+        return self._pool is not None and self._owner == os.getpid()
+
+    def map(self, func, iterable, chunksize=None, desc=None, callback=None):
+        return self._run(func, iterable, False, chunksize, desc, callback)
+
+    def starmap(self, func, iterable, chunksize=None, desc=None, callback=None):
+        return self._run(func, iterable, True, chunksize, desc, callback)
+
+    def _run(self, func, iterable, star, chunksize, desc, callback):
+        jobs = list(iterable)
+        if not self.active or len(jobs) < 2:
+            results = []
+            for i, args in enumerate(jobs):
+                results.append(_indexed_call((func, i, args, star))[1])
+                if callback is not None:
+                    callback(i, results[-1])
+            return results
+
+        if chunksize is None:
+            # small chunks - the jobs are calls to external tools with very different run times
+            chunksize = max(1, len(jobs) // (self.threads * 8))
+
+        results = [None] * len(jobs)
+        step = max(1, len(jobs) // 10)
+        packs = ((func, i, args, star) for i, args in enumerate(jobs))
+        for done, (i, res) in enumerate(self._pool.imap_unordered(_indexed_call, packs, chunksize), start=1):
+            results[i] = res
+            if callback is not None:
+                callback(i, res)
+            if desc and (done % step == 0 or done == len(jobs)):
+                ml.info('{}: {}/{} done'.format(desc, done, len(jobs)))
+        return results
+
+    def close(self):
+        if self.active:
+            self._pool.close()
+            self._pool.join()
+        self._pool = None
+
+    def terminate(self):
+        if self.active:
+            self._pool.terminate()
+            self._pool.join()
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+
+@contextmanager
+def shared_pool(threads):
+    """Create the pool shared by all stages for the duration of the context.
+    It should be entered early, so the workers are forked before large data are loaded.
+    """
+    global _SHARED
+    previous = _SHARED
+    with WorkerPool(threads) as pool:
+        _SHARED = pool
+        try:
+            yield pool
+        finally:
+            _SHARED = previous
+
+
+@contextmanager
+def pool_for(threads):
+    """Return the shared pool if it is running, otherwise temporary pool with given number of threads."""
+    if _SHARED is not None and _SHARED.active:
+        yield _SHARED
+    else:
+        with WorkerPool(threads) as pool:
+            yield pool
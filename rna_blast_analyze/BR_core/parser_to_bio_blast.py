@@ -5,6 +5,7 @@ import logging
 import math
 import os
 import re
+from functools import partial
 
 from Bio.Alphabet.IUPAC import IUPACAmbiguousDNA
 from Bio.Blast import Record
@@ -32,18 +33,21 @@ def f_parser():
 # if multiple query on txt, we need to seek to EOF, several lines form the end parse the blast information, which is
 # common to all query records
 
-def blast_parse_txt(handle):
+def blast_parse_txt(handle, start_offset=None):
     """
     parser is not prepared to handle joined search outputs from different databases
         the parser do not check for this and will return all records as if they come from the database for last query
     it can handle search output for multiple queries to single database
     :param handle:
+    :param start_offset: offset of the "Query=" line of the first record to parse (records before are skipped)
     :return:
     """
     ml.info(fname())
     lead_info = _read_leading_info(handle)
     trail_info = _read_trailing_info(handle)
     lead_info.update(trail_info)
+    if start_offset is not None:
+        handle.seek(start_offset)
 
     for one_query in _parse_blast_body(handle, lead_info):
         yield one_query
@@ -162,12 +166,14 @@ def _parse_tail_section(tail_text):
     data = dict()
 
     def _find_matches(pattern):
-        ff = [m for m in [re.search(pattern, txt) for txt in tt] if m]
+        search = re.compile(pattern).search
+        ff = [m for m in map(search, tt) if m]
         assert len(ff) == 1
         return ff[0]
 
     def _find_index_match(pattern):
-        return [i for i, m in enumerate([re.search(pattern, txt) for txt in tt]) if m]
+        search = re.compile(pattern).search
+        return [i for i, m in enumerate(map(search, tt)) if m]
 
     # matrix
     try:
@@ -295,6 +301,51 @@ def update_blast_record(br, commonparseddata):
         setattr(br, key, commonparseddata[key])
 
 
+# patterns used in the body of the output, compiled once
+_RE_NO_HITS = re.compile(r'\*{5}\sNo hits found\s\*{5}')
+_RE_NUMBER = re.compile(r' *(\d+)')
+_RE_HIT_ID = re.compile(r'(?<=>) *[\S|.]+')
+_RE_HIT_LENGTH = re.compile(r'(?<=Length=)\d+')
+_RE_BITS = re.compile(r'Score = *(\d+\.?\d*)')
+_RE_SCORE = re.compile(r'bits \( *(\d+)\)')
+# the regexp for scientific format from here:
+# http://stackoverflow.com/questions/18152597/extract-scientific-number-from-string
+_RE_EXPECT = re.compile(r'Expect =(-? *[0-9]+\.?[0-9]*(?:[Ee] *-? *[0-9]+)?)')
+_RE_IDENTITIES = re.compile(r'Identities = *(\d+)/(\d+)(?= *\()')
+_RE_GAPS = re.compile(r'Gaps = *(\d+)/(\d+)(?= *\()')
+_RE_STRAND = re.compile(r'Strand=(\S+)')
+_RE_INT = re.compile(r'\d+')
+# allow lowercase masking sequences
+_RE_ALIGNED_SEQ = re.compile('[ACGTUKSYMWRBDHVNacgtuksymwrbdhvn-]+')
+
+
+class _Lines(object):
+    """
+    Lines of the BLAST output read in single pass
+    bread skips blank lines (as the parser expects), raw returns the lines as they are
+    both return empty line when EOF
+    """
+    __slots__ = ('raw', 'bread')
+
+    def __init__(self, f):
+        lines = iter(f)
+        self.raw = partial(next, lines, '')
+        self.bread = partial(next, (t for t in lines if t != '\n'), '')
+
+
+def _int_at_end(txt):
+    """number at the end of line (as matched by '\\d+$')"""
+    if txt[-1:] == '\n':
+        txt = txt[:-1]
+    return int(txt[len(txt.rstrip('0123456789')):])
+
+
+def _new_record(common_info):
+    br = Record.Blast()
+    update_blast_record(br, copy.deepcopy(common_info))
+    return br
+
+
 def _parse_blast_body(f, common_info):
     """
     run on open handle to file
@@ -311,29 +362,28 @@ def _parse_blast_body(f, common_info):
          input
         if no hits are returned blast will not allow txt file download
     """
+    lines = _Lines(f)
 
     # start the parse loop
-    txt = bread(f)
+    txt = lines.bread()
 
-    record_holder = Record.Blast()
-    update_blast_record(record_holder, common_info)
     do_query_name = True
     do_query_length = True
-    R = copy.deepcopy(record_holder)
+    R = _new_record(common_info)
     while txt != '':
         # parse query name
-        if do_query_name and re.search('^Query=', txt):
-            # query_name = re.search('(?<=Query=)\ *\S+', txt).group().lstrip()
+        if do_query_name and txt[:6] == 'Query=':
             # it is possible, that no query name is provided (web)
-            R.query = re.search(r'(?<=Query=)\s*\S*', txt).group().lstrip()
+            name = txt[6:].split(None, 1)
+            R.query = name[0] if name else ''
             do_query_name = False
-            txt = bread(f)
+            txt = lines.bread()
             continue
 
         # parse query Lenght
-        if do_query_length and re.search('^Length=', txt):
-            R.query_length = int(re.search(r'(?<=Length=) *\d+', txt).group().lstrip())
-            txt = bread(f)
+        if do_query_length and txt[:7] == 'Length=':
+            R.query_length = int(_RE_NUMBER.match(txt, 7).group(1))
+            txt = lines.bread()
             do_query_length = False
             continue
 
@@ -342,101 +392,82 @@ def _parse_blast_body(f, common_info):
         # parse hits to sequence
         if txt[:10] == 'ALIGNMENTS' or txt[0] == '>':
             # enter the alignments loop
-            if txt[0] == '>':
-                # seek before the line as the subsequent function expects it
-                f.seek(f.tell() - len(txt) - 2)
-            [R, txt] = read_aligns(f, R)
-            # R.query_length = query_length
-            # R.query = query_name
+            if txt[0] != '>':
+                # get line after alignments
+                txt = lines.bread()
+            R, txt = read_aligns(lines, R, txt)
             # append blast record object to the temporary wrapper
             yield R
-            R = copy.deepcopy(record_holder)
+            R = _new_record(common_info)
             do_query_name = True
             do_query_length = True
-        elif re.search(r'\*{5}\sNo hits found\s\*{5}', txt) or re.search("^Query=", txt):
+        elif txt[:6] == 'Query=' or _RE_NO_HITS.search(txt):
             # new record
             yield R
-            R = copy.deepcopy(record_holder)
+            R = _new_record(common_info)
             do_query_name = True
             do_query_length = True
-            txt = bread(f)
+            txt = lines.bread()
         else:
             # get the next line
-            txt = bread(f)
+            txt = lines.bread()
 
 
-def read_aligns(f, R):
+def read_aligns(lines, R, txt):
     """
     read alignments
     parse all aligns to end of blast report or to next query sequence
+    txt is the first line of the alignments (the first line starting with ">" is expected)
+    returns the record and the first line not belonging to the alignments
 
     issue:
      now, genebank switched to using accession instead of gis
      and in blast there are accession.version identifier (and sometimes something different)
 
     """
-    # parse_regexp = '[ACTGUactgu\-]+'
-    parse_regexp_q = '[ACGTUKSYMWRBDHVNacgtuksymwrbdhvn-]+'
-    eor = True
-    txt = bread(f)  # get line after alignments
-    # if txt[0] == '>':  # enter a record
-    #     # create an alignment object if we are sure that there is one
-    #     # start of parsing hits to single source sequence
-    while txt and eor:
+    bread = lines.bread
+    while txt:
         if txt[:6] == 'Query=':
             break
-        c = re.search(r'(?<=>) *[\S|.]+', txt)
-        def_rem = bread(f)
-        while not re.search('Length=', def_rem):
-            txt += def_rem
-            def_rem = bread(f)
+        # start of parsing hits to single source sequence
+        c = _RE_HIT_ID.search(txt)
+        definition = [txt]
+        def_rem = bread()
+        while def_rem and 'Length=' not in def_rem:
+            definition.append(def_rem)
+            def_rem = bread()
         # get new alig object
         curr_alig = Record.Alignment()
 
         curr_alig.hit_id = c.group()
-        curr_alig.hit_def = txt[c.end() + 1:]
-        curr_alig.length = int(re.search(r'(?<=Length=)\d+', def_rem).group())
+        curr_alig.hit_def = ''.join(definition)[c.end() + 1:]
+        curr_alig.length = int(_RE_HIT_LENGTH.search(def_rem).group())
 
         # draw next line
-        txt = bread(f)
+        txt = bread()
 
-        while txt and eor:
+        while txt:
             # loop the hsps of the record
             if txt[0] == '>' or txt[:6] == 'Query=':
-                # R.alignments.append(curr_alig)
                 break
 
             curr_hsp = Record.HSP()
 
-            while txt and eor:
+            while txt:
                 # parse scores
                 if txt[:8] == " Score =":
                     # changing "score" to bits
                     # because the score is in "bits" units
-                    curr_hsp.bits = float(
-                        re.search(r'(?<=Score =) *\d+\.?\d*', txt).group(0).lstrip()
-                    )
-                    # if re.search('bits \(', txt):
+                    curr_hsp.bits = float(_RE_BITS.search(txt).group(1))
 
                     # changing "bits" to score, because the number in brackets is match score (in nucleotide blast
                     #  same as number of identities)
-                    curr_hsp.score = int(
-                        re.search(r'(?<=bits \() *\d+(?=\))', txt).group(0).lstrip()
-                    )
-                    # the regexp for scientific format from here:
-                    # http://stackoverflow.com/questions/18152597/extract-scientific-number-from-string
-                    curr_hsp.expect = float(
-                        re.search(r'(?<=Expect =)-? *[0-9]+\.?[0-9]*(?:[Ee] *-? *[0-9]+)?', txt).group(0).lstrip()
-                    )
+                    curr_hsp.score = int(_RE_SCORE.search(txt).group(1))
+                    curr_hsp.expect = float(_RE_EXPECT.search(txt).group(1).lstrip())
                 elif txt[:13] == " Identities =":
                     # return only first int in identities field to mimic the XML parser
-
-                    tmp_idtts = [
-                        int(i) for i in re.search(r'(?<=Identities =) *\d+/\d+(?= *\()', txt).group(0).lstrip().split('/')
-                    ]
-                    tmp_gaps = [
-                        int(i) for i in re.search(r'(?<=Gaps =) *\d+/\d+(?= *\()', txt).group(0).lstrip().split('/')
-                    ]
+                    tmp_idtts = [int(i) for i in _RE_IDENTITIES.search(txt).groups()]
+                    tmp_gaps = [int(i) for i in _RE_GAPS.search(txt).groups()]
                     curr_hsp.identities = tmp_idtts[0]
                     curr_hsp.gaps = tmp_gaps[0]
 
@@ -444,36 +475,28 @@ def read_aligns(f, R):
 
                     curr_hsp.align_length = tmp_idtts[1]
 
-                    del tmp_idtts
-                    del tmp_gaps
-
                 elif txt[:8] == " Strand=":
-                    curr_hsp.strand = tuple(
-                        re.search(
-                            r'(?<=Strand=)\S+', txt).group(0).rstrip().split('/')
-                    )
+                    curr_hsp.strand = tuple(_RE_STRAND.search(txt).group(1).split('/'))
                 elif txt[:10] == " Features ":
-                    # must be enabled even if output isn't used, moves the pointer pas the features field
-                    parsed_features = _parse_features(f, txt)
-                    curr_hsp.features = parsed_features
+                    # must be enabled even if output isn't used, moves past the features field
+                    curr_hsp.features, txt = _parse_features(lines, txt)
+                    continue
 
                 elif txt[:5] == "Query":
                     break
 
                 else:
-                    ml.debug("line ignored pos {} - {}".format(f.tell(), txt))
+                    ml.debug("line ignored - {}".format(txt))
 
                 # read next line
-                txt = bread(f)
+                txt = bread()
 
             # start of alignment (hsps) parse block
-            # hsps starts with "Score ="
-            qseq = ''
-            mid = ''
-            sseq = ''
+            qseq = []
+            mid = []
+            sseq = []
             count = 1
-            # while not re.search('Score =', txt):
-            while txt[:8] != " Score =" or txt[:10] != " Features ":
+            while True:
                 # Features in this part
                 # Features flanking this part
 
@@ -485,74 +508,67 @@ def read_aligns(f, R):
                 #       b) continue with next alignment (different source sequence (organism))
                 #       c) be an EOF (this is not signaled) - tail was already parsed
 
-                # read alignment
                 # read alignment by triples
-                if not txt[:5] == 'Query':
+                if txt[:5] != 'Query':
                     # this is eof (may not be)
                     while txt != '':
-                        # if 'Database' in txt or 'database' in txt:
-                        #     pass
                         if (txt[:6] == 'Query=') or (txt[0] == ">"):
-                            # raise AssertionError('parser failed - unparsed record at %s', txt)
                             break
-                        txt = bread(f)
-                    # eor = False
+                        txt = bread()
                     break
 
                 # get query start only at first instance
                 if count == 1:
-                    query_start = int(re.search(r'\d+', txt[5:]).group())
+                    query_start = int(_RE_INT.search(txt, 5).group())
 
                 # match query end at each instance
-                query_end = int(re.search(r'\d+$', txt).group())
+                query_end = _int_at_end(txt)
 
-                # allow lowercase masking sequences
-                # add 5 to prevent matching in Query
-                q_info = re.search(parse_regexp_q, txt[5:])
-                qseq += q_info.group()
+                # skip 5 to prevent matching in Query
+                q_info = _RE_ALIGNED_SEQ.search(txt, 5)
+                qstart, qend = q_info.span()
+                qseq.append(q_info.group())
 
                 # get middle line
-                txt = bread(f)
-                mid += txt[q_info.start() + 5:q_info.end() + 5]
+                txt = bread()
+                mid.append(txt[qstart:qend])
 
-                txt = bread(f)
-                sseq += txt[q_info.start() + 5:q_info.end() + 5]
+                txt = bread()
+                sseq.append(txt[qstart:qend])
 
                 if count == 1:
-                    subject_start = int(re.search(r'\d+', txt[5:]).group())
+                    subject_start = int(_RE_INT.search(txt, 5).group())
 
-                subject_end = int(re.search(r'\d+$', txt).group())
+                subject_end = _int_at_end(txt)
 
                 # go next
-                txt = bread(f)
+                txt = bread()
                 count += 1
-                if (txt[0] == '>') or (txt[:8] == " Score =") or (txt[:6] == 'Query=') or txt[:10] == " Features ":
+                if txt[:1] == '>' or txt[:8] == " Score =" or txt[:6] == 'Query=' or txt[:10] == " Features ":
                     break
 
             # if end of iteration save current hsp and go for next one
-            curr_hsp.query = qseq
-            curr_hsp.match = mid
-            curr_hsp.sbjct = sseq
+            curr_hsp.query = ''.join(qseq)
+            curr_hsp.match = ''.join(mid)
+            curr_hsp.sbjct = ''.join(sseq)
             curr_hsp.query_start = query_start
             curr_hsp.query_end = query_end
             curr_hsp.sbjct_start = subject_start
             curr_hsp.sbjct_end = subject_end
 
-            assert len(qseq) == len(mid) == len(sseq)
+            assert len(curr_hsp.query) == len(curr_hsp.match) == len(curr_hsp.sbjct)
 
             # append hsps to current alignment
             curr_alig.hsps.append(curr_hsp)
 
         R.alignments.append(curr_alig)
 
-    if not eor and len(R.alignments) == 0:
-        R.alignments.append(curr_alig)
     if len(R.alignments) == 0:
         print('no hits parsed')
     return R, txt
 
 
-def _parse_features(f, txt):
+def _parse_features(lines, txt):
     """
     there is two kinds of features
     1) Features in this part of subject sequence:
@@ -561,30 +577,28 @@ def _parse_features(f, txt):
     in both cases, they may be multiline
 
     :param txt: str
-    :return:
+    :return: parsed features and the next line to parse
     """
 
     pf = None
     if txt[:43] == " Features in this part of subject sequence:":
-        pf = _features_inside(f, f.readline())
+        pf = _features_inside(lines, lines.raw())
+        txt = lines.bread()
     elif txt[:49] == " Features flanking this part of subject sequence:":
-        pf = _features_flanking(f, f.readline())
+        pf = _features_flanking(lines, lines.raw())
+        txt = lines.bread()
     else:
         # just find the start of expected line
-        t = f.tell()
-        while not (txt[:5] == "Query"):
-            t = f.tell()
-            txt = f.readline()
-        # seek to before query was encountered
-        f.seek(t)
-    return pf
+        while txt and not (txt[:5] == "Query"):
+            txt = lines.raw()
+    return pf, txt
 
 
-def _features_inside(f, txt):
+def _features_inside(lines, txt):
     feature = []
     while txt[:3] == "   ":
         feature.append(txt)
-        txt = f.readline()
+        txt = lines.raw()
 
     return "".join(feature)
 
@@ -593,40 +607,30 @@ def _parse_features_flank(txt):
     return int(txt.strip().split()[0]), "side".join(txt.split("side:")[1:])
 
 
-def _features_flanking_strict(f, txt):
+def _features_flanking_strict(lines, txt):
     flanks = [None, None]
     while txt[:3] == "   ":
-        if re.search("at 5' side:", txt):
+        if "at 5' side:" in txt:
             flanks[0] = _parse_features_flank(txt)
 
-        elif re.search("at 3' side:", txt):
+        elif "at 3' side:" in txt:
             flanks[1] = _parse_features_flank(txt)
         else:
             ml.debug("flanking feature parsing failed for line: {}".format(txt))
 
-        txt = f.readline()
+        txt = lines.raw()
     return flanks
 
 
-def _features_flanking(f, txt):
+def _features_flanking(lines, txt):
     flanks = []
     while txt[:3] == "   ":
-        if re.search("at 5' side:", txt):
+        if "at 5' side:" in txt:
             flanks.append(txt)
-        elif re.search("at 3' side:", txt):
+        elif "at 3' side:" in txt:
             flanks.append(txt)
         else:
             ml.debug("flanking feature parsing failed for line: {}".format(txt))
 
-        txt = f.readline()
+        txt = lines.raw()
     return flanks
-
-
-def bread(f):
-    """read one line and skip blank lines
-    return empty line when EOF"""
-
-    t = f.readline()
-    while t == '\n':
-        t = f.readline()
-    return t
@@ -3,7 +3,7 @@ import os
 import re
 from subprocess import call
 from tempfile import mkstemp, TemporaryFile
-import multiprocessing
+from functools import partial
 
 import numpy as np
 from Bio import AlignIO, SeqIO
@@ -19,11 +19,12 @@ from rna_blast_analyze.BR_core.config import CONFIG
 from rna_blast_analyze.BR_core.db2shape import nesting
 from rna_blast_analyze.BR_core.decorators import timeit_decorator
 from rna_blast_analyze.BR_core.fname import fname
+from rna_blast_analyze.BR_core.fold_backend import fold_fasta
 from rna_blast_analyze.BR_core.infer_homology import alignment_column_conservation
 from rna_blast_analyze.BR_core.par_distance import compute_distances
+from rna_blast_analyze.BR_core.parallel import pool_for
 from rna_blast_analyze.BR_core.stockholm_parser import read_st
 from rna_blast_analyze.BR_core import exceptions
-from rna_blast_analyze.BR_core.viennaRNA import rnafold_fasta
 
 ml = logging.getLogger('rboAnalyzer')
 
@@ -412,7 +413,7 @@ def alifold_refold_prediction(nr_homologs_hits_fasta, all_hits_fasta, refold='re
             if '-C' not in rnafold_parameters:
                 rnafold_parameters += ' -C'
 
-            seq_str = rnafold_prediction(refold_file, params=rnafold_parameters)
+            seq_str = rnafold_prediction(refold_file, params=rnafold_parameters, threads=threads or 1)
 
         else:
             seq_str = read_seq_str(refold_file)
@@ -494,7 +495,9 @@ def cmmodel_rnafold_c(allhits_fasta, cmmodel_file, threads=None, params=None, ti
         ))
 
     temp_constraint_file = compute_refold(temp_clustal_aln, temp_mock_consensus, timeout=timeout)
-    structures = rnafold_prediction(temp_constraint_file, params=rnafold_params, timeout=timeout)
+    structures = rnafold_prediction(
+        temp_constraint_file, params=rnafold_params, timeout=timeout, threads=threads or 1
+    )
     str_out = desanitize_fasta_names_in_seqrec_list(structures, san_dict)
 
     remove_files_with_try([
@@ -589,9 +592,9 @@ def rfam_subopt_pred(all_sequence_fasta, cm_ref_str, params=None, threads=1, tim
         for seq in subs:
             new_structures.append(_helper_subopt(seq, cm_ref_str, timeout=timeout))
     else:
-        with multiprocessing.Pool(processes=threads) as pool:
+        with pool_for(threads) as pool:
             tuples = [(seq, cm_ref_str) for seq in subs]
-            new_structures = pool.starmap(_helper_subopt, tuples)
+            new_structures = pool.starmap(partial(_helper_subopt, timeout=timeout), tuples, desc='RNAdistance')
 
     return new_structures
 
@@ -601,16 +604,9 @@ def rnafold_wrap_for_predict(*args, **kwargs):
     return rnafold_prediction(*args, **kwargs)
 
 
-def rnafold_prediction(fasta2predict, params='', timeout=None):
+def rnafold_prediction(fasta2predict, params='', timeout=None, threads=1):
     ml.debug(fname())
-    fd, structure_output_file = mkstemp(prefix='rba_', suffix='_54', dir=CONFIG.tmpdir)
-    os.close(fd)
-
-    structure_output_file = rnafold_fasta(fasta2predict, structure_output_file, params, timeout=timeout)
-
-    structures = read_seq_str(structure_output_file)
-    remove_one_file_with_try(structure_output_file)
-    return structures
+    return fold_fasta(fasta2predict, params=params, threads=threads, timeout=timeout)
 
 
 @timeit_decorator
@@ -646,15 +642,15 @@ def subopt_fold_query(all_fasta_hits_file, query_file, params=None, threads=1, t
         for seq in subs:
             new_structures.append(_helper_subopt(seq, qs_string, timeout=timeout))
     else:
-        with multiprocessing.Pool(processes=threads) as pool:
+        with pool_for(threads) as pool:
             tuples = [(seq, qs_string) for seq in subs]
-            new_structures = pool.starmap(_helper_subopt, tuples)
+            new_structures = pool.starmap(partial(_helper_subopt, timeout=timeout), tuples, desc='RNAdistance')
 
     return new_structures
 
 
 @timeit_decorator
-def subopt_fold_alifold(all_fasta_hits_file, homologs_file, aligner='muscle', params=None, threads=None):
+def subopt_fold_alifold(all_fasta_hits_file, homologs_file, aligner='muscle', params=None, threads=None, timeout=None):
     """
     run clustal/muscle on selected homologs file
     :return:
@@ -686,17 +682,17 @@ def subopt_fold_alifold(all_fasta_hits_file, homologs_file, aligner='muscle', pa
     alif_str = read_seq_str(alif_file)[0]
     consensus_structure = alif_str.letter_annotations['ss0']
 
-    subs = run_hybrid_ss_min(all_fasta_hits_file, mfold=params.get('mfold', (10, 2, 20)), threads=threads)
+    subs = run_hybrid_ss_min(all_fasta_hits_file, mfold=params.get('mfold', (10, 2, 20)), threads=threads, timeout=timeout)
 
     # now compute rna distance score
     if threads == 1:
         new_structures = []
         for seq in subs:
-            new_structures.append(_helper_subopt(seq, consensus_structure))
+            new_structures.append(_helper_subopt(seq, consensus_structure, timeout=timeout))
     else:
-        with multiprocessing.Pool(processes=threads) as pool:
+        with pool_for(threads) as pool:
             tuples = [(seq, consensus_structure) for seq in subs]
-            new_structures = pool.starmap(_helper_subopt, tuples)
+            new_structures = pool.starmap(partial(_helper_subopt, timeout=timeout), tuples, desc='RNAdistance')
 
     remove_files_with_try([alif_file, alig_file])
     return new_structures
@@ -707,7 +703,7 @@ def _helper_subopt(seq, consensus_structure, timeout=None):
         str2compare = []
         key_list = []
         for key in seq.annotations['sss']:
-            str2compare.append((seq.letter_annotations[key], consensus_structure))
+            str2compare.append((consensus_structure, seq.letter_annotations[key]))
             key_list.append(key)
         rnadist_score = compute_distances(str2compare, timeout=timeout)
 
@@ -5,6 +5,10 @@ import gzip
 import numpy as np
 import pandas
 import json
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from copy import deepcopy
 from tempfile import mkstemp
 from Bio import AlignIO, SeqIO
 from Bio.Phylo.TreeConstruction import DistanceCalculator
@@ -15,7 +19,8 @@ import rna_blast_analyze.BR_core.predict_structures
 from rna_blast_analyze.BR_core.BA_methods import HitList
 from rna_blast_analyze.BR_core.BA_support import iter2file_name, add_loc_to_description
 from rna_blast_analyze.BR_core.centroid_homfold import me_centroid_homfold, centroid_homfold_fast
-from rna_blast_analyze.BR_core.cmalign import RfamInfo, run_cmfetch, extract_ref_from_cm, run_cmemit
+from rna_blast_analyze.BR_core.cmalign import RfamInfo
+from rna_blast_analyze.BR_core import cm_store
 from rna_blast_analyze.BR_core.fname import fname
 from rna_blast_analyze.BR_core.infer_homology import infer_hits_cm
 from rna_blast_analyze.BR_core.predict_structures import alifold_refold_prediction, \
@@ -23,15 +28,23 @@ from rna_blast_analyze.BR_core.predict_structures import alifold_refold_predicti
     subopt_fold_alifold, cmmodel_rnafold_c, rfam_subopt_pred
 from rna_blast_analyze.BR_core.predict_structures import find_nc_and_remove, check_lonely_bp
 from rna_blast_analyze.BR_core.turbofold import turbofold_fast, turbofold_with_homologous
-from rna_blast_analyze.BR_core.output.htmloutput import write_html_output
+from rna_blast_analyze.BR_core.output.htmloutput import write_html_output, write_html_paged
 from rna_blast_analyze.BR_core.convert_classes import blastsearchrecompute2dict
+from rna_blast_analyze.BR_core.checkpoint import CheckpointStore, prediction_delta
 from rna_blast_analyze.BR_core.filter_blast import filter_by_eval, filter_by_bits
 from rna_blast_analyze.BR_core.config import CONFIG
+from rna_blast_analyze.BR_core.result_cache import open_cache
+from rna_blast_analyze.BR_core.structure_cache import prediction_context, structure_key, record_from_cache
 from rna_blast_analyze.BR_core import exceptions
 from hashlib import sha1
 
 ml = logging.getLogger('rboAnalyzer')
 
+# results of trusted hits selection shared by prediction methods, see shared_prerequisites
+_shared_selection = None
+_shared_selection_users = 0
+_shared_selection_lock = threading.Lock()
+
 safe_prediction_method = [
     'rnafold',
     'centroid-fast',
@@ -43,6 +56,7 @@ safe_prediction_method = [
 
 def wrapped_ending_with_prediction(
     args_inner, analyzed_hits, pred_method=None, method_params=None, used_cm_file=None, multi_query=False, iteration=0,
+    checkpoint=None,
 ):
     """
     wrapper for prediction of secondary structures
@@ -51,6 +65,7 @@ def wrapped_ending_with_prediction(
     :param pred_method:
     :param method_params:
     :param used_cm_file: cmfile if cmfile is known (user given or computed)
+    :param checkpoint: CheckpointStore for the backup file, opened from args_inner if not given
     :return:
     """
     ml.debug(fname())
@@ -71,6 +86,9 @@ def wrapped_ending_with_prediction(
     if method_params is None:
         method_params = args_inner.pred_params
 
+    if checkpoint is None:
+        checkpoint = CheckpointStore(args_inner.blast_in + '.r-' + args_inner.sha1[:10], sha1=args_inner.sha1)
+
     # ======= filter if needed =======
     # do the filtering based on e-val or bitscore
     # homologous hits still gets used for prediction
@@ -107,18 +125,18 @@ def wrapped_ending_with_prediction(
     delete_cm = False
     if used_cm_file is None and analyzed_hits.best_matching_model is not None:
         rfam = RfamInfo()
-        used_cm_file = run_cmfetch(rfam.file_path, analyzed_hits.best_matching_model['target_name'])
+        used_cm_file = cm_store.fetch_model(analyzed_hits.best_matching_model['target_name'], rfam=rfam)
         delete_cm = True
 
-    fd, seqs2predict_fasta = mkstemp(prefix='rba_', suffix='_83', dir=CONFIG.tmpdir)
-    with os.fdopen(fd, 'w') as fah:
-        for hit in analyzed_hits.hits:
-            if len(hit.extension.seq) == 0:
-                continue
-            fah.write('>{}\n{}\n'.format(
-                hit.extension.id,
-                str(hit.extension.seq))
-            )
+    # identical sequences are predicted only once, the structure is then copied to all hits with the sequence
+    # the predicted records are copies, so the messages from prediction are not mixed with the hit messages
+    unique_seqs, seq_positions = BA_support.dedup_seqs([hit.extension for hit in analyzed_hits.hits])
+    seqs2predict_list = []
+    for seq in unique_seqs:
+        rec = BA_support.snapshot_record(seq)
+        rec.annotations['msgs'] = []
+        seqs2predict_list.append(rec)
+    ml.info(BA_support.dedup_msg(len(seqs2predict_list), len(analyzed_hits.hits)))
 
     if not isinstance(method_params, dict):
         raise Exception('prediction method parameters must be python dict')
@@ -131,6 +149,7 @@ def wrapped_ending_with_prediction(
 
     prediction_msgs = []
     # compute prediction methods which were not computed
+    to_predict = []
     for pkey in set(pred_method):
         # add sha1 hashes
         nh = sha1()
@@ -149,70 +168,89 @@ def wrapped_ending_with_prediction(
                 print(msg_skip, flush=True)
             continue
 
-        msg_run = 'Running: {}...'.format(pkey)
-        ml.info(msg_run)
+        to_predict.append((pkey, current_hash))
 
-        if ml.level > 20:
-            print(msg_run, flush=True)
+    # independent methods run concurrently, the threads are divided between them
+    #  work done in the shared process pool is limited by its size
+    threads = args_inner.threads if args_inner.threads else os.cpu_count()
+    n_concurrent = max(1, min(len(to_predict), threads))
+    method_threads = max(1, threads // n_concurrent)
 
-        structures, etime, msgs = repredict_structures_for_homol_seqs(
-            query,
-            seqs2predict_fasta,
-            args_inner.threads,
-            prediction_method=pkey,
-            pred_method_params=method_params,
-            all_hits_list=all_hits_list,
-            seqs2predict_list=[i.extension for i in analyzed_hits.hits],
-            use_cm_file=used_cm_file,
-            )
-
-        exec_time[pkey] = etime
+    with shared_prerequisites(), ThreadPoolExecutor(max_workers=n_concurrent) as executor:
+        running = {}
+        for pkey, current_hash in to_predict:
+            msg_run = 'Running: {}...'.format(pkey)
+            ml.info(msg_run)
 
-        if structures is None:
-            msg = 'Structures not predicted with {} method'.format(pkey)
-            ml.info(msg)
             if ml.level > 20:
-                print('STATUS: ' + msg)
-
-        else:
-            for i, hit in enumerate(analyzed_hits.hits):
-                assert str(hit.extension.seq) == str(structures[i].seq)
-                hit.extension.annotations['sss'] += [pkey]
-
-                hit.extension.annotations['msgs'] += structures[i].annotations.get('msgs', [])
-
-                # expects "predicted" in annotations - for now, if not given, default is True, as not all prediction
-                #  methods implement "predicted" in their output
-                if structures[i].annotations.get('predicted', True):
-                    hit.extension.letter_annotations[pkey] = structures[i].letter_annotations['ss0']
-
-                if 'sha1' not in hit.extension.annotations:
-                    hit.extension.annotations['sha1'] = dict()
-                hit.extension.annotations['sha1'][pkey] = current_hash
-
-                try:
-                    del hit.extension.letter_annotations['ss0']
-                except KeyError:
-                    pass
-                try:
-                    hit.extension.annotations['sss'].remove('ss0')
-                except ValueError:
-                    pass
-
-            analyzed_hits.update_hit_stuctures()
+                print(msg_run, flush=True)
+
+            # the methods modify annotations of the input records
+            future = executor.submit(
+                predict_with_cache,
+                BA_support.snapshot_record(query),
+                [BA_support.snapshot_record(s) for s in seqs2predict_list],
+                method_threads,
+                prediction_method=pkey,
+                pred_method_params=method_params,
+                params_sha1=current_hash,
+                all_hits_list=[BA_support.snapshot_record(s) for s in all_hits_list],
+                use_cm_file=used_cm_file,
+            )
+            running[future] = (pkey, current_hash)
 
-        # check if msgs are not empty
-        if msgs:
-            prediction_msgs.append('{}: {}'.format(pkey, '\n'.join(msgs)))
+        # merge and save results in order of completion
+        for future in as_completed(running):
+            pkey, current_hash = running[future]
+            structures, etime, msgs = future.result()
+            exec_time[pkey] = etime
 
-        analyzed_hits.msgs = prediction_msgs
+            if structures is None:
+                msg = 'Structures not predicted with {} method'.format(pkey)
+                ml.info(msg)
+                if ml.level > 20:
+                    print('STATUS: ' + msg)
 
-        with open(args_inner.blast_in + '.r-' + args_inner.sha1[:10], 'r+') as f:
-            all_saved_data = json.load(f)
-            all_saved_data[iteration] = blastsearchrecompute2dict(analyzed_hits)
-            f.seek(0)
-            f.truncate()
-            json.dump(all_saved_data, f, indent=2)
+            else:
+                for hit, u in zip(analyzed_hits.hits, seq_positions):
+                    structure = structures[u]
+                    assert str(hit.extension.seq) == str(structure.seq)
+                    hit.extension.annotations['sss'] += [pkey]
+
+                    hit.extension.annotations['msgs'] += structure.annotations.get('msgs', [])
+
+                    # expects "predicted" in annotations - for now, if not given, default is True,
+                    #  as not all prediction methods implement "predicted" in their output
+                    if structure.annotations.get('predicted', True):
+                        hit.extension.letter_annotations[pkey] = structure.letter_annotations['ss0']
+
+                    if 'sha1' not in hit.extension.annotations:
+                        hit.extension.annotations['sha1'] = dict()
+                    hit.extension.annotations['sha1'][pkey] = current_hash
+
+                    try:
+                        del hit.extension.letter_annotations['ss0']
+                    except KeyError:
+                        pass
+                    try:
+                        hit.extension.annotations['sss'].remove('ss0')
+                    except ValueError:
+                        pass
+
+                analyzed_hits.update_hit_stuctures()
+
+            # check if msgs are not empty
+            if msgs:
+                prediction_msgs.append('{}: {}'.format(pkey, '\n'.join(msgs)))
+
+            analyzed_hits.msgs = prediction_msgs
+
+            if iteration in checkpoint:
+                checkpoint.save_prediction(
+                    iteration, prediction_delta(pkey, current_hash, analyzed_hits.hits, analyzed_hits.msgs)
+                )
+            else:
+                checkpoint.save_query(iteration, blastsearchrecompute2dict(analyzed_hits))
 
     # remove structures predicted by different methods (which might be saved from previous computation)
     for hit in analyzed_hits.hits:
@@ -224,10 +262,8 @@ def wrapped_ending_with_prediction(
                 except ValueError:
                     pass
 
-    BA_support.remove_one_file_with_try(seqs2predict_fasta)
-
     if delete_cm:
-        BA_support.remove_one_file_with_try(used_cm_file)
+        cm_store.release(used_cm_file)
 
     add_loc_to_description(analyzed_hits)
 
@@ -235,8 +271,11 @@ def wrapped_ending_with_prediction(
     if args_inner.html:
         html_file = iter2file_name(args_inner.html, multi_query, iteration)
         ml.info('Writing html to {}.'.format(html_file))
-        with open(html_file, 'wb') as h:
-            h.write(write_html_output(analyzed_hits))
+        if getattr(args_inner, 'html_report', 'single') == 'paged':
+            write_html_paged(analyzed_hits, html_file)
+        else:
+            with open(html_file, 'wb') as h:
+                h.write(write_html_output(analyzed_hits))
 
     # write csv file if requested
     if args_inner.csv:
@@ -244,6 +283,10 @@ def wrapped_ending_with_prediction(
         ml.info('Writing csv to {}.'.format(csv_file))
         analyzed_hits.to_csv(csv_file)
 
+    # all queries go to one file
+    if getattr(args_inner, 'table', None):
+        analyzed_hits.to_table(args_inner.table)
+
     # replace with json
     if args_inner.json:
         json_file = iter2file_name(args_inner.json, multi_query, iteration)
@@ -261,7 +304,7 @@ def wrapped_ending_with_prediction(
     if args_inner.pandas_dump:
         pickle_file = iter2file_name(args_inner.pandas_dump, multi_query, iteration)
         ml.info('Writing pandas pickle to {}.'.format(pickle_file))
-        pandas.to_pickle(analyzed_hits.pandas, pickle_file)
+        analyzed_hits.to_pandas_dump(pickle_file)
 
     if args_inner.dump:
         dump_file = iter2file_name(args_inner.dump, multi_query, iteration)
@@ -275,6 +318,70 @@ def wrapped_ending_with_prediction(
     return analyzed_hits
 
 
+def predict_with_cache(
+        query, seqs2predict_list, threads, prediction_method, pred_method_params, params_sha1, all_hits_list,
+        use_cm_file=None,
+):
+    """Predict structures with repredict_structures_for_homol_seqs for sequences without structure
+    in the persistent structure cache.
+
+    :return: (structures, exec_time, msgs) structures are in the order of seqs2predict_list
+    """
+    cache = open_cache('structures')
+    structures = [None] * len(seqs2predict_list)
+    keys = [None] * len(seqs2predict_list)
+    if cache is not None:
+        context = prediction_context(prediction_method, query, all_hits_list, use_cm_file)
+        for i, seq in enumerate(seqs2predict_list):
+            keys[i] = structure_key(seq, prediction_method, params_sha1, context)
+            cached = cache.get(keys[i])
+            if cached is not None:
+                structures[i] = record_from_cache(seq, cached)
+
+    missing = [i for i, s in enumerate(structures) if s is None]
+    ml.info('{}: {} of {} structures loaded from cache.'.format(
+        prediction_method, len(structures) - len(missing), len(structures))
+    )
+    if not missing:
+        return structures, 0.0, []
+
+    fd, seqs2predict_fasta = mkstemp(prefix='rba_', suffix='_83', dir=CONFIG.tmpdir)
+    with os.fdopen(fd, 'w') as fah:
+        for i in missing:
+            seq = seqs2predict_list[i]
+            if len(seq.seq) == 0:
+                continue
+            fah.write('>{}\n{}\n'.format(
+                seq.id,
+                str(seq.seq))
+            )
+
+    try:
+        predicted, exec_time, msgs = repredict_structures_for_homol_seqs(
+            query,
+            seqs2predict_fasta,
+            threads,
+            prediction_method=prediction_method,
+            pred_method_params=pred_method_params,
+            all_hits_list=all_hits_list,
+            seqs2predict_list=[seqs2predict_list[i] for i in missing],
+            use_cm_file=use_cm_file,
+        )
+    finally:
+        BA_support.remove_one_file_with_try(seqs2predict_fasta)
+
+    if predicted is None:
+        return None, exec_time, msgs
+
+    for i, structure in zip(missing, predicted):
+        structures[i] = structure
+        # failed predictions are not stored
+        if cache is not None and structure.annotations.get('predicted', True) and 'ss0' in structure.letter_annotations:
+            cache.put(keys[i], structure.letter_annotations['ss0'])
+
+    return structures, exec_time, msgs
+
+
 def create_nr_trusted_hits_file_MSA_safe(
         sim_threshold_percent=None,
         all_hits=None,
@@ -422,7 +529,55 @@ def _extract_cmscore_from_hom_seqs(hom_seqs):
     return [i.annotations['cmstat']['bit_sc'] for i in hom_seqs]
 
 
+@contextmanager
+def shared_prerequisites():
+    """Share the selection of trusted hits between prediction methods run in the context.
+    The context may be entered from several threads (queries computed concurrently), the shared selections
+     are dropped when the last one exits.
+    """
+    global _shared_selection, _shared_selection_users
+    with _shared_selection_lock:
+        if _shared_selection_users == 0:
+            _shared_selection = {}
+        _shared_selection_users += 1
+    try:
+        yield
+    finally:
+        with _shared_selection_lock:
+            _shared_selection_users -= 1
+            if _shared_selection_users == 0:
+                _shared_selection = None
+
+
 def _trusted_hits_selection_wrapper(all_hits_, query_, cmscore_tr_, cm_threshold_percent_, len_diff_=0.1):
+    """
+    trusted hits selection computed only once for same input in the shared_prerequisites context
+     the first caller computes it, concurrent callers wait for the result
+    """
+    if _shared_selection is None:
+        return _trusted_hits_selection(all_hits_, query_, cmscore_tr_, cm_threshold_percent_, len_diff_=len_diff_)
+
+    key = (tuple(h.id for h in all_hits_), query_.id, cmscore_tr_, cm_threshold_percent_, len_diff_)
+    with _shared_selection_lock:
+        owner = key not in _shared_selection
+        if owner:
+            _shared_selection[key] = Future()
+        future = _shared_selection[key]
+
+    if owner:
+        try:
+            future.set_result(
+                _trusted_hits_selection(all_hits_, query_, cmscore_tr_, cm_threshold_percent_, len_diff_=len_diff_)
+            )
+        except Exception as e:
+            future.set_exception(e)
+
+    # callers modify the output
+    dist_table, homologous_seqs, msgs = future.result()
+    return dist_table.copy(), deepcopy(homologous_seqs), list(msgs)
+
+
+def _trusted_hits_selection(all_hits_, query_, cmscore_tr_, cm_threshold_percent_, len_diff_=0.1):
     """
     runs basic non_redundant sequences calculation (ie exact sequence match)
     selects homologous sequences from all hits list by cmscore threshold or by query sequence
@@ -588,7 +743,7 @@ def repredict_structures_for_homol_seqs(
                 if '-N' not in cep:
                     cep += ' -N {}'.format(method_parameters.get('n_seqs', 10))
 
-                hf_file = run_cmemit(use_cm_file, params=cep)
+                hf_file = cm_store.emit_samples(use_cm_file, params=cep)
 
                 structures, exec_time = me_centroid_homfold(seqs2predict_fasta, hf_file, params=method_parameters)
 
@@ -601,7 +756,7 @@ def repredict_structures_for_homol_seqs(
                 ml.warning(msg)
                 return None, None, [msg]
             else:
-                ref_structure = extract_ref_from_cm(use_cm_file)
+                ref_structure = cm_store.ref_structure(use_cm_file)
 
                 structures, exec_time = rfam_subopt_pred(
                     seqs2predict_fasta,
@@ -614,7 +769,8 @@ def repredict_structures_for_homol_seqs(
         elif 'rnafold' == prediction_method:
             structures, exec_time = rnafold_wrap_for_predict(
                 seqs2predict_fasta,
-                params=pred_method_params.get(prediction_method, {}).get('RNAfold', '')
+                params=pred_method_params.get(prediction_method, {}).get('RNAfold', ''),
+                threads=threads or 1
             )
             return structures, exec_time, []
 
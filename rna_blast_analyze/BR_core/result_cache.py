@@ -0,0 +1,223 @@
+import os
+import time
+import zlib
+import sqlite3
+import threading
+import logging
+from functools import wraps
+from hashlib import sha1
+from multiprocessing.util import Finalize
+
+from rna_blast_analyze.BR_core.config import CONFIG
+
+ml = logging.getLogger('rboAnalyzer')
+
+# 1 GB
+DEFAULT_CACHE_SIZE = 10**9
+
+# opened caches {(name, pid, cache_dir): ResultCache}
+_OPENED = {}
+
+
+def cache_key(*parts):
+    """Compute cache key from the parts which determine the cached result."""
+    h = sha1()
+    for p in parts:
+        h.update(str(p).encode())
+        h.update(b'\x00')
+    return h.hexdigest()
+
+
+def _locked(method):
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class ResultCache(object):
+    """Persistent cache of tool outputs stored in sqlite file.
+
+    Values are compressed text. When the size of stored values exceeds max_size, the least recently used
+     entries are removed. The size of stored values is kept in the counters table together with the numbers
+     of hits and misses, so the hit rate can be computed also for lookups done in worker processes.
+    Lookups only read the file. Hits, misses and access times are collected in memory and written in one
+     transaction with the next put, when ACCESS_BATCH lookups are pending, at close and at the exit of the process.
+    """
+    ACCESS_BATCH = 1000
+
+    def __init__(self, dbfile, max_size=DEFAULT_CACHE_SIZE):
+        self.dbfile = dbfile
+        self.max_size = max_size
+        # the connection is shared by threads of the process, the lock serializes its use
+        self.con = sqlite3.connect(dbfile, timeout=60, check_same_thread=False)
+        self.lock = threading.RLock()
+        self._counts = {'hits': 0, 'misses': 0}
+        self._atimes = {}
+        with self.con:
+            self.con.execute(
+                "CREATE TABLE IF NOT EXISTS entries("
+                "key TEXT PRIMARY KEY NOT NULL, value BLOB, size INTEGER, atime REAL);"
+            )
+            self.con.execute("CREATE INDEX IF NOT EXISTS entries_atime ON entries(atime);")
+            self.con.execute("CREATE TABLE IF NOT EXISTS counters(name TEXT PRIMARY KEY NOT NULL, value INTEGER);")
+            self.con.execute("INSERT OR IGNORE INTO counters VALUES('hits', 0), ('misses', 0);")
+            # caches created before the size was kept in counters
+            self.con.execute(
+                "INSERT OR IGNORE INTO counters SELECT 'size', COALESCE(SUM(size), 0) FROM entries;"
+            )
+        # pending lookups are written also when worker process exits
+        Finalize(self, self.close, exitpriority=10)
+
+    @_locked
+    def get(self, key):
+        """Return cached text for key or None.
+        Failure of the cache (e.g. locked by other process for too long) is reported as a miss.
+        """
+        try:
+            row = self.con.execute("SELECT value FROM entries WHERE key = ?;", (key,)).fetchone()
+        except sqlite3.OperationalError as e:
+            ml.debug('Cache lookup failed: {}'.format(str(e)))
+            row = None
+
+        if row is None:
+            self._counts['misses'] += 1
+        else:
+            self._counts['hits'] += 1
+            self._atimes[key] = time.time()
+
+        if self._counts['hits'] + self._counts['misses'] >= self.ACCESS_BATCH:
+            self.flush()
+
+        if row is None:
+            return None
+        return zlib.decompress(row[0]).decode()
+
+    def _write_access(self):
+        """Write pending lookups, must be called inside transaction."""
+        self.con.executemany(
+            "UPDATE counters SET value = value + ? WHERE name = ?;", [(v, k) for k, v in self._counts.items()]
+        )
+        self.con.executemany("UPDATE entries SET atime = ? WHERE key = ?;", [(t, k) for k, t in self._atimes.items()])
+        self._counts = {'hits': 0, 'misses': 0}
+        self._atimes = {}
+
+    @_locked
+    def flush(self):
+        """Write hits, misses and access times collected in memory."""
+        if self.con is None or not (self._atimes or any(self._counts.values())):
+            return
+        try:
+            with self.con:
+                self._write_access()
+        except sqlite3.OperationalError as e:
+            ml.debug('Cache write failed: {}'.format(str(e)))
+
+    @_locked
+    def put(self, key, value):
+        data = zlib.compress(value.encode())
+        try:
+            with self.con:
+                # the size of replaced entry must not be changed by other process before it is replaced
+                self.con.execute("BEGIN IMMEDIATE;")
+                old = self.con.execute("SELECT size FROM entries WHERE key = ?;", (key,)).fetchone()
+                self.con.execute(
+                    "INSERT OR REPLACE INTO entries VALUES(?, ?, ?, ?);", (key, data, len(data), time.time())
+                )
+                self.con.execute(
+                    "UPDATE counters SET value = value + ? WHERE name = 'size';",
+                    (len(data) - (old[0] if old is not None else 0),)
+                )
+                self._write_access()
+            if self.size() > self.max_size:
+                self.prune(self.max_size * 0.9)
+        except sqlite3.OperationalError as e:
+            ml.debug('Cache write failed: {}'.format(str(e)))
+
+    @_locked
+    def size(self):
+        return self.con.execute("SELECT value FROM counters WHERE name = 'size';").fetchone()[0]
+
+    @_locked
+    def __len__(self):
+        return self.con.execute("SELECT COUNT(*) FROM entries;").fetchone()[0]
+
+    @_locked
+    def prune(self, max_size):
+        """Remove least recently used entries until the size of stored values is below max_size.
+        :return: number of removed entries
+        """
+        self.flush()
+        removed = 0
+        with self.con:
+            self.con.execute("BEGIN IMMEDIATE;")
+            total = self.size()
+            for key, size in self.con.execute("SELECT key, size FROM entries ORDER BY atime;").fetchall():
+                if total <= max_size:
+                    break
+                self.con.execute("DELETE FROM entries WHERE key = ?;", (key,))
+                total -= size
+                removed += 1
+            self.con.execute("UPDATE counters SET value = ? WHERE name = 'size';", (total,))
+        return removed
+
+    @_locked
+    def clear(self):
+        self._counts = {'hits': 0, 'misses': 0}
+        self._atimes = {}
+        with self.con:
+            self.con.execute("DELETE FROM entries;")
+            self.con.execute("UPDATE counters SET value = 0;")
+
+    @_locked
+    def vacuum(self):
+        """Return the space of removed entries to the filesystem."""
+        self.con.execute("VACUUM;")
+
+    @_locked
+    def stats(self):
+        """Return {hits, misses, entries, size}. Lookups of this process not written yet are included."""
+        out = dict(self.con.execute("SELECT name, value FROM counters;").fetchall())
+        for k, v in self._counts.items():
+            out[k] += v
+        out['entries'] = len(self)
+        return out
+
+    @_locked
+    def close(self):
+        if self.con is None:
+            return
+        self.flush()
+        self.con.close()
+        self.con = None
+
+
+def open_cache(name, max_size=DEFAULT_CACHE_SIZE):
+    """Return cache [name].sqlite in the cache_dir from the configuration opened for current process.
+    None is returned if the cache is disabled (empty cache_dir) or it can't be opened.
+    """
+    if not CONFIG.cache_dir:
+        return None
+
+    # sqlite connection must not be shared with forked processes
+    pkey = (name, os.getpid(), CONFIG.cache_dir)
+    if pkey not in _OPENED:
+        try:
+            os.makedirs(CONFIG.cache_dir, exist_ok=True)
+            _OPENED[pkey] = ResultCache(os.path.join(CONFIG.cache_dir, name + '.sqlite'), max_size=max_size)
+        except (OSError, sqlite3.Error) as e:
+            ml.info('Cache {} is not available: {}'.format(name, str(e)))
+            _OPENED[pkey] = None
+    return _OPENED[pkey]
+
+
+def hit_rate_msg(name, before, after):
+    """Format hits and misses between two stats() calls."""
+    hits = after['hits'] - before['hits']
+    misses = after['misses'] - before['misses']
+    total = hits + misses
+    rate = 100 * hits / total if total else 0
+    return '{} cache: {} hits, {} misses ({:.1f}% hit rate), {} entries, {:.1f} MB.'.format(
+        name, hits, misses, rate, after['entries'], after['size'] / 10**6
+    )
@@ -0,0 +1,99 @@
+import os
+import logging
+import shutil
+from hashlib import sha1
+
+from Bio.SeqRecord import SeqRecord
+
+from rna_blast_analyze.BR_core.config import CONFIG
+from rna_blast_analyze.BR_core.fold_backend import backend_version
+from rna_blast_analyze.BR_core.result_cache import cache_key
+
+ml = logging.getLogger('rboAnalyzer')
+
+# Inputs other than the sequence and the parameters on which the predicted structure depends.
+#  Methods not listed here use homologous sequences selected from all hits, so all inputs are used.
+method_context = {
+    'rnafold': (),
+    'rfam-Rc': ('cm',),
+    'rfam-sub': ('cm',),
+    'fq-sub': ('query',),
+}
+full_context = ('query', 'cm', 'hits')
+
+# executables used by prediction methods (directly or in helper functions)
+_prediction_tools = [
+    ('viennarna_bin', 'RNAfold'),
+    ('viennarna_bin', 'RNAalifold'),
+    ('viennarna_bin', 'RNAdistance'),
+    ('refold', 'refold.pl'),
+    ('mfold', 'hybrid-ss-min'),
+    ('centroid', 'centroid_homfold'),
+    ('turbofold', 'TurboFold'),
+    ('infernal', 'cmalign'),
+    ('infernal', 'cmemit'),
+    ('clustal', 'clustalo'),
+    ('muscle', 'muscle'),
+]
+
+_fingerprint = {}
+
+
+def tools_fingerprint():
+    """Identify installed prediction tools by path, size and modification time of the executables.
+    Upgrade of any tool (or of RNAlib used for folding) invalidates the cached structures.
+    """
+    key = tuple(sorted(CONFIG.tool_paths.items()))
+    if key not in _fingerprint:
+        h = sha1()
+        h.update(backend_version().encode())
+        for tool_key, program in _prediction_tools:
+            path = shutil.which(CONFIG.tool_paths[tool_key] + program)
+            if path is None:
+                h.update('{}:missing;'.format(program).encode())
+            else:
+                st = os.stat(path)
+                h.update('{}:{}:{}:{};'.format(program, os.path.realpath(path), st.st_size, st.st_mtime).encode())
+        _fingerprint[key] = h.hexdigest()
+    return _fingerprint[key]
+
+
+def _file_hash(file):
+    h = sha1()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def prediction_context(method, query, all_hits_list, cm_file):
+    """Hash of inputs (other than the predicted sequence and the parameters) used by the prediction method."""
+    parts = [tools_fingerprint()]
+    used = method_context.get(method, full_context)
+    if 'query' in used:
+        parts.append(str(query.seq))
+    if 'cm' in used:
+        parts.append(_file_hash(cm_file) if cm_file else None)
+    if 'hits' in used:
+        parts.extend(
+            sorted(
+                str(h.seq) + str(h.annotations.get('cmstat', '')) for h in all_hits_list
+            )
+        )
+    return cache_key(*parts)
+
+
+def structure_key(seq, method, params_sha1, context):
+    return cache_key(str(seq.seq), method, params_sha1, context)
+
+
+def record_from_cache(seq, structure):
+    """Build record with the cached structure in the same form as returned by the prediction methods."""
+    return SeqRecord(
+        seq.seq,
+        id=seq.id,
+        name=seq.name,
+        description=seq.description,
+        annotations={'msgs': [], 'predicted': True},
+        letter_annotations={'ss0': structure},
+    )
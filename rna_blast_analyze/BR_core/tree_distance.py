@@ -0,0 +1,235 @@
+"""Secondary structure distances computed in-process without RNAlib or RNAdistance.
+
+The tree edit distance is computed on the full tree representation of the dot-bracket structure
+ (RNAdistance -Df, the default of RNAdistance and of RNA.tree_edit_distance) with the same edit costs:
+ insert/delete of unpaired base costs 1, of base pair 2 and relabeling between them 1.
+Used only when neither RNAlib nor the RNAdistance executable is available, both compute the same distances
+ (see test_tree_distance) about ten times faster (benchmarks/bench_distance.py).
+"""
+from rna_blast_analyze.BR_core.exceptions import ParsingError
+
+# node labels of the full tree
+_ROOT = 0
+_UNPAIRED = 1
+_PAIRED = 2
+
+# cost of deleting (inserting) node with given label
+_INDEL = (0, 1, 2)
+
+# relabel cost [a][b], root can be matched only with root
+_RELABEL = (
+    (0, 10**9, 10**9),
+    (10**9, 0, 1),
+    (10**9, 1, 0),
+)
+
+# maximal number of memorized subtree distance blocks of one reference
+MEMO_SIZE = 10**6
+
+
+class FullTree(object):
+    """Full tree of the dot-bracket structure stored in postorder as needed by the Zhang-Shasha algorithm.
+
+    labels - label of each node
+    lml - index of the leftmost leaf descendant of each node
+    keyroots - highest node for each leftmost leaf, in postorder
+    leftpath - {keyroot: nodes on the path from its leftmost leaf up to the keyroot}
+    substructure - {keyroot: dot-bracket of the subtree}, identical subtrees have identical distances
+    """
+    __slots__ = ('structure', 'labels', 'lml', 'keyroots', 'leftpath', 'substructure')
+
+    def __init__(self, structure):
+        self.structure = structure
+        labels = []
+        lml = []
+        # first and last position of each node's subtree in the structure
+        start = []
+        end = []
+        # open pairs [position of '(', leftmost leaf or None]
+        stack = []
+        for pos, c in enumerate(structure):
+            if c == '(':
+                stack.append([pos, None])
+                continue
+
+            idx = len(labels)
+            if c == ')':
+                if not stack:
+                    raise ParsingError('Unbalanced structure: {}'.format(structure))
+                open_pos, left = stack.pop()
+                labels.append(_PAIRED)
+                lml.append(idx if left is None else left)
+                start.append(open_pos)
+            else:
+                labels.append(_UNPAIRED)
+                lml.append(idx)
+                start.append(pos)
+            end.append(pos)
+            if stack and stack[-1][1] is None:
+                stack[-1][1] = lml[idx]
+        if stack:
+            raise ParsingError('Unbalanced structure: {}'.format(structure))
+
+        root = len(labels)
+        labels.append(_ROOT)
+        lml.append(0)
+
+        kr = {}
+        for i, l in enumerate(lml):
+            kr[l] = i
+        self.labels = labels
+        self.lml = lml
+        self.keyroots = sorted(kr.values())
+        self.leftpath = {k: [x for x in range(lml[k], k + 1) if lml[x] == lml[k]] for k in self.keyroots}
+        self.substructure = {
+            k: structure[start[k]:end[k] + 1] if k != root else '#' + structure for k in self.keyroots
+        }
+
+    def __len__(self):
+        return len(self.labels)
+
+
+def tree_edit_distance(t1, t2, memo=None):
+    """Zhang-Shasha tree edit distance of two FullTree objects.
+
+    Distances computed for each pair of keyroot subtrees are stored in memo ({(substructure1, substructure2): block})
+     and reused for any other tree containing the same subtree.
+    """
+    l1 = t1.lml
+    l2 = t2.lml
+    lab1 = t1.labels
+    lab2 = t2.labels
+    indel2 = [_INDEL[x] for x in lab2]
+    if memo is None:
+        memo = {}
+
+    td = [[0] * len(lab2) for _ in range(len(lab1))]
+
+    for i in t1.keyroots:
+        li = l1[i]
+        lp1 = t1.leftpath[i]
+        s1 = t1.substructure[i]
+        for j in t2.keyroots:
+            lp2 = t2.leftpath[j]
+            key = (s1, t2.substructure[j])
+            block = memo.get(key)
+            if block is not None:
+                for x, bx in zip(lp1, block):
+                    tdx = td[x]
+                    for y, v in zip(lp2, bx):
+                        tdx[y] = v
+                continue
+
+            lj = l2[j]
+            # per block constants, index k of row corresponds to node lj + k - 1
+            ins = indel2[lj:j + 1]
+            offs = [l - lj for l in l2[lj:j + 1]]
+            on_path = [o == 0 for o in offs]
+            labs = lab2[lj:j + 1]
+
+            # forest distances, row 0 and column 0 represent the empty forest
+            r = 0
+            row = [0]
+            for c in ins:
+                r += c
+                row.append(r)
+            fd = [row]
+            for x in range(li, i + 1):
+                a = lab1[x]
+                da = _INDEL[a]
+                prev = row
+                tdx = td[x]
+                tds = tdx[lj:j + 1]
+                if l1[x] == li:
+                    # x on the left path, distances of trees rooted in x and on the left path of j are computed here
+                    rel = _RELABEL[a]
+                    fd0 = fd[0]
+                    third = [
+                        pk + rel[b] if lp else fd0[o] + t
+                        for pk, b, lp, o, t in zip(prev, labs, on_path, offs, tds)
+                    ]
+                else:
+                    fdx = fd[l1[x] - li]
+                    third = [fdx[o] + t for o, t in zip(offs, tds)]
+
+                r = prev[0] + da
+                row = [r]
+                for p, c, v in zip(prev[1:], ins, third):
+                    p += da
+                    if p < v:
+                        v = p
+                    r += c
+                    if v < r:
+                        r = v
+                    row.append(r)
+                if l1[x] == li:
+                    for k, lp in enumerate(on_path):
+                        if lp:
+                            tdx[lj + k] = row[k + 1]
+                fd.append(row)
+
+            if len(memo) < MEMO_SIZE:
+                memo[key] = [[td[x][y] for y in lp2] for x in lp1]
+    return td[-1][-1]
+
+
+def base_pairs(structure):
+    """Return set of (i, j) base pairs of the dot-bracket structure."""
+    pairs = set()
+    stack = []
+    for i, c in enumerate(structure):
+        if c == '(':
+            stack.append(i)
+        elif c == ')':
+            if not stack:
+                raise ParsingError('Unbalanced structure: {}'.format(structure))
+            pairs.add((stack.pop(), i))
+    if stack:
+        raise ParsingError('Unbalanced structure: {}'.format(structure))
+    return pairs
+
+
+def bp_distance(structure1, structure2):
+    """Number of base pairs present in only one of the structures (RNAdistance -DP)."""
+    return len(base_pairs(structure1) ^ base_pairs(structure2))
+
+
+class DistanceEngine(object):
+    """Distances of many structures to one reference structure.
+
+    The reference is parsed once. Identical candidates are computed once and the distances of identical subtrees
+     are shared between all candidates (suboptimal structures of one sequence usually differ only locally).
+    """
+    def __init__(self, reference):
+        self.reference = reference
+        self.tree = FullTree(reference)
+        self._pairs = None
+        self._memo = {}
+        self._done = {}
+
+    def tree_edit_distances(self, structures):
+        out = []
+        for s in structures:
+            if s not in self._done:
+                self._done[s] = tree_edit_distance(self.tree, FullTree(s), memo=self._memo)
+            out.append(self._done[s])
+        return out
+
+    def bp_distances(self, structures):
+        if self._pairs is None:
+            self._pairs = base_pairs(self.reference)
+        return [len(self._pairs ^ base_pairs(s)) for s in structures]
+
+
+def group_by_reference(pairs):
+    """Group (reference, structure) pairs by the reference.
+    :return: list of (reference, [structures], [indexes of the pairs])
+    """
+    groups = {}
+    for i, (reference, structure) in enumerate(pairs):
+        if reference not in groups:
+            groups[reference] = ([], [])
+        groups[reference][0].append(structure)
+        groups[reference][1].append(i)
+    return [(ref, structures, idx) for ref, (structures, idx) in groups.items()]
+
@@ -1,10 +1,10 @@
 import logging
-import multiprocessing
 import os
 from shutil import rmtree
 from subprocess import call
 from tempfile import mkdtemp, TemporaryFile
 from itertools import chain
+from functools import partial
 
 from Bio.SeqRecord import SeqRecord
 
@@ -13,6 +13,7 @@ from rna_blast_analyze.BR_core import BA_support
 from rna_blast_analyze.BR_core.config import CONFIG
 from rna_blast_analyze.BR_core.decorators import timeit_decorator
 from rna_blast_analyze.BR_core.fname import fname
+from rna_blast_analyze.BR_core.parallel import pool_for
 
 ml = logging.getLogger('rboAnalyzer')
 
@@ -87,9 +88,8 @@ def turbofold_ext_nr_fast(all_seqs, nrset, cpu, n, turbofold_params, pkey='Turbo
         for oneseqset, tpar, _ in list2predict:
             pred_list.append(run_turbofold(oneseqset, tpar, timeout=timeout))
     else:
-        pool = multiprocessing.Pool(processes=cpu)
-        pred_list = pool.map(_rt_wrapper, list2predict)
-        pool.close()
+        with pool_for(cpu) as pool:
+            pred_list = pool.map(partial(_rt_wrapper, timeout=timeout), list2predict, desc='TurboFold')
 
     # rebuild predicted TurboFold structures
     # - take care that prediction might be empty if TurboFold fails
@@ -128,8 +128,8 @@ def _prepare_set_n(seq, nr_seqs, n):
     return BA_support.non_redundant_seqs([seq] + nr_seqs)
 
 
-def _rt_wrapper(pack):
-    return run_turbofold(pack[0], pack[1])
+def _rt_wrapper(pack, timeout=None):
+    return run_turbofold(pack[0], pack[1], timeout=timeout)
 
 
 def write_turbofold_confile(input_sequences, turbofold_params=None, cpus=None, outdir=None):
@@ -239,7 +239,7 @@ def _turbofold_worker(sequences, params, timeout=None):
 
 
 @timeit_decorator
-def turbofold_with_homologous(all_sequences, nr_homologous, params, n, cpu, pkey='TurboFold', sha1val=''):
+def turbofold_with_homologous(all_sequences, nr_homologous, params, n, cpu, pkey='TurboFold', sha1val='', timeout=None):
     """
     Trubofold mode is MEA by default
     :param all_sequences:
@@ -280,11 +280,10 @@ def turbofold_with_homologous(all_sequences, nr_homologous, params, n, cpu, pkey
     if cpu == 1:
         pred_list = []
         for oneseqset, tpar, _ in list2predict:
-            pred_list.append(run_turbofold(oneseqset, tpar))
+            pred_list.append(run_turbofold(oneseqset, tpar, timeout=timeout))
     else:
-        pool = multiprocessing.Pool(processes=cpu)
-        pred_list = pool.map(_rt_wrapper, list2predict)
-        pool.close()
+        with pool_for(cpu) as pool:
+            pred_list = pool.map(partial(_rt_wrapper, timeout=timeout), list2predict, desc='TurboFold')
 
     out_list = []
     for out, l_in in zip(pred_list, list2predict):
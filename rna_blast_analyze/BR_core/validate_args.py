@@ -6,6 +6,7 @@ import rna_blast_analyze.BR_core.tools_versions as tools
 from rna_blast_analyze.BR_core.filter_blast import OPERATIONS
 from Bio import SeqIO
 from rna_blast_analyze.BR_core.BA_support import IUPACmapping
+from rna_blast_analyze.BR_core.output.table_output import TABLE_FORMATS, table_format, pyarrow
 from hashlib import sha1
 
 ml = logging.getLogger('rboAnalyzer')
@@ -102,7 +103,7 @@ def validate_args(args):
             ml.error("parameter '{}' should be 'bool' not {}".format(arg, type(args.get(arg))))
             return False
 
-    if not any([args.json, args.html, args.csv, args.pandas_dump, args.dump]):
+    if not any([args.json, args.html, args.csv, args.table, args.pandas_dump, args.dump]):
         ml.error(
             "It appears that no output file was requested."
             " Please provide --html and/or --json and/or --csv argument(s)."
@@ -148,6 +149,20 @@ def validate_args(args):
         ml.error("Refusing to overwrite 'csv' {}.".format(args.csv))
         return False
 
+    if precheck_file_exist(args.table) and not args.enable_overwrite:
+        ml.error("Refusing to overwrite 'table' {}.".format(args.table))
+        return False
+
+    if args.table is not None:
+        if table_format(args.table) is None:
+            ml.error("Unknown format of 'table' {}, use one of the extensions: {}.".format(
+                args.table, ', '.join(sorted(TABLE_FORMATS))
+            ))
+            return False
+        if pyarrow is None:
+            ml.error("The 'table' output requires pyarrow python package, which is not installed.")
+            return False
+
     if precheck_file_exist(args.json) and not args.enable_overwrite:
         ml.error("Refusing to overwrite 'json' {}.".format(args.json))
         return False
@@ -5,12 +5,12 @@ import shutil
 import subprocess
 from subprocess import call, check_output
 from tempfile import TemporaryFile, gettempdir
-from multiprocessing import Pool
 
 from rna_blast_analyze.BR_core import exceptions
 from rna_blast_analyze.BR_core.config import CONFIG
 from rna_blast_analyze.BR_core.fname import fname
-from rna_blast_analyze.BR_core.BA_support import generate_random_name
+from rna_blast_analyze.BR_core.BA_support import generate_random_name, remove_one_file_with_try
+from rna_blast_analyze.BR_core.parallel import pool_for
 
 ml = logging.getLogger('rboAnalyzer')
 
@@ -65,9 +65,8 @@ def run_rnaplot(seq, structure=None, format='svg', outfile=None, timeout=None):
     if format not in allowed_formats:
         raise TypeError('Format can be only from {}.'.format(allowed_formats))
 
-    currdirr = os.getcwd()
+    # RNAplot writes the output to working directory
     tmpdir = gettempdir()
-    os.chdir(tmpdir)
 
     cmd = ['{}RNAplot'.format(CONFIG.viennarna_path), '--output-format={}'.format(format)]
     ml.debug(cmd)
@@ -75,7 +74,7 @@ def run_rnaplot(seq, structure=None, format='svg', outfile=None, timeout=None):
     rnaname = generate_random_name(10)
 
     with TemporaryFile(mode='w+', encoding='utf-8') as tmp:
-        with subprocess.Popen(cmd, universal_newlines=True, stdin=subprocess.PIPE, stdout=tmp, stderr=tmp) as p:
+        with subprocess.Popen(cmd, universal_newlines=True, stdin=subprocess.PIPE, stdout=tmp, stderr=tmp, cwd=tmpdir) as p:
             try:
                 p.communicate(input='>{}\n{}\n{}\n'.format(
                     rnaname,
@@ -90,14 +89,12 @@ def run_rnaplot(seq, structure=None, format='svg', outfile=None, timeout=None):
             if p.returncode:
                 msgfail = 'Call to RNAplot failed.'
                 ml.error(msgfail)
-                os.chdir(currdirr)
                 tmp.seek(0)
                 details = tmp.read()
                 ml.debug(details)
                 raise exceptions.RNAplotException(msgfail, details)
 
         plot_output_file = os.path.join(tmpdir, rnaname + '_ss.' + format)
-        os.chdir(currdirr)
         if outfile is None:
             return plot_output_file
         else:
@@ -105,6 +102,16 @@ def run_rnaplot(seq, structure=None, format='svg', outfile=None, timeout=None):
             return outfile
 
 
+def rnaplot_svg(sequence, structure, timeout=None):
+    """Return SVG picture of the structure drawn by RNAplot as text."""
+    picfile = run_rnaplot(seq=sequence, structure=structure, format='svg', timeout=timeout)
+    try:
+        with open(picfile, 'r') as f:
+            return f.read()
+    finally:
+        remove_one_file_with_try(picfile)
+
+
 def RNAfold(sequence, timeout=None):
     ml.debug(fname())
     with TemporaryFile(mode='w+', encoding='utf-8') as tmp:
@@ -139,5 +146,5 @@ def wrap_RNAfold(sequences, threads=1):
     if threads == 1:
         return [RNAfold(seq) for seq in sequences]
     else:
-        with Pool(processes=threads) as pool:
-            return pool.map(RNAfold, sequences)
+        with pool_for(threads) as pool:
+            return pool.map(RNAfold, sequences, desc='RNAfold')
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# PYTHON_ARGCOMPLETE_OK
+import argparse
+import glob
+import os
+import sys
+
+from rna_blast_analyze.BR_core.config import CONFIG, tools_paths
+from rna_blast_analyze.BR_core.result_cache import ResultCache
+from rna_blast_analyze.BR_core import cm_store
+
+# the models extracted from RFAM are stored in the directory of the same name as the cache of their hashes
+MODEL_STORE = 'cm_models'
+
+
+def parser():
+    p = argparse.ArgumentParser(
+        description=(
+            'Inspect and prune the persistent caches of rboAnalyzer (LocARNA alignments, predicted structures,'
+            ' covariance models).'
+            ' The caches are stored in the "cache_dir" directory from the configuration file'
+            ' (default $XDG_CACHE_HOME/rboAnalyzer).'
+        ),
+        usage='rboAnalyzer_cache [--config_file FILE] [--cache_dir PATH] {info,prune,clear} ...'
+    )
+    p.add_argument(
+        '--config_file',
+        type=str,
+        default=None,
+        help='Provide config file if tools are in non-standard locations.'
+    )
+    p.add_argument(
+        '--cache_dir',
+        type=str,
+        default=None,
+        help='Directory with the caches. Overrides "cache_dir" from the config file.'
+    )
+    sub = p.add_subparsers(dest='command')
+    sub.required = True
+
+    sub.add_parser('info', help='Print number of entries, size and hit rate of each cache.')
+
+    pp = sub.add_parser('prune', help='Remove least recently used entries.')
+    pp.add_argument(
+        '--max_size',
+        type=float,
+        required=True,
+        help='Maximal size of each cache in MB.'
+    )
+    pp.add_argument(
+        '--cache',
+        type=str,
+        default=None,
+        help='Name of the cache to prune (default all).'
+    )
+
+    pc = sub.add_parser('clear', help='Remove all entries.')
+    pc.add_argument(
+        '--cache',
+        type=str,
+        default=None,
+        help='Name of the cache to clear (default all).'
+    )
+    return p.parse_args()
+
+
+def find_caches(cache_dir, name=None):
+    """Return {name: path} of caches in cache_dir."""
+    out = {}
+    for file in sorted(glob.glob(os.path.join(cache_dir, '*.sqlite'))):
+        cname = os.path.basename(file)[:-len('.sqlite')]
+        if name is None or cname == name:
+            out[cname] = file
+    return out
+
+
+def find_model_store(cache_dir, name=None):
+    """Return the directory with the covariance models (filled by cm_store.fetch_model) or None."""
+    store_dir = os.path.join(cache_dir, MODEL_STORE)
+    if (name is None or name == MODEL_STORE) and os.path.isdir(store_dir):
+        return store_dir
+    return None
+
+
+def main():
+    args = parser()
+    if args.config_file:
+        CONFIG.override(tools_paths(config_file=args.config_file))
+    if args.cache_dir is not None:
+        CONFIG.data_paths['cache_dir'] = args.cache_dir
+
+    if not CONFIG.cache_dir:
+        print('Caching is disabled (empty cache_dir in the configuration).')
+        sys.exit(0)
+
+    caches = find_caches(CONFIG.cache_dir, getattr(args, 'cache', None))
+    store_dir = find_model_store(CONFIG.cache_dir, getattr(args, 'cache', None))
+    if not caches and store_dir is None:
+        print('No cache found in {}.'.format(CONFIG.cache_dir))
+        sys.exit(0)
+
+    for name, file in caches.items():
+        cache = ResultCache(file)
+        if args.command == 'prune':
+            removed = cache.prune(args.max_size * 10**6)
+            cache.vacuum()
+            print('{}: removed {} entries.'.format(name, removed))
+        elif args.command == 'clear':
+            cache.clear()
+            cache.vacuum()
+            print('{}: cleared.'.format(name))
+
+        stats = cache.stats()
+        lookups = stats['hits'] + stats['misses']
+        print('{}: {} entries, {:.1f} MB, {} hits / {} lookups ({:.1f}%), file: {}'.format(
+            name,
+            stats['entries'],
+            stats['size'] / 10**6,
+            stats['hits'],
+            lookups,
+            100 * stats['hits'] / lookups if lookups else 0,
+            file,
+        ))
+        cache.close()
+
+    if store_dir is not None:
+        if args.command == 'prune':
+            removed = cm_store.prune(store_dir, args.max_size * 10**6)
+            print('{} store: removed {} models.'.format(MODEL_STORE, removed))
+        elif args.command == 'clear':
+            # models used by running analyses are kept
+            removed = cm_store.prune(store_dir, 0)
+            print('{} store: removed {} models.'.format(MODEL_STORE, removed))
+
+        stats = cm_store.store_stats(store_dir)
+        print('{} store: {} models, {:.1f} MB, directory: {}'.format(
+            MODEL_STORE,
+            stats['models'],
+            stats['size'] / 10**6,
+            store_dir,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -23,7 +23,8 @@ setup(
     entry_points={
         'console_scripts': [
             'rboAnalyzer = rna_blast_analyze.BA:main',
-            'genomes_from_blast = rna_blast_analyze.download_blast_genomes:main'
+            'genomes_from_blast = rna_blast_analyze.download_blast_genomes:main',
+            'rboAnalyzer_cache = rna_blast_analyze.manage_cache:main',
         ],
     },
     install_requires=[
@@ -26,9 +26,13 @@ class Pseudoargs(Namespace):
             cm_file=None,
             use_rfam=False,
             config_file=None,
+            cache_dir=None,
             html=None,
+            html_pictures='rnaplot',
+            html_report='single',
             json=None,
             csv=None,
+            table=None,
             download_rfam=False,
             show_gene_browser=False,
             zip_json=False,
@@ -60,9 +64,13 @@ class Pseudoargs(Namespace):
         self.cm_file = cm_file
         self.use_rfam = use_rfam
         self.config_file = config_file
+        self.cache_dir = cache_dir
         self.csv = csv
+        self.table = table
         self.json = json
         self.html = html
+        self.html_pictures = html_pictures
+        self.html_report = html_report
         self.download_rfam = download_rfam
         self.show_gene_browser = show_gene_browser
         self.zip_json = zip_json
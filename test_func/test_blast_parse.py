@@ -30,6 +30,22 @@ class TestBlastParser(unittest.TestCase):
 
         self._make_t(blast_in, bixml)
 
+    def test_features(self):
+        blast_in = os.path.abspath(os.path.dirname(__file__) + '/test_data/blast_parse_web_multi_hit.txt')
+        with open(blast_in, 'r') as f:
+            records = list(blast_parse_txt(f))
+        hsps = [h for r in records for a in r.alignments for h in a.hsps]
+        features = [h.features for h in hsps if hasattr(h, 'features')]
+
+        self.assertIn('   transcription termination factor Rho\n', features)
+        self.assertIn(
+            ["   27 bp at 5' side: acyl-CoA dehydrogenase\n", "   45 bp at 3' side: hypothetical protein\n"],
+            features
+        )
+        for h in hsps:
+            self.assertEqual(len(h.query), len(h.sbjct))
+            self.assertEqual(len(h.query), h.align_length)
+
     def _make_t(self, file_txt, file_xml):
         with open(file_txt, 'r') as f, open(file_xml, 'r') as x:
             for btxt, bxml in zip(blast_parse_txt(f), NCBIXML.parse(x)):                                # queries
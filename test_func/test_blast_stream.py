@@ -0,0 +1,92 @@
+import os
+import re
+import tempfile
+import unittest
+
+from Bio.Blast import NCBIXML
+
+from rna_blast_analyze.BR_core import exceptions
+from rna_blast_analyze.BR_core.BA_support import remove_files_with_try
+from rna_blast_analyze.BR_core.blast_stream import iter_blast_records, iter_queries, load_offset_index, \
+    resolve_blast_format
+from rna_blast_analyze.BR_core.parser_to_bio_blast import blast_parse_txt
+
+fwd = os.path.dirname(__file__)
+xml_single = os.path.join(fwd, 'test_data', 'web_multi_hit.xml')
+txt_multi = os.path.join(fwd, 'test_data', 'blast_parse_multi_query_web.txt')
+
+
+def _summary(records):
+    return [(r.query, len(r.alignments), [a.hit_id for a in r.alignments[:5]]) for r in records]
+
+
+class TestBlastStream(unittest.TestCase):
+    def setUp(self):
+        # multi query xml made of renamed copies of a single query iteration
+        with open(xml_single, 'r') as f:
+            xml = f.read()
+        head, rest = xml.split('<Iteration>', 1)
+        iteration, tail = rest.split('</Iteration>', 1)
+        iterations = []
+        for i in range(3):
+            it = re.sub(r'<Iteration_iter-num>\d+', '<Iteration_iter-num>{}'.format(i + 1), iteration)
+            it = re.sub(
+                r'<Iteration_query-def>[^<]*', '<Iteration_query-def>query_{}'.format(i), it
+            )
+            iterations.append('<Iteration>' + it + '</Iteration>')
+        fd, self.xml = tempfile.mkstemp(prefix='rba_', suffix='_t60')
+        with os.fdopen(fd, 'w') as f:
+            f.write(head + '\n'.join(iterations) + tail)
+
+        fd, self.query3 = tempfile.mkstemp(prefix='rba_', suffix='_t61')
+        with os.fdopen(fd, 'w') as f:
+            for i in range(3):
+                f.write('>query_{}\nACGUACGUACGUACGUAC\n'.format(i))
+
+        fd, self.query2 = tempfile.mkstemp(prefix='rba_', suffix='_t62')
+        with os.fdopen(fd, 'w') as f:
+            f.write('>q1\nACGU\n>q2\nACGU\n')
+
+        fd, self.idx = tempfile.mkstemp(prefix='rba_', suffix='_t63')
+        os.close(fd)
+
+    def tearDown(self):
+        remove_files_with_try([self.xml, self.query3, self.query2, self.idx])
+
+    def test_xml_seek(self):
+        self.assertEqual(resolve_blast_format(self.xml), 'xml')
+        index = load_offset_index(self.xml, 'xml', self.idx)
+        self.assertEqual(len(index['offsets']), 3)
+        self.assertTrue(index['seekable'])
+        # saved index is reused
+        self.assertEqual(load_offset_index(self.xml, 'xml', self.idx), index)
+
+        with open(self.xml, 'r') as f:
+            ref = _summary(NCBIXML.parse(f))
+        self.assertEqual([r[0] for r in ref], ['query_0', 'query_1', 'query_2'])
+        for start in range(3):
+            self.assertEqual(_summary(iter_blast_records(self.xml, 'xml', start=start, index=index)), ref[start:])
+
+    def test_txt_seek(self):
+        self.assertEqual(resolve_blast_format(txt_multi), 'plain')
+        index = load_offset_index(txt_multi, 'plain', self.idx)
+        self.assertEqual(len(index['offsets']), 2)
+
+        with open(txt_multi, 'r') as f:
+            ref = _summary(blast_parse_txt(f))
+        self.assertEqual(_summary(iter_blast_records(txt_multi, 'plain', start=1, index=index)), ref[1:])
+
+    def test_iter_queries(self):
+        index = load_offset_index(self.xml, 'xml', self.idx)
+        res = [(i, b is None, q.id) for i, b, q in iter_queries(self.xml, self.query3, 'xml', start=1, index=index)]
+        self.assertEqual(res, [(0, True, 'query_0'), (1, False, 'query_1'), (2, False, 'query_2')])
+
+    def test_count_mismatch(self):
+        with self.assertRaises(exceptions.ParsingError):
+            list(iter_queries(self.xml, self.query2, 'xml'))
+        with self.assertRaises(exceptions.ParsingError):
+            list(iter_queries(txt_multi, self.query3, 'plain'))
+
+
+if __name__ == '__main__':
+    unittest.main()
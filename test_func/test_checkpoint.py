@@ -0,0 +1,129 @@
+import json
+import os
+import re
+import tempfile
+import unittest
+
+from rna_blast_analyze.BR_core.BA_support import remove_one_file_with_try
+from rna_blast_analyze.BR_core.checkpoint import CheckpointStore, apply_prediction
+
+fwd = os.path.dirname(__file__)
+blast_output = os.path.join(fwd, 'test_data', 'RF00001_output.json')
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        with open(blast_output, 'r') as f:
+            self.data = json.load(f)
+        ff, self.backup = tempfile.mkstemp(prefix='rba_', suffix='_t30')
+        os.close(ff)
+
+    def tearDown(self):
+        remove_one_file_with_try(self.backup)
+
+    def _delta(self, ss):
+        hits = {}
+        for h in self.data['hits']:
+            key = re.split('[|:]', h['source']['id'])[1]
+            hits[key] = {
+                'structure': ss * len(h['extension']['Bio.Seq']['seq']),
+                'annotations': {'sss': ['test']},
+            }
+        return {'method': 'test', 'sha1': 'abc', 'hits': hits, 'msgs': ['m']}
+
+    def test_migrate_old_format(self):
+        with open(self.backup, 'w') as f:
+            json.dump([None, self.data], f)
+
+        c = CheckpointStore(self.backup, sha1='other')
+        self.assertEqual(c.iterations(), [1])
+        self.assertEqual(c.sha1, self.data['args']['sha1'])
+        self.assertEqual(c.load(1), self.data)
+        self.assertIsNone(c.load(0))
+
+    def test_migrate_empty(self):
+        with open(self.backup, 'w') as f:
+            json.dump(None, f)
+
+        c = CheckpointStore(self.backup, sha1='abc')
+        self.assertEqual(c.iterations(), [])
+        self.assertEqual(c.sha1, 'abc')
+
+    def test_prediction_delta(self):
+        c = CheckpointStore(self.backup, sha1='abc')
+        c.save_query(0, self.data)
+        c.save_prediction(0, self._delta('.'))
+        c.save_prediction(0, self._delta(':'))
+
+        # reopen - the index must be rebuilt from the file
+        c = CheckpointStore(self.backup)
+        self.assertEqual(c.sha1, 'abc')
+        loaded = c.load(0)
+        for h in loaded['hits'] + loaded['__all_hits']:
+            ss = h['extension']['letter_annotations']['test']
+            self.assertEqual(ss, ':' * len(h['extension']['Bio.Seq']['seq']))
+            self.assertEqual(h['extension']['annotations']['sss'], ['test'])
+        self.assertEqual(loaded['msgs'], ['m'])
+
+        # new query record replaces previous deltas
+        c.save_query(0, self.data)
+        self.assertEqual(c.load(0), self.data)
+
+    def test_incomplete_record(self):
+        c = CheckpointStore(self.backup, sha1='abc')
+        c.save_query(0, self.data)
+        with open(self.backup, 'a') as f:
+            f.write('P\t0\t{"method": "te')
+
+        c = CheckpointStore(self.backup)
+        self.assertEqual(c.load(0), self.data)
+
+    def test_resume_after_partial_write(self):
+        c = CheckpointStore(self.backup, sha1='abc')
+        c.save_query(0, self.data)
+        with open(self.backup, 'a') as f:
+            f.write('Q\t1\t{"hits": [')
+
+        # the computation is resumed, new records are saved after the last complete one
+        c = CheckpointStore(self.backup)
+        c.save_query(2, self.data)
+        self.assertNotIn(1, c)
+
+        c = CheckpointStore(self.backup)
+        self.assertEqual(c.iterations(), [0, 2])
+        self.assertIsNone(c.load(1))
+        self.assertEqual(c.load(2), self.data)
+
+    def test_apply_prediction(self):
+        d = apply_prediction(json.loads(json.dumps(self.data)), self._delta('.'))
+        for h in d['hits']:
+            self.assertIn('test', h['extension']['letter_annotations'])
+
+    def test_alignments(self):
+        c = CheckpointStore(self.backup, sha1='abc')
+        c.save_alignment(0, 3, self.data['hits'][0])
+        c.save_alignment(0, 5, self.data['hits'][1])
+        c.save_alignment(1, 3, None)
+
+        c = CheckpointStore(self.backup)
+        self.assertEqual(c.iterations(), [])
+        self.assertEqual(c.load_alignments(0), {3: self.data['hits'][0], 5: self.data['hits'][1]})
+        self.assertEqual(c.load_alignments(1), {3: None})
+
+        # finished query does not need the alignments
+        c.save_query(0, self.data)
+        self.assertEqual(c.load_alignments(0), {})
+
+    def test_compact(self):
+        c = CheckpointStore(self.backup, sha1='abc')
+        c.save_query(0, self.data)
+        c.save_prediction(0, self._delta('.'))
+        c.compact([(0, self.data), (1, self.data)])
+        self.assertEqual(c.iterations(), [0, 1])
+        self.assertEqual(c.load(0), self.data)
+        with open(self.backup, 'r') as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
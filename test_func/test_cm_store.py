@@ -0,0 +1,140 @@
+import fcntl
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from rna_blast_analyze.BR_core import cm_store
+from rna_blast_analyze.BR_core.cmalign import RfamInfo
+from rna_blast_analyze.BR_core.config import CONFIG
+from rna_blast_analyze import manage_cache
+
+
+class FakeCmfetch(object):
+    def __init__(self, tmp_dir):
+        self.tmp_dir = tmp_dir
+        self.calls = []
+
+    def __call__(self, cmfile, modelid, outfile=None, timeout=None):
+        self.calls.append(modelid)
+        if outfile is None:
+            fd, outfile = tempfile.mkstemp(dir=self.tmp_dir)
+            os.close(fd)
+        with open(outfile, 'w') as f:
+            f.write('INFERNAL1/a\nNAME {}\n'.format(modelid) + 'x' * 100 + '\n//\n')
+        return outfile
+
+
+class TestCmStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='rba_')
+        self.rfam = RfamInfo(rfamdir=self.tmp)
+        self.fake = FakeCmfetch(self.tmp)
+        self.patches = [
+            mock.patch.dict(CONFIG.data_paths, {'cache_dir': os.path.join(self.tmp, 'cache')}),
+            mock.patch.object(cm_store, 'run_cmfetch', self.fake),
+            mock.patch.object(cm_store, 'check_if_cmfetch_indexed', return_value=True),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.tmp)
+
+    def test_fetch_shared(self):
+        a = cm_store.fetch_model('5S_rRNA', rfam=self.rfam)
+        b = cm_store.fetch_model('5S_rRNA', rfam=self.rfam)
+        self.assertEqual(a, b)
+        self.assertEqual(self.fake.calls, ['5S_rRNA'])
+        self.assertEqual(os.path.basename(a), cm_store.cm_hash(a) + '.cm')
+
+        # files of the store are kept after release, models in use are not pruned
+        cm_store.release(a)
+        cm_store.prune(os.path.dirname(a), max_size=0)
+        self.assertTrue(os.path.isfile(a))
+        cm_store.release(b)
+        self.assertTrue(os.path.isfile(a))
+        self.assertEqual(cm_store.prune(os.path.dirname(a), max_size=0), 1)
+        self.assertFalse(os.path.exists(a))
+
+        # model locked by other run is not removed
+        c = cm_store.fetch_model('5S_rRNA', rfam=self.rfam)
+        cm_store.release(c)
+        with open(c, 'rb') as other:
+            fcntl.flock(other, fcntl.LOCK_SH)
+            self.assertEqual(cm_store.prune(os.path.dirname(a), max_size=0), 0)
+        self.assertTrue(os.path.isfile(c))
+        cm_store.prune(os.path.dirname(a), max_size=0)
+
+        # removed model is extracted again
+        c = cm_store.fetch_model('5S_rRNA', rfam=self.rfam)
+        self.assertEqual(c, a)
+        self.assertEqual(self.fake.calls, ['5S_rRNA', '5S_rRNA', '5S_rRNA'])
+        cm_store.release(c)
+
+    def test_temporary_files(self):
+        with mock.patch.dict(CONFIG.data_paths, {'cache_dir': ''}):
+            a = cm_store.fetch_model('tRNA', rfam=self.rfam)
+        self.assertTrue(os.path.isfile(a))
+        cm_store.release(a)
+        self.assertFalse(os.path.exists(a))
+
+    def test_derived(self):
+        cm_file = cm_store.fetch_model('tRNA', rfam=self.rfam)
+        with mock.patch.object(cm_store, 'extract_ref_from_cm', return_value='((..))') as ref:
+            self.assertEqual(cm_store.ref_structure(cm_file), '((..))')
+            self.assertEqual(cm_store.ref_structure(cm_file), '((..))')
+        self.assertEqual(ref.call_count, 1)
+
+        def emit(model, params='', timeout=None):
+            fd, out = tempfile.mkstemp(dir=self.tmp)
+            with os.fdopen(fd, 'w') as f:
+                f.write('>s1\nACGU\n')
+            return out
+
+        with mock.patch.object(cm_store, 'run_cmemit', side_effect=emit) as em:
+            files = [
+                cm_store.emit_samples(cm_file, params=' -u  -N 10 --seed 7'),
+                cm_store.emit_samples(cm_file, '-u -N 10 --seed 7'),
+            ]
+            # without the seed the samples differ between runs
+            for params in ['-u -N 10 --seed 0', '-u -N 10', '-u -N 10']:
+                os.remove(cm_store.emit_samples(cm_file, params=params))
+        self.assertEqual(em.call_count, 4)
+        for f in files:
+            with open(f, 'r') as fh:
+                self.assertEqual(fh.read(), '>s1\nACGU\n')
+            os.remove(f)
+        cm_store.release(cm_file)
+
+    def _manage_cache(self, *argv):
+        with mock.patch('sys.argv', ['rboAnalyzer_cache'] + list(argv)), \
+                mock.patch('sys.stdout', new_callable=io.StringIO) as out:
+            manage_cache.main()
+        return out.getvalue()
+
+    def test_manage_cache(self):
+        a = cm_store.fetch_model('5S_rRNA', rfam=self.rfam)
+        cm_store.release(a)
+        b = cm_store.fetch_model('tRNA', rfam=self.rfam)
+
+        self.assertIn('cm_models store: 2 models', self._manage_cache('info'))
+
+        # the model in use is kept
+        out = self._manage_cache('clear')
+        self.assertIn('cm_models store: removed 1 models.', out)
+        self.assertIn('cm_models store: 1 models', out)
+        self.assertFalse(os.path.exists(a))
+        self.assertTrue(os.path.isfile(b))
+
+        cm_store.release(b)
+        self.assertIn('cm_models store: removed 1 models.', self._manage_cache('prune', '--max_size', '0'))
+        self.assertFalse(os.path.exists(b))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from rna_blast_analyze.BR_core import cmalign
+from rna_blast_analyze.BR_core.config import CONFIG
+
+_names = ['#target name', 'accession', 'query name', 'accession', 'mdl', 'mdl from', 'mdl to', 'seq from',
+          'seq to', 'strand', 'trunc', 'pass', 'gc', 'bias', 'score', 'E-value', 'inc', 'description of target']
+_widths = [20, 9, 20, 9, 3, 8, 8, 8, 8, 6, 5, 4, 4, 5, 6, 9, 3, 21]
+
+
+def _tblout_line(values):
+    return ' '.join(str(v).ljust(w) for v, w in zip(values, _widths)).rstrip() + '\n'
+
+
+class FakeCmscan(object):
+    """Write cmscan table with one model per query, the model is given by the first letter of the sequence."""
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self.calls = []
+
+    def __call__(self, fastafile, params=None, threads=None, rfam=None, timeout=None):
+        with open(fastafile, 'r') as f:
+            queries = re.findall(r'>(\S+)\n(\S+)', f.read())
+        self.calls.append([q for q, _ in queries])
+        out = os.path.join(self.out_dir, 'tblout{}'.format(len(self.calls)))
+        with open(out, 'w') as f:
+            f.write(_tblout_line(_names))
+            f.write(' '.join('#' + '-' * (w - 1) if i == 0 else '-' * w for i, w in enumerate(_widths)) + '\n')
+            for q, seq in queries:
+                if seq[0] == 'U':
+                    continue
+                f.write(_tblout_line([
+                    'model_' + seq[0], 'RF00001', q, '-', 'cm', 1, 10, 1, 10, '+', 'no', 1, 0.5, 0.0, 50.0, 1e-10,
+                    '!', 'some model'
+                ]))
+        return out
+
+
+class TestCmscanCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='rba_')
+        self.query_file = os.path.join(self.tmp, 'query.fasta')
+        with open(self.query_file, 'w') as f:
+            f.write('>first query\nACGUACGU\n>second\nGGGAAACC\n>third\nUUUUCCCC\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _table(self, fake, query_file):
+        with mock.patch.dict(CONFIG.data_paths, {'cache_dir': os.path.join(self.tmp, 'cache')}), \
+                mock.patch.object(cmalign, 'run_cmscan', fake):
+            return cmalign.get_cm_model_table(query_file, threads=2)
+
+    def test_cached(self):
+        fake = FakeCmscan(self.tmp)
+        table = self._table(fake, self.query_file)
+        self.assertEqual(fake.calls, [['q0', 'q1', 'q2']])
+        self.assertEqual(list(table['query_name']), ['first', 'second'])
+        self.assertEqual(list(table['target_name']), ['model_A', 'model_G'])
+        self.assertEqual(cmalign.select_best_matching_model_from_cmscan(table)['target_name'], 'model_A')
+
+        # second lookup of the same sequences does not run cmscan
+        fake = FakeCmscan(self.tmp)
+        cached = self._table(fake, self.query_file)
+        self.assertEqual(fake.calls, [])
+        self.assertTrue(table.equals(cached))
+
+        # only the new sequence is scanned, sequence under other name is taken from the cache
+        other = os.path.join(self.tmp, 'other.fasta')
+        with open(other, 'w') as f:
+            f.write('>renamed\nGGGAAACC\n>new\nCCCCAAAA\n')
+        table = self._table(fake, other)
+        self.assertEqual(fake.calls, [['q1']])
+        self.assertEqual(list(table['query_name']), ['renamed', 'new'])
+        self.assertEqual(list(table['target_name']), ['model_G', 'model_C'])
+
+    def test_failed_cmscan(self):
+        def fail(*args, **kwargs):
+            raise cmalign.exceptions.CmscanException('Call to cmscan failed.', '')
+
+        self.assertIsNone(self._table(fail, self.query_file))
+        # failure is not cached
+        fake = FakeCmscan(self.tmp)
+        self._table(fake, self.query_file)
+        self.assertEqual(len(fake.calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
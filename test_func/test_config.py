@@ -3,7 +3,9 @@
 # test if config override is transfered to object loaded in different functions (if not so, then it is unusable)
 
 import os
+import tempfile
 import unittest
+from unittest import mock
 from rna_blast_analyze.BR_core.config import CONFIG, tools_paths
 
 fwd = os.path.dirname(__file__)
@@ -24,6 +26,21 @@ class TestConfig(unittest.TestCase):
         CONFIG.override(tools_paths(os.path.join(fwd, 'test_data', 'config_test.txt')))
         self.assertEqual(CONFIG.rfam_dir, rfam_dir)
 
+    def test_cache_dir_default(self):
+        with mock.patch.dict(os.environ, {'XDG_CACHE_HOME': '/test/xdg_cache'}):
+            self.assertEqual(tools_paths(None).cache_dir, '/test/xdg_cache/rboAnalyzer')
+        with mock.patch.dict(os.environ, {'XDG_CACHE_HOME': ''}):
+            self.assertEqual(
+                tools_paths(None).cache_dir, os.path.join(os.path.expanduser('~'), '.cache', 'rboAnalyzer')
+            )
+
+    def test_cache_dir_config_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cfg = os.path.join(tmpdir, 'config.txt')
+            with open(cfg, 'w') as f:
+                f.write('[DATA]\ncache_dir = /test/cache\n')
+            self.assertEqual(tools_paths(cfg).cache_dir, '/test/cache')
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,106 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from Bio import SeqIO
+from Bio.Blast.Record import HSP
+
+from rna_blast_analyze.BR_core import extend_hits
+from rna_blast_analyze.BR_core.BA_support import remove_files_with_try
+from rna_blast_analyze.BR_core.config import CONFIG
+from rna_blast_analyze.BR_core.fasta_index import IndexedSequenceFile, build_fai, IrregularFastaException, \
+    _cached_fai_file
+
+
+class TestFastaIndex(unittest.TestCase):
+    def setUp(self):
+        self.seq = ''.join(random.choice('ACGT') for _ in range(1037))
+        fd, self.fasta = tempfile.mkstemp(prefix='rba_', suffix='_t31')
+        with os.fdopen(fd, 'w') as f:
+            f.write('>acc.1 some description\n')
+            for i in range(0, len(self.seq), 60):
+                f.write(self.seq[i:i + 60] + '\n')
+            f.write('\n>second\nACGT\n')
+        self.cache_dir = tempfile.mkdtemp(prefix='rba_')
+        self.patch = mock.patch.dict(CONFIG.data_paths, {'cache_dir': self.cache_dir})
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        remove_files_with_try([self.fasta, self.fasta + '.fai'])
+        shutil.rmtree(self.cache_dir)
+
+    def test_fetch_equals_seqio_slice(self):
+        with open(self.fasta, 'r') as f:
+            ref = next(SeqIO.parse(f, format='fasta'))
+
+        isf = IndexedSequenceFile(self.fasta)
+        for s, e in [(0, 10), (0, 60), (59, 61), (100, 1037), (1000, 2000), (1037, 1040), (5, 5)]:
+            r = isf.fetch(s, e)
+            self.assertEqual(str(r.seq), str(ref[s:e].seq))
+            self.assertEqual(r.id, ref.id)
+            self.assertEqual(r.description, ref.description)
+        isf.close()
+
+        # index is cached in the cache_dir, not next to the fasta file
+        self.assertFalse(os.path.exists(self.fasta + '.fai'))
+        self.assertTrue(os.path.isfile(_cached_fai_file(self.fasta)))
+        with mock.patch('rna_blast_analyze.BR_core.fasta_index.build_fai') as build:
+            IndexedSequenceFile(self.fasta).close()
+        self.assertEqual(build.call_count, 0)
+
+    def test_without_cache(self):
+        with mock.patch.dict(CONFIG.data_paths, {'cache_dir': ''}):
+            isf = IndexedSequenceFile(self.fasta)
+            self.assertEqual(str(isf.fetch(0, 10).seq), self.seq[:10])
+            isf.close()
+        self.assertFalse(os.path.exists(self.fasta + '.fai'))
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_files_closed(self):
+        # hits to two genome files alternate, only one file is open at a time
+        database, name = os.path.split(self.fasta)
+        other = name + '_other'
+        shutil.copy(self.fasta, os.path.join(database, other))
+        self.addCleanup(remove_files_with_try, [os.path.join(database, other)])
+
+        hits = []
+        for i in range(4):
+            hsp = HSP()
+            hsp.query_start, hsp.query_end, hsp.sbjct_start, hsp.sbjct_end = 1, 10, 11 + i, 20 + i
+            hits.append([name if i % 2 else other, hsp])
+
+        opened = []
+
+        class Tracked(IndexedSequenceFile):
+            def __init__(self, *args, **kwargs):
+                self.open_before = [o for o in opened if o._handle is not None]
+                opened.append(self)
+                super(Tracked, self).__init__(*args, **kwargs)
+
+        with mock.patch.object(extend_hits, 'IndexedSequenceFile', Tracked):
+            exp_hits, _ = extend_hits.expand_hits_from_fasta(
+                hits, database, 10, blast_regexp=r'(.*)', blast_input_file=self.fasta
+            )
+        self.assertEqual(len(opened), 2)
+        self.assertTrue(all(o.open_before == [] and o._handle is None for o in opened))
+        self.assertEqual([str(h.seq) for h in exp_hits], [self.seq[10 + i:20 + i] for i in range(4)])
+        self.assertEqual([h.id.split('|')[0] for h in exp_hits], ['uid:0', 'uid:1', 'uid:2', 'uid:3'])
+
+    def test_irregular_fasta(self):
+        with open(self.fasta, 'w') as f:
+            f.write('>acc.1\nACGT\nAC\nACGT\n')
+
+        with self.assertRaises(IrregularFastaException):
+            build_fai(self.fasta)
+
+        # falls back to parsing the file
+        isf = IndexedSequenceFile(self.fasta)
+        self.assertEqual(str(isf.fetch(2, 8).seq), 'GTACAC')
+
+
+if __name__ == '__main__':
+    unittest.main()
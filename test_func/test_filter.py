@@ -3,10 +3,13 @@ import json
 import unittest
 
 from Bio.Blast import NCBIXML
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
 from rna_blast_analyze.BR_core.BA_support import blast_hit_getter_from_hits, blast_hit_getter_from_subseq
-from rna_blast_analyze.BR_core.BA_support import blast_hsps2list
+from rna_blast_analyze.BR_core.BA_support import blast_hsps2list, filter_by_length_diff
 from rna_blast_analyze.BR_core.filter_blast import filter_by_eval, filter_by_bits
 from rna_blast_analyze.BR_core.convert_classes import blastsearchrecomputefromdict
+from rna_blast_analyze.BR_core.hit_table import HitTable
 
 
 class TestFilterBlastHits(unittest.TestCase):
@@ -50,6 +53,35 @@ class TestFilterBlastHits(unittest.TestCase):
             self.assertTrue(10**-30 < _get_eval(f) < 5)
 
 
+class TestHitTable(unittest.TestCase):
+    def setUp(self):
+        bixml = os.path.abspath(os.path.dirname(__file__) + '/test_data/web_multi_hit.xml')
+        with open(bixml, 'r') as b:
+            self.blast = blast_hsps2list([i for i in NCBIXML.parse(b)][0])
+
+    def test_filter_keeps_order(self):
+        filtered = filter_by_bits(self.blast, blast_hit_getter_from_hits, [('>=', 30), ('<=', 60)])
+        expected = [h for h in self.blast if 30 <= h[1].bits <= 60]
+        self.assertTrue(0 < len(expected) < len(self.blast))
+        self.assertEqual(len(filtered), len(expected))
+        for f, e in zip(filtered, expected):
+            self.assertIs(f, e)
+
+    def test_columns(self):
+        table = HitTable(self.blast, blast_hit_getter_from_hits)
+        self.assertEqual(len(table), len(self.blast))
+        self.assertEqual(list(table['expect']), [h[1].expect for h in self.blast])
+        self.assertEqual(list(table['sbjct_start']), [h[1].sbjct_start for h in self.blast])
+        with self.assertRaises(KeyError):
+            table['hit_id']
+
+    def test_filter_by_length_diff(self):
+        seqs = [SeqRecord(Seq('A' * n)) for n in (80, 91, 100, 109, 120, 200)]
+        filtered = filter_by_length_diff(seqs, 100, 0.1)
+        self.assertEqual([len(s) for s in filtered], [91, 100, 109])
+        self.assertEqual(filter_by_length_diff([], 100, 0.1), [])
+
+
 def _get_bits(f):
     return f.source.annotations['blast'][1].bits
 
@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from rna_blast_analyze.BR_core import fold_backend
+from rna_blast_analyze.BR_core.BA_support import remove_one_file_with_try
+from rna_blast_analyze.BR_core.fold_backend import fold_fasta, rnalib_options
+
+
+@unittest.skipIf(fold_backend.RNA is None, 'RNAlib not available')
+class TestFoldBackend(unittest.TestCase):
+    def setUp(self):
+        self.seq = "GCCTCATAGCTCAGAGGTTTAGAGCACTGGTCTTGTAAACCAGGGGTCGTGAGTTCGAGTCTCACTGGGGCCT"
+        fd, self.fasta = tempfile.mkstemp(prefix='rba_', suffix='_t51')
+        with os.fdopen(fd, 'w') as f:
+            f.write('>first some description\n{}\n{}\n>second\n{}\n'.format(self.seq[:40], self.seq[40:], self.seq[:30]))
+
+        fd, self.constrained = tempfile.mkstemp(prefix='rba_', suffix='_t52')
+        with os.fdopen(fd, 'w') as f:
+            f.write('>c1\n{}\n{}\n'.format(self.seq, 'x' * 10 + '.' * (len(self.seq) - 10)))
+
+    def tearDown(self):
+        remove_one_file_with_try(self.fasta)
+        remove_one_file_with_try(self.constrained)
+
+    def test_options(self):
+        self.assertIsNotNone(rnalib_options(''))
+        self.assertEqual(rnalib_options('--noLP -T 25')['temp'], 25)
+        self.assertTrue(rnalib_options('-C --noPS')['constraint'])
+        # options not supported in-process, RNAfold must be used
+        self.assertIsNone(rnalib_options('-p'))
+        self.assertIsNone(rnalib_options('--unknown'))
+
+    def test_fold(self):
+        for threads in [1, 2]:
+            res = fold_fasta(self.fasta, threads=threads)
+            self.assertEqual([r.id for r in res], ['first', 'second'])
+            self.assertEqual(res[0].description, 'some description')
+            self.assertEqual(str(res[0].seq), self.seq.replace('T', 'U'))
+            self.assertEqual(res[0].letter_annotations['ss0'], fold_backend.RNA.fold(self.seq)[0])
+            self.assertEqual(res[1].annotations['sss'], ['ss0'])
+
+    def test_constraint(self):
+        res = fold_fasta(self.constrained, params='-C')
+        self.assertEqual(len(res), 1)
+        self.assertEqual(res[0].letter_annotations['ss0'][:10], '.' * 10)
+        self.assertNotEqual(res[0].letter_annotations['ss0'][:10], fold_backend.RNA.fold(self.seq)[0][:10])
+
+    def test_param_file_reset(self):
+        default = fold_fasta(self.fasta)[0].letter_annotations['ss0']
+
+        fd, par_file = tempfile.mkstemp(prefix='rba_', suffix='_t53.par')
+        os.close(fd)
+        try:
+            fold_backend.RNA.params_load_RNA_Andronescu2007()
+            fold_backend.RNA.params_save(par_file)
+            fold_backend.RNA.params_load_RNA_Turner2004()
+            fold_fasta(self.fasta, params='-P {}'.format(par_file))
+        finally:
+            remove_one_file_with_try(par_file)
+
+        # fold without -P uses the default parameters again
+        self.assertEqual(fold_fasta(self.fasta)[0].letter_annotations['ss0'], default)
+        self.assertEqual(default, fold_backend.RNA.fold(self.seq)[0])
+
+
+class TestParamFileTracking(unittest.TestCase):
+    def test_reload(self):
+        options = {'paramFile': None, 'constraint': False, 'temp': None, 'dangles': None, 'maxBPspan': None,
+                   'noLP': False, 'noGU': False, 'noClosingGU': False}
+        with mock.patch.object(fold_backend, 'RNA') as rna, \
+                mock.patch.object(fold_backend._fold_one, 'params_loaded', None):
+            rna.fold_compound.return_value.mfe.return_value = ('....', 0.0)
+            fold_backend._fold_one(('ACGU', None), options=options)
+            fold_backend._fold_one(('ACGU', None), options=dict(options, paramFile='custom.par'))
+            fold_backend._fold_one(('ACGU', None), options=dict(options, paramFile='custom.par'))
+            fold_backend._fold_one(('ACGU', None), options=options)
+
+        rna.params_load.assert_called_once_with('custom.par')
+        # defaults are restored after the custom parameters, not before (nothing was loaded)
+        rna.params_load_RNA_Turner2004.assert_called_once_with()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import pysam
+
+from rna_blast_analyze.BR_core.config import CONFIG
+from rna_blast_analyze.BR_core.load_from_bgzip import GenomeDB, resolver
+
+
+class TestGenomeDB(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='rba_')
+        self.dbfile = os.path.join(self.tmpdir, 'genomes.db')
+        self.seqs = {
+            'NC_000001.1': 'ACGT' * 100,
+            'NC_000002.1': 'GGCC' * 50,
+        }
+        con = sqlite3.connect(self.dbfile)
+        with con:
+            con.execute("CREATE TABLE genomes(acc TEXT PRIMARY KEY NOT NULL, description TEXT, seq BLOB, gff BLOB);")
+            for acc, seq in self.seqs.items():
+                con.execute(
+                    "INSERT INTO genomes VALUES(?, ?, ?, ?);",
+                    (acc, acc + ' test genome', gzip.compress(seq.encode()), None)
+                )
+        con.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_load_regions(self):
+        db = GenomeDB(self.dbfile)
+        regions = [
+            ('NC_000001.1', 0, 10),
+            ('NC_000002.1', 5, 20),
+            ('NC_000001.1', 390, 500),
+        ]
+        records = db.load_regions(regions)
+        for (acc, start, end), rec in zip(regions, records):
+            self.assertEqual(str(rec.seq), self.seqs[acc][start:end])
+            self.assertEqual(rec.id, acc)
+            self.assertEqual(rec.description, acc + ' test genome')
+
+        # each genome decompressed once
+        self.assertEqual(db.stats['misses'], 2)
+
+        db.load_genome('NC_000002.1', 0, 4)
+        self.assertEqual(db.stats['hits'], 1)
+        db.close()
+
+    def test_cache_eviction(self):
+        db = GenomeDB(self.dbfile, cache_size=450)
+        db.load_genome('NC_000001.1', 0, 4)
+        db.load_genome('NC_000002.1', 0, 4)
+        # first genome evicted
+        db.load_genome('NC_000001.1', 0, 4)
+        self.assertEqual(db.stats['misses'], 3)
+        self.assertEqual(db.stats['hits'], 0)
+        db.close()
+
+    def test_missing(self):
+        db = GenomeDB(self.dbfile)
+        with self.assertRaises(KeyError):
+            db.load_regions([('NC_000003.1', 0, 10)])
+        db.close()
+
+    def test_read_only_bgzip(self):
+        # genome stored in bgzipped fasta file
+        acc = 'NC_000003.1'
+        ff = resolver(self.tmpdir, acc) + '.fasta'
+        os.makedirs(os.path.dirname(ff))
+        with open(ff, 'w') as f:
+            f.write('>{} bgzipped genome\n{}\n'.format(acc, 'ACGU' * 20))
+        pysam.tabix_compress(ff, ff + '.gz')
+        pysam.FastaFile(ff + '.gz').close()
+        con = sqlite3.connect(self.dbfile)
+        with con:
+            con.execute("INSERT INTO genomes VALUES(?, ?, ?, ?);", (acc, None, None, None))
+        con.close()
+        os.chmod(self.dbfile, 0o444)
+        before = os.stat(self.dbfile).st_mtime
+
+        cache_dir = os.path.join(self.tmpdir, 'cache')
+        with mock.patch.dict(CONFIG.data_paths, {'cache_dir': cache_dir}):
+            db = GenomeDB(self.dbfile)
+            rec = db.load_regions([(acc, 4, 8), ('NC_000001.1', 0, 4)])
+            db.close()
+            self.assertEqual(str(rec[0].seq), 'ACGU')
+            self.assertEqual(rec[0].description, acc + ' bgzipped genome')
+
+            # the description is read from the file only once, it is stored in the cache_dir
+            db = GenomeDB(self.dbfile)
+            with mock.patch('rna_blast_analyze.BR_core.load_from_bgzip.load_description') as ld:
+                rec = db.load_regions([(acc, 0, 4)])
+            db.close()
+            self.assertEqual(ld.call_count, 0)
+            self.assertEqual(rec[0].description, acc + ' bgzipped genome')
+            self.assertTrue(os.path.isfile(os.path.join(cache_dir, 'genome_descriptions.sqlite')))
+
+        # the genome database is not modified
+        self.assertEqual(os.stat(self.dbfile).st_mtime, before)
+        con = sqlite3.connect(self.dbfile)
+        tables = [r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type = 'table';")]
+        con.close()
+        self.assertEqual(tables, ['genomes'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+from argparse import Namespace
+
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from rna_blast_analyze.BR_core.BA_methods import BlastSearchRecompute
+from rna_blast_analyze.BR_core.BA_support import Subsequences
+
+
+class TestHitSnapshot(unittest.TestCase):
+    def setUp(self):
+        query = SeqRecord(Seq('ACGUACGUAC'), id='query')
+        self.bsr = BlastSearchRecompute(Namespace(threads=1, prediction_method=['rnafold']), query, 0)
+        source = SeqRecord(Seq('UUACGUACGUACUU'), id='hit', annotations={'blast': ('hit', None), 'msgs': []})
+        hit = Subsequences(source)
+        hit.extension = SeqRecord(
+            Seq('ACGUACGUAC'), id='hit', annotations={'msgs': ['m0'], 'sss': ['ss0']},
+            letter_annotations={'ss0': '((....))..'}
+        )
+        self.bsr.hits.append(hit)
+        self.bsr.copy_hits()
+
+    def test_independent(self):
+        snap = self.bsr.snapshot()
+        hit = snap.hits[0]
+        hit.extension.annotations['sss'].append('rnafold')
+        hit.extension.annotations['msgs'].append('m1')
+        hit.extension.letter_annotations['rnafold'] = '(((..)))..'
+        snap.query.letter_annotations['ss0'] = '..........'
+        snap.args.threads = 4
+        snap.msgs.append('msg')
+
+        orig = self.bsr.hits[0]
+        self.assertEqual(orig.extension.annotations['sss'], ['ss0'])
+        self.assertEqual(orig.extension.annotations['msgs'], ['m0'])
+        self.assertNotIn('rnafold', orig.extension.letter_annotations)
+        self.assertNotIn('ss0', self.bsr.query.letter_annotations)
+        self.assertEqual(self.bsr.args.threads, 1)
+        self.assertEqual(self.bsr.msgs, [])
+        self.assertNotIn('rnafold', self.bsr.get_all_hits()[0].extension.letter_annotations)
+
+        # the sequences and the source (BLAST) records are shared
+        self.assertIs(hit.source, orig.source)
+        self.assertIs(hit.extension.seq, orig.extension.seq)
+
+
+if __name__ == '__main__':
+    unittest.main()
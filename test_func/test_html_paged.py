@@ -0,0 +1,84 @@
+import base64
+import gzip
+import json
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from argparse import Namespace
+
+from Bio.Blast.Record import HSP
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from rna_blast_analyze.BR_core.BA_methods import BlastSearchRecompute
+from rna_blast_analyze.BR_core.BA_support import Subsequences
+from rna_blast_analyze.BR_core.output.htmloutput import write_html_paged
+
+
+def _analyzed_hits(n_hits):
+    args = Namespace(
+        prediction_method=['rnafold'], pred_params={}, blast_in='blast.xml', blast_query='query.fasta', threads=1,
+        show_gene_browser=False, show_HSP=True, html_pictures='lazy',
+    )
+    bsr = BlastSearchRecompute(args, SeqRecord(Seq('ACGUACGUAC'), id='query'), 0)
+    for i in range(n_hits):
+        hsp = HSP()
+        hsp.expect, hsp.bits, hsp.score = 1e-5, 30.0, 20
+        hsp.query = hsp.sbjct = 'ACGUACGUAC'
+        hsp.match = '|' * 10
+        hsp.align_length, hsp.identities, hsp.positives, hsp.gaps = 10, 10, 10, 0
+        hsp.strand = ('Plus', 'Plus')
+        hsp.query_start, hsp.query_end, hsp.sbjct_start, hsp.sbjct_end = 1, 10, 101, 110
+        source = SeqRecord(
+            Seq('ACGUACGUAC'), id='uid:{}|hit_{}'.format(i, i), description='',
+            annotations={'blast': ('hit_{}'.format(i), hsp), 'msgs': [], 'extended_start': 101, 'extended_end': 110}
+        )
+        hit = Subsequences(source)
+        hit.best_start, hit.best_end = 101, 110
+        hit.extension = SeqRecord(
+            Seq('ACGUACGUAC'), id=source.id,
+            annotations={'msgs': [], 'cmstat': {'bit_sc': 10.0}, 'homology_estimate': 'Uncertain'},
+            letter_annotations={'rnafold': '((....))..'}
+        )
+        bsr.hits.append(hit)
+    return bsr
+
+
+class TestHtmlPaged(unittest.TestCase):
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp(prefix='rba_')
+        self.html = os.path.join(self.out_dir, 'report.html')
+
+    def tearDown(self):
+        shutil.rmtree(self.out_dir)
+
+    def test_chunks(self):
+        write_html_paged(_analyzed_hits(25), self.html, chunk_size=10)
+
+        with open(self.html, 'r') as f:
+            index = f.read()
+        self.assertEqual(
+            re.findall(r'data-src="([^"]+)"', index),
+            ['report_files/chunk_00000.js', 'report_files/chunk_00001.js', 'report_files/chunk_00002.js']
+        )
+        # hits are only in the chunks
+        self.assertNotIn('hit_3', index)
+
+        hits = []
+        for n in range(3):
+            with open(os.path.join(self.out_dir, 'report_files', 'chunk_{:05d}.js'.format(n)), 'r') as f:
+                m = re.match(r'hitChunk\((\d+), "([^"]+)"\);', f.read())
+            self.assertEqual(int(m.group(1)), n)
+            hits += json.loads(gzip.decompress(base64.b64decode(m.group(2))).decode())
+
+        self.assertEqual(len(hits), 25)
+        for i, h in enumerate(hits):
+            self.assertIn('id="{}onehit"'.format(i), h)
+            self.assertIn('Hit: hit_{}'.format(i), h)
+            self.assertIn('rnaarc', h)
+
+
+if __name__ == '__main__':
+    unittest.main()
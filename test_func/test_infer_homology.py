@@ -1,6 +1,12 @@
 import unittest
 import os
+import re
 import json
+import threading
+from unittest import mock
+
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
 
 from rna_blast_analyze.BR_core import infer_homology
 from rna_blast_analyze.BR_core import convert_classes
@@ -42,5 +48,56 @@ class Test1WithCMfile(unittest.TestCase):
         pred, sel, _ = infer_homology.infer_homology(self.data, self.data.args, cm_file)
 
 
+class FakeCmalign(object):
+    """Write cmalign score file, the bit score is the number of G in the sequence."""
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, fasta_file, model_file, cmalign_params='', timeout=None):
+        with open(fasta_file, 'r') as f:
+            seqs = re.findall(r'>(\S+)\n(\S+)', f.read())
+        with self.lock:
+            self.calls.append(([name for name, _ in seqs], cmalign_params))
+        sfile = re.search(r'--sfile (\S+)', cmalign_params).group(1)
+        with open(sfile, 'w') as f:
+            f.write('# header\n#\n# seq_name length\n# ---\n')
+            for name, seq in seqs:
+                f.write('{} {} 1 10 no {} 0.9 0.01 0.01 0.02 1.0\n'.format(name, len(seq), float(seq.count('G'))))
+        return model_file + '.msa'
+
+
+class TestShardedCmalign(unittest.TestCase):
+    def setUp(self):
+        self.records = [SeqRecord(Seq('GGGAAA'), id='query')] + [
+            SeqRecord(Seq('G' * (i % 5) + 'AAA'), id='uid:{}|hit'.format(i)) for i in range(25)
+        ]
+
+    def _scores(self, fake, **kwargs):
+        with mock.patch.object(infer_homology, 'run_cmalign_on_fasta', fake):
+            return infer_homology.run_cmalign_scores_sharded(self.records, 'model.cm', **kwargs)
+
+    def test_shards(self):
+        fake = FakeCmalign()
+        scores = self._scores(fake, threads=4, shard_size=10)
+
+        self.assertEqual(len(fake.calls), 3)
+        for names, params in fake.calls:
+            # query is the anchor of each shard, threads are divided between the shards
+            self.assertEqual(names[0], 'query')
+            self.assertIn('--cpu 1', params)
+        self.assertEqual(list(scores.seq_name), [r.id for r in self.records])
+        self.assertEqual(list(scores.bit_sc), [3.0] + [float(i % 5) for i in range(25)])
+        self.assertEqual(list(scores.index), list(range(26)))
+
+    def test_single_shard(self):
+        fake = FakeCmalign()
+        scores = self._scores(fake, threads=4)
+        # less hits than the minimal shard
+        self.assertEqual(len(fake.calls), 1)
+        self.assertIn('--cpu 4', fake.calls[0][1])
+        self.assertEqual(list(scores.seq_name), [r.id for r in self.records])
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,70 @@
+import unittest
+from argparse import Namespace
+from unittest import mock
+
+from Bio.Blast.Record import HSP
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from rna_blast_analyze.BR_core import expand_by_joined_pred_with_rsearch as meta
+from rna_blast_analyze.BR_core import infer_homology
+from rna_blast_analyze.BR_core.BA_methods import BlastSearchRecompute
+from rna_blast_analyze.BR_core.BA_support import Subsequences
+from test_func.test_infer_homology import FakeCmalign
+
+
+def _hit(i, extension):
+    hsp = HSP()
+    hsp.expect, hsp.bits, hsp.align_length = 1e-5, 30.0, 10
+    source = SeqRecord(Seq('ACGU'), id='uid:{}|hit_{}'.format(i, i), annotations={'blast': ('hit_{}'.format(i), hsp)})
+    hit = Subsequences(source)
+    hit.extension = SeqRecord(Seq(extension), id=source.id, annotations={'msgs': []})
+    return hit
+
+
+def _extension(extensions):
+    """Fake extension core, returns the given extension (None for failed) of each hit."""
+    def extend(analyzed_hits, *args, infer=True, **kwargs):
+        assert not infer
+        for i, ext in enumerate(extensions):
+            if ext is None:
+                analyzed_hits.hits_failed.append(_hit(i, 'A'))
+            else:
+                analyzed_hits.hits.append(_hit(i, ext))
+        return analyzed_hits, None, None, None
+    return extend
+
+
+class TestMetaPipeline(unittest.TestCase):
+    def test_single_cmalign(self):
+        args = Namespace(
+            config_file=None, repredict_file=None, threads=2, cm_file='model.cm', use_rfam=False, prediction_method=[],
+        )
+        analyzed_hits = BlastSearchRecompute(args, SeqRecord(Seq('GGGG'), id='query'), 0)
+        # bit score is the number of G
+        simple = _extension(['GAAA', 'GGGA', 'AAAA', None])
+        locarna = _extension(['GGAA', 'GAAA', None, None])
+
+        fake = FakeCmalign()
+        with mock.patch.object(meta, 'extend_simple_core', simple), \
+                mock.patch.object(meta, 'extend_locarna_core', locarna), \
+                mock.patch.object(infer_homology, 'run_cmalign_on_fasta', fake):
+            analyzed_hits, prediction, homol_seqs, cm_file = meta.extend_meta_core(
+                analyzed_hits, analyzed_hits.query, args, [], False, 0, 'model.cm'
+            )
+
+        # all extensions of both methods are scored at once
+        self.assertEqual(len(fake.calls), 1)
+        self.assertEqual(len(fake.calls[0][0]), 6)
+        self.assertEqual(cm_file, 'model.cm')
+
+        self.assertEqual([str(h.extension.seq) for h in analyzed_hits.hits], ['GGAA', 'GGGA', 'AAAA'])
+        self.assertEqual(prediction, [True, True, False])
+        self.assertEqual([h.extension.annotations['cmstat']['seq_name'] for h in analyzed_hits.hits],
+                         ['uid:0|hit_0', 'uid:1|hit_1', 'uid:2|hit_2'])
+        self.assertEqual(analyzed_hits.query.annotations['cmstat']['bit_sc'], 4.0)
+        self.assertEqual(len(analyzed_hits.hits_failed), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
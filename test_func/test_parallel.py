@@ -0,0 +1,56 @@
+import os
+import time
+import unittest
+
+from rna_blast_analyze.BR_core import parallel
+from rna_blast_analyze.BR_core.parallel import WorkerPool, shared_pool, pool_for
+
+
+def _slow_square(x, delay=0.0):
+    time.sleep(delay)
+    return x * x
+
+
+def _nested(x):
+    # pool can't be used from the worker, the jobs must run serially
+    with pool_for(2) as pool:
+        return os.getpid(), pool.map(_slow_square, [x, x + 1])
+
+
+class TestWorkerPool(unittest.TestCase):
+    def test_order_preserved(self):
+        data = list(range(50))
+        with WorkerPool(4) as pool:
+            self.assertEqual(pool.map(_slow_square, data, desc='test'), [i * i for i in data])
+            self.assertEqual(pool.starmap(_slow_square, [(i, 0.001 * (i % 3)) for i in data]), [i * i for i in data])
+
+    def test_callback(self):
+        done = {}
+
+        def cb(i, res):
+            done[i] = res
+
+        for threads in [1, 3]:
+            done.clear()
+            with WorkerPool(threads) as pool:
+                res = pool.map(_slow_square, range(10), chunksize=1, callback=cb)
+            self.assertEqual([done[i] for i in range(10)], res)
+
+    def test_serial(self):
+        with WorkerPool(1) as pool:
+            self.assertFalse(pool.active)
+            self.assertEqual(pool.map(_slow_square, [1, 2, 3]), [1, 4, 9])
+
+    def test_shared_pool_reused(self):
+        with shared_pool(2) as spool:
+            with pool_for(8) as pool:
+                self.assertIs(pool, spool)
+            res = pool.map(_nested, [1, 2, 3])
+            for pid, r in res:
+                self.assertNotEqual(pid, os.getpid())
+            self.assertEqual([r for _, r in res], [[1, 4], [4, 9], [9, 16]])
+        self.assertIsNone(parallel._SHARED)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -110,7 +110,7 @@ class TestPredictExceptions(unittest.TestCase):
         self.assertIsNone(b)
         self.assertEqual(c, ['expected_error_rnafold'])
 
-    @mock.patch("rna_blast_analyze.BR_core.repredict_structures.run_cmemit", side_effect=exceptions.CmemitException('expected_error_cmemit', 'b'))
+    @mock.patch("rna_blast_analyze.BR_core.cm_store.run_cmemit", side_effect=exceptions.CmemitException('expected_error_cmemit', 'b'))
     def test_cmemit(self, callMock):
         self.func_args['prediction_method'] = 'rfam-centroid'
         a, b, c = repredict_structures_for_homol_seqs(**self.func_args)
@@ -0,0 +1,128 @@
+import os
+import re
+import tempfile
+import time
+import unittest
+from argparse import Namespace
+from unittest import mock
+
+from rna_blast_analyze.BR_core import luncher
+from rna_blast_analyze.BR_core.BA_support import remove_files_with_try
+from rna_blast_analyze.BR_core.cmalign import cmscan_table_from_records
+
+fwd = os.path.dirname(__file__)
+xml_single = os.path.join(fwd, 'test_data', 'web_multi_hit.xml')
+
+
+# {query id: region pool used by the query}
+_pools = {}
+
+
+def _fake_compute(args_inner, shared_list, iteration, bhp, query, multi_query, checkpoint, cmscan_result=None,
+                  region_pool=None):
+    _pools[query.id] = region_pool.result()
+    # later queries finish first
+    time.sleep(0.05 * (3 - iteration))
+    if query.id == 'query_1':
+        raise SystemExit(1)
+    model = cmscan_result['target_name'][0] if cmscan_result is not None else None
+    return 'hits {} {} {}'.format(query.id, args_inner.threads, model), 'line {}'.format(iteration)
+
+
+class FakeScan(object):
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, query_file, iterations, threads=None):
+        self.calls.append((list(iterations), threads))
+        return {
+            i: cmscan_table_from_records(
+                [{'target_name': 'model_{}'.format(i), 'score': 10.0, 'E-value': 1e-5}], 'query_{}'.format(i)
+            ) for i in iterations
+        }
+
+
+class FakePrefetch(object):
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, args_inner, queries, genome_db=None):
+        self.calls.append([query.id for _, query in queries])
+        return 'pool_{}'.format(len(self.calls))
+
+
+class TestQueryScheduler(unittest.TestCase):
+    def setUp(self):
+        fd, self.xml = tempfile.mkstemp(prefix='rba_', suffix='_t64')
+        os.close(fd)
+        fd, self.query = tempfile.mkstemp(prefix='rba_', suffix='_t65')
+        os.close(fd)
+        self._write_input(['query_0', 'query_1', 'query_2'])
+
+        self.args = Namespace(blast_in=self.xml, blast_query=self.query, b_type='xml', sha1='0123456789abcdef', threads=6,
+                              db_type='blastdb')
+        self.saved = '{}.r-{}'.format(self.xml, self.args.sha1[:10])
+
+    def _write_input(self, names):
+        """multi query xml made of renamed copies of a single query iteration and matching query fasta"""
+        with open(xml_single, 'r') as f:
+            xml = f.read()
+        head, rest = xml.split('<Iteration>', 1)
+        iteration, tail = rest.split('</Iteration>', 1)
+        iterations = [
+            '<Iteration>' + re.sub(r'<Iteration_query-def>[^<]*', '<Iteration_query-def>' + name, iteration)
+            + '</Iteration>' for name in names
+        ]
+        with open(self.xml, 'w') as f:
+            f.write(head + '\n'.join(iterations) + tail)
+        with open(self.query, 'w') as f:
+            for name in names:
+                f.write('>{}\nACGUACGUACGUACGUAC\n'.format(name))
+
+    def tearDown(self):
+        remove_files_with_try([self.xml, self.query, self.saved, self.saved + '.idx'])
+
+    def _run(self, scan, prefetch=None):
+        with mock.patch.object(luncher, '_compute_query', _fake_compute), \
+                mock.patch.object(luncher, 'scan_queries', scan), \
+                mock.patch.object(luncher, 'prefetch_regions', prefetch or FakePrefetch()):
+            return luncher._lunch_computation(self.args, [])
+
+    def test_order_and_isolation(self):
+        scan = FakeScan()
+        out_line, analyzed = self._run(scan)
+
+        # failed query is left out, the others are in the query order with threads divided between queries
+        self.assertEqual(analyzed, ['hits query_0 2 model_0', 'hits query_2 2 model_2'])
+        self.assertEqual(out_line, 'line 0\nline 2')
+
+        # all queries are searched with one cmscan call using all threads
+        self.assertEqual(scan.calls, [([0, 1, 2], 6)])
+
+    def test_cmscan_checkpoint(self):
+        self._run(FakeScan())
+
+        # the tables of not completed queries are loaded from the checkpoint
+        scan = FakeScan()
+        _, analyzed = self._run(scan)
+        self.assertEqual(scan.calls, [])
+        self.assertEqual(analyzed, ['hits query_0 2 model_0', 'hits query_2 2 model_2'])
+
+    def test_region_prefetch(self):
+        # two queries computed at once, the regions are retrieved for two queries at once
+        self.args.threads = 2
+        prefetch = FakePrefetch()
+        _pools.clear()
+        self._run(FakeScan(), prefetch)
+        self.assertEqual(prefetch.calls, [['query_0', 'query_1'], ['query_2']])
+        self.assertEqual(_pools, {'query_0': 'pool_1', 'query_1': 'pool_1', 'query_2': 'pool_2'})
+
+    def test_single_query_failure(self):
+        self._write_input(['query_1'])
+
+        with self.assertRaises(SystemExit):
+            self._run(FakeScan())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import unittest
+
+from Bio import SeqIO
+
+from rna_blast_analyze.BR_core.extend_hits import BlastdbRegionPool
+
+fwd = os.path.dirname(__file__)
+blast_db = os.path.join(fwd, 'test_data', 'blastdb', 'db1')
+# fasta file the blast database was built from
+source_fasta = os.path.join(fwd, 'test_data', 'blastdb', 'db1.fa')
+
+
+class TestBlastdbRegionPool(unittest.TestCase):
+    def test_merge_overlapping_regions(self):
+        pool = BlastdbRegionPool(blast_db)
+        pool.add('A', 1, 10)
+        pool.add('A', 5, 20)
+        pool.add('A', 21, 25)
+        pool.add('A', 40, 50)
+        pool.add('B', 3, 8)
+        self.assertEqual(
+            pool._merged_regions(),
+            [('A', 1, 25), ('A', 40, 50), ('B', 3, 8)]
+        )
+
+    def test_regions_equal_to_source_fasta(self):
+        with open(source_fasta, 'r') as fh:
+            source = {rec.id: rec for rec in SeqIO.parse(fh, format='fasta')}
+
+        regions = [
+            ('LT111111.1', 1, 20),
+            ('LT111111.1', 10, 30),
+            # trimmed to the sequence length (50) as by blastdbcmd -entry -range
+            ('LT111111.1', 25, 200),
+            ('LT111112.1', 5, 15),
+        ]
+        pool = BlastdbRegionPool(blast_db, threads=2)
+        for r in regions:
+            pool.add(*r)
+        pool.fetch_all()
+
+        for acc, start, end in regions:
+            ref = source[acc]
+            ref_seq = str(ref.seq)[start - 1:end]
+            rec = pool.get(acc, start, end)
+            self.assertEqual(str(rec.seq).upper(), ref_seq.upper())
+            self.assertEqual(rec.id, '{}:{}-{}'.format(acc, start, start + len(ref_seq) - 1))
+            self.assertEqual(rec.description, ref.description[len(ref.id):].strip())
+
+    def test_missing_accession(self):
+        pool = BlastdbRegionPool(blast_db)
+        pool.add('LT111111.1', 1, 20)
+        pool.add('NOTINDB.1', 1, 20)
+        pool.fetch_all()
+        self.assertTrue(pool.has_accession('LT111111.1'))
+        self.assertFalse(pool.has_accession('NOTINDB.1'))
+
+        # missing accession is not requested again
+        pool.add('NOTINDB.1', 1, 20)
+        self.assertEqual(pool.pending, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
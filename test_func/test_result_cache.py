@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from rna_blast_analyze.BR_core.result_cache import ResultCache, cache_key
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='rba_')
+        self.dbfile = os.path.join(self.tmpdir, 'test.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_put(self):
+        cache = ResultCache(self.dbfile)
+        key = cache_key('ACGU', '-p 1', 7)
+        self.assertNotEqual(key, cache_key('ACGU', '-p 1', 8))
+        self.assertIsNone(cache.get(key))
+        cache.put(key, 'Score: 10\nquery ACGU\n')
+        cache.close()
+
+        # persistent across runs
+        cache = ResultCache(self.dbfile)
+        self.assertEqual(cache.get(key), 'Score: 10\nquery ACGU\n')
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['entries'], 1)
+        cache.close()
+
+    def test_eviction(self):
+        cache = ResultCache(self.dbfile, max_size=10**9)
+        values = [os.urandom(500).hex() for _ in range(4)]
+        for i, v in enumerate(values):
+            cache.put(str(i), v)
+        # make the first entry recently used
+        cache.get('0')
+
+        cache.max_size = cache.size() - 1
+        cache.put('4', values[0])
+        self.assertIsNotNone(cache.get('0'))
+        self.assertIsNone(cache.get('1'))
+        self.assertLessEqual(cache.size(), cache.max_size)
+        cache.close()
+
+    def test_clear(self):
+        cache = ResultCache(self.dbfile)
+        cache.put('a', 'x')
+        cache.get('a')
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats()['hits'], 0)
+        cache.close()
+
+    def test_running_size(self):
+        cache = ResultCache(self.dbfile)
+        for i in range(5):
+            cache.put(str(i % 3), os.urandom(100 + i).hex())
+        self.assertEqual(cache.size(), sum(r[0] for r in cache.con.execute("SELECT size FROM entries;")))
+        cache.prune(1)
+        self.assertEqual(cache.size(), 0)
+        cache.close()
+
+    def test_lookups_batched(self):
+        cache = ResultCache(self.dbfile)
+        cache.put('a', 'x')
+        changes = cache.con.total_changes
+        for key in ['a', 'b', 'a']:
+            cache.get(key)
+        # lookups are not written to the file until close
+        self.assertEqual(cache.con.total_changes, changes)
+        self.assertEqual(cache.stats()['hits'], 2)
+        cache.close()
+
+        cache = ResultCache(self.dbfile)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import numpy as np
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from rna_blast_analyze.BR_core import repredict_structures
+
+
+class TestSharedPrerequisites(unittest.TestCase):
+    def setUp(self):
+        self.query = SeqRecord(Seq('ACGU'), id='query')
+        self.hits = [SeqRecord(Seq('ACGA'), id='uid:0|a'), SeqRecord(Seq('ACGG'), id='uid:1|b')]
+        self.result = (np.ones((2, 2)), self.hits, ['msg'])
+
+    def test_selection_computed_once(self):
+        with mock.patch.object(repredict_structures, '_trusted_hits_selection', return_value=self.result) as sel:
+            with repredict_structures.shared_prerequisites():
+                with ThreadPoolExecutor(4) as executor:
+                    futures = [
+                        executor.submit(
+                            repredict_structures._trusted_hits_selection_wrapper, self.hits, self.query, 0.0, None
+                        ) for _ in range(4)
+                    ]
+                    results = [f.result() for f in futures]
+                # different parameters are computed again
+                repredict_structures._trusted_hits_selection_wrapper(self.hits, self.query, 1.0, None)
+            self.assertEqual(sel.call_count, 2)
+
+            # outside of the context nothing is shared
+            repredict_structures._trusted_hits_selection_wrapper(self.hits, self.query, 0.0, None)
+            self.assertEqual(sel.call_count, 3)
+
+        # each caller gets own copy
+        results[0][2].append('other')
+        self.assertEqual(results[1][2], ['msg'])
+        self.assertIsNot(results[0][1][0], results[1][1][0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from rna_blast_analyze.BR_core.structure_cache import prediction_context, structure_key, record_from_cache
+
+
+class TestStructureCache(unittest.TestCase):
+    def setUp(self):
+        self.query = SeqRecord(Seq('ACGUACGUACGU'), id='query')
+        self.hits = [SeqRecord(Seq('ACGUACGA'), id='uid:0|a'), SeqRecord(Seq('ACGUAAGA'), id='uid:1|b')]
+
+    def test_context(self):
+        other_hits = self.hits[:1]
+        # rnafold does not depend on other sequences
+        self.assertEqual(
+            prediction_context('rnafold', self.query, self.hits, None),
+            prediction_context('rnafold', self.query, other_hits, None),
+        )
+        self.assertNotEqual(
+            prediction_context('C-A-sub', self.query, self.hits, None),
+            prediction_context('C-A-sub', self.query, other_hits, None),
+        )
+        # order of hits does not matter
+        self.assertEqual(
+            prediction_context('C-A-sub', self.query, self.hits, None),
+            prediction_context('C-A-sub', self.query, self.hits[::-1], None),
+        )
+
+    def test_key(self):
+        context = prediction_context('rnafold', self.query, self.hits, None)
+        a = structure_key(self.hits[0], 'rnafold', 'abc', context)
+        self.assertNotEqual(a, structure_key(self.hits[1], 'rnafold', 'abc', context))
+        self.assertNotEqual(a, structure_key(self.hits[0], 'rnafold', 'abd', context))
+
+        rec = record_from_cache(self.hits[0], '((....))')
+        self.assertEqual(rec.letter_annotations['ss0'], '((....))')
+        self.assertEqual(rec.id, self.hits[0].id)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import shutil
+import subprocess
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from rna_blast_analyze.BR_core.config import CONFIG
+from rna_blast_analyze.BR_core.exceptions import RNAplotException
+from rna_blast_analyze.BR_core.output import structure_pictures
+from rna_blast_analyze.BR_core.output.htmloutput import _prepare_pictures
+
+
+class FakeRNAplot(object):
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, seq, structure):
+        with self.lock:
+            self.calls.append((seq, structure))
+        if structure.startswith(')'):
+            raise RNAplotException('RNAplot failed', '')
+        return '<svg>{} {}</svg>'.format(seq, structure)
+
+
+class TestStructurePictures(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='rba_')
+        self.records = []
+        for i in range(4):
+            rec = SeqRecord(Seq('ACGUACGU' if i % 2 else 'GGGAAACC'), id='uid:{}|hit'.format(i))
+            rec.letter_annotations['rnafold'] = '((....))'
+            rec.letter_annotations['centroid'] = '........'
+            self.records.append(rec)
+        self.records[0].letter_annotations['broken'] = ')(......'
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def _render(self, fake):
+        with mock.patch.dict(CONFIG.data_paths, {'cache_dir': self.cache_dir}), \
+                mock.patch.object(structure_pictures, 'rnaplot_svg', fake):
+            return structure_pictures.render_pictures(self.records, threads=3)
+
+    def test_dedup_and_cache(self):
+        fake = FakeRNAplot()
+        pictures = self._render(fake)
+        # 2 sequences x 2 structures + the broken one, each drawn once
+        self.assertEqual(len(fake.calls), 5)
+        self.assertEqual(len(set(fake.calls)), 5)
+        self.assertEqual(pictures[('GGGAAACC', '((....))')], '<svg>GGGAAACC ((....))</svg>')
+        self.assertIsNone(pictures[('GGGAAACC', ')(......')])
+
+        # the second run takes the pictures from the cache, failed ones are tried again
+        fake = FakeRNAplot()
+        self.assertEqual(self._render(fake), pictures)
+        self.assertEqual(fake.calls, [('GGGAAACC', ')(......')])
+
+    def test_prepare_pictures(self):
+        pictures = self._render(FakeRNAplot())
+        pics = _prepare_pictures(self.records[0], pictures)
+        self.assertEqual([p['picname'] for p in pics], ['rnafold', 'centroid'])
+        self.assertTrue(pics[0]['pic'].startswith('data:image/svg+xml;utf8,<svg>'))
+
+        # lazy mode, structures are drawn by the browser
+        pics = _prepare_pictures(self.records[0], None)
+        self.assertEqual([p['picname'] for p in pics], ['rnafold', 'centroid', 'broken'])
+        self.assertIsNone(pics[0]['pic'])
+
+    def test_rnaplot_unavailable(self):
+        errors = [FileNotFoundError('RNAplot'), subprocess.TimeoutExpired('RNAplot', 1)]
+        for error in errors:
+            pictures = self._render(mock.Mock(side_effect=error))
+            self.assertEqual(len(pictures), 5)
+            self.assertTrue(all(p is None for p in pictures.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -30,3 +30,11 @@ class TestNR(unittest.TestCase):
             nr = BA_support.non_redundant_seqs(seqs_list)
             self.assertEqual(len(nr), len(check_n), 'length do not match')
             self.assertEqual({str(seq.seq) for seq in nr}, check_n)
+
+    def test_dedup(self):
+        for seqs_list, check_n in self.test_cases:
+            unique, positions = BA_support.dedup_seqs(seqs_list)
+            self.assertEqual(len(unique), len(check_n))
+            self.assertEqual(len(positions), len(seqs_list))
+            for seq, p in zip(seqs_list, positions):
+                self.assertEqual(str(unique[p].seq), str(seq.seq))
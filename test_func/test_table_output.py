@@ -0,0 +1,119 @@
+import os
+import tempfile
+import unittest
+from argparse import Namespace
+
+from Bio.Blast.Record import HSP
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from rna_blast_analyze.BR_core.BA_methods import BlastSearchRecompute
+from rna_blast_analyze.BR_core.BA_support import Subsequences, remove_files_with_try
+from rna_blast_analyze.BR_core.output import table_output
+
+try:
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+def _analyzed_hits(iteration, n_hits):
+    query = SeqRecord(Seq('ACGUACGUAC'), id='query_{}'.format(iteration))
+    bsr = BlastSearchRecompute(Namespace(prediction_method=['rnafold', 'centroid']), query, iteration)
+    for i in range(n_hits):
+        hsp = HSP()
+        hsp.expect, hsp.bits = 10.0 ** -i, 20.0 + i
+        hsp.query_start, hsp.query_end, hsp.sbjct_start, hsp.sbjct_end = 1, 10, 100 + i, 109 + i
+        source = SeqRecord(
+            Seq('ACGUACGUAC'), id='uid:{}|hit_{}'.format(i, i),
+            annotations={'blast': ('hit_{}'.format(i), hsp), 'extended_start': 100 + i, 'extended_end': 109 + i}
+        )
+        hit = Subsequences(source)
+        hit.best_start, hit.best_end = 1, 10
+        hit.extension = SeqRecord(
+            Seq('ACGUACGUAC'), id=source.id, annotations={'score': None, 'msgs': []},
+            letter_annotations={'rnafold': '((....))..'}
+        )
+        bsr.hits.append(hit)
+    return bsr
+
+
+class TestExportPandas(unittest.TestCase):
+    def test_columns(self):
+        df = _analyzed_hits(0, 3).export_pandas_results()
+        self.assertEqual(
+            list(df.columns),
+            [
+                'blast_query', 'subject', 'bstart', 'bend', 'blast_bits', 'best_sequence', 'estart', 'eend',
+                'blast_eval', 'query_start', 'query_end', 'b_e_start', 'b_e_end', 'locarna_score', 'rnafold',
+                'centroid',
+            ]
+        )
+        self.assertEqual(list(df['bstart']), [100, 101, 102])
+        self.assertEqual(list(df['blast_eval']), [1.0, 0.1, 0.01])
+        self.assertEqual(set(df['rnafold']), {'((....))..'})
+        self.assertEqual(set(df['centroid']), {'PREDICTION FAILED'})
+
+    def test_empty(self):
+        df = _analyzed_hits(0, 0).export_pandas_results()
+        self.assertEqual(len(df), 0)
+        self.assertIn('rnafold', df.columns)
+
+
+@unittest.skipIf(pyarrow is None, 'pyarrow not installed')
+class TestTableOutput(unittest.TestCase):
+    def setUp(self):
+        self.files = []
+
+    def tearDown(self):
+        remove_files_with_try(self.files)
+
+    def _tmp(self, suffix):
+        fd, path = tempfile.mkstemp(prefix='rba_', suffix=suffix)
+        os.close(fd)
+        self.files.append(path)
+        return path
+
+    def test_parquet_row_groups(self):
+        path = self._tmp('_t70.parquet')
+        with table_output.shared_table_writers():
+            _analyzed_hits(1, 3).to_table(path)
+            writer = table_output._SHARED.writers[path]
+            # waits for query 0
+            self.assertEqual(len(writer._pending), 1)
+            _analyzed_hits(0, 2).to_table(path)
+            self.assertEqual(len(writer._pending), 1)
+            table_output.query_finished(0)
+            self.assertEqual(writer._pending, [])
+            _analyzed_hits(3, 1).to_table(path)
+            table_output.query_finished(1)
+            # query 2 did not finish, the following tables are written on close
+            self.assertEqual(len(writer._pending), 1)
+
+        pq = pyarrow.parquet.ParquetFile(path)
+        self.assertEqual(pq.metadata.num_row_groups, 3)
+        table = pq.read()
+        # row groups are in the order of the queries, not in the order they finished
+        self.assertEqual(table.column('iteration').to_pylist(), [0, 0, 1, 1, 1, 3])
+        self.assertEqual(table.schema.field('bstart').type, pyarrow.int64())
+        self.assertEqual(table.schema.field('locarna_score').type, pyarrow.float64())
+        self.assertEqual(table.column('blast_query').to_pylist()[0], 'query_0')
+
+    def test_arrow_single(self):
+        path = self._tmp('_t71.arrow')
+        _analyzed_hits(0, 2).to_table(path)
+
+        with pyarrow.OSFile(path, 'rb') as f:
+            reader = pyarrow.ipc.open_file(f)
+            self.assertEqual(reader.num_record_batches, 1)
+            self.assertEqual(reader.read_all().num_rows, 2)
+
+    def test_unknown_format(self):
+        self.assertIsNone(table_output.table_format('out.csv'))
+        with self.assertRaises(ValueError):
+            table_output.TableWriter('out.csv')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import random
+import unittest
+from unittest import mock
+
+try:
+    import RNA
+    from rna_blast_analyze.BR_core import par_distance_efective
+except ImportError:
+    RNA = None
+
+from rna_blast_analyze.BR_core import par_distance_no_RNAlib
+from rna_blast_analyze.BR_core.exceptions import ParsingError
+from rna_blast_analyze.BR_core.tree_distance import FullTree, tree_edit_distance, bp_distance, DistanceEngine, \
+    group_by_reference
+
+
+class TestTreeDistance(unittest.TestCase):
+    def setUp(self):
+        self.ref = "(((((...((((.........)))).(((((.......))))).....(((((.......))))).))))).."
+        # suboptimal structures of tRNA and distances computed by RNAlib (tree_edit_distance, bp_distance)
+        self.subopt = [
+            ("(((((...((((.........)))).(((((.......))))).....(((((.......))))).)))))..", 0, 0),
+            ("(((((...((((.(((.((..((.(.(((((.......))))).).))..)).)))))))......)))))..", 48, 21),
+            ("(((((..(((((.(((.((..((.(.(((((.......))))).).))..)).)))))).))....)))))..", 52, 22),
+            ("((((((..((((.........)))).(((((.......))))).....(((((.......)))))))))))..", 4, 1),
+            ("((((((...(((.(((.((..((.(.(((((.......))))).).))..)).))))))......))))))..", 48, 21),
+        ]
+
+    def test_simple(self):
+        for s1, s2, d in [
+            ('((...))', '.......', 8),
+            ('(.)', '...', 4),
+            ('((.))', '(...)', 4),
+            ('..', '...', 1),
+            ('()', '..', 2),
+            ('(((...)))', '((.....))', 4),
+            ('((..)).((..))', '((........))', 13),
+        ]:
+            self.assertEqual(tree_edit_distance(FullTree(s1), FullTree(s2)), d)
+            self.assertEqual(tree_edit_distance(FullTree(s2), FullTree(s1)), d)
+
+    def test_engine(self):
+        engine = DistanceEngine(self.ref)
+        structures = [s for s, _, _ in self.subopt]
+        self.assertEqual(engine.tree_edit_distances(structures), [d for _, d, _ in self.subopt])
+        # repeated call reuses computed distances
+        self.assertEqual(engine.tree_edit_distances(structures[::-1]), [d for _, d, _ in self.subopt][::-1])
+        self.assertEqual(engine.bp_distances(structures), [b for _, _, b in self.subopt])
+        self.assertEqual(bp_distance(self.ref, structures[1]), 21)
+
+    def test_unbalanced(self):
+        for s in ['((..)', '(..))', ')(']:
+            with self.assertRaises(ParsingError):
+                FullTree(s)
+
+    def test_group_by_reference(self):
+        pairs = [('a', '1'), ('b', '2'), ('a', '3')]
+        self.assertEqual(group_by_reference(pairs), [('a', ['1', '3'], [0, 2]), ('b', ['2'], [1])])
+
+    def test_compute_distances_without_rnadistance(self):
+        pairs = [(self.ref, s) for s, _, _ in self.subopt] + [('((...))', '.......')]
+        with mock.patch.object(par_distance_no_RNAlib.shutil, 'which', return_value=None):
+            dist = par_distance_no_RNAlib.compute_distances(pairs)
+        self.assertEqual(dist, [d for _, d, _ in self.subopt] + [8])
+
+    @unittest.skipIf(RNA is None, 'RNAlib is not available')
+    def test_same_as_rnalib(self):
+        rng = random.Random(0)
+        for _ in range(5):
+            seq = ''.join(rng.choice('ACGU') for _ in range(120))
+            reference = RNA.fold(''.join(rng.choice('ACGU') for _ in range(120)))[0]
+            structures = [s.structure for s in RNA.fold_compound(seq).subopt(300)][:50]
+            self.assertEqual(
+                DistanceEngine(reference).tree_edit_distances(structures),
+                par_distance_efective.run_RNAdistance_batch(reference, structures)
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()